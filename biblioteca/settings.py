@@ -10,6 +10,8 @@ For the full list of settings and their values, see
 https://docs.djangoproject.com/en/5.2/ref/settings/
 """
 
+import os
+from datetime import timedelta
 from pathlib import Path
 
 # Build paths inside the project like this: BASE_DIR / 'subdir'.
@@ -44,6 +46,7 @@ INSTALLED_APPS = [
 ]
 
 MIDDLEWARE = [
+    'gestion.presupuesto.presupuesto_consultas',
     'django.middleware.security.SecurityMiddleware',
     'django.contrib.sessions.middleware.SessionMiddleware',
     'django.middleware.common.CommonMiddleware',
@@ -51,6 +54,7 @@ MIDDLEWARE = [
     'django.contrib.auth.middleware.AuthenticationMiddleware',
     'django.contrib.messages.middleware.MessageMiddleware',
     'django.middleware.clickjacking.XFrameOptionsMiddleware',
+    'gestion.replica.marcar_escrituras',
 ]
 
 ROOT_URLCONF = 'biblioteca.urls'
@@ -65,6 +69,7 @@ TEMPLATES = [
                 'django.template.context_processors.request',
                 'django.contrib.auth.context_processors.auth',
                 'django.contrib.messages.context_processors.messages',
+                'cuentas.context_processors.rol',
             ],
         },
     },
@@ -80,9 +85,130 @@ DATABASES = {
     'default': {
         'ENGINE': 'django.db.backends.sqlite3',
         'NAME': BASE_DIR / 'db.sqlite3',
+        # Base de pruebas en archivo (no en memoria compartida) para que las
+        # pruebas con hilos concurrentes se comporten como en producción
+        'TEST': {
+            'NAME': BASE_DIR / 'test_db.sqlite3',
+        },
     }
 }
 
+# Perfil de SQLite. BIBLIOTECA_SQLITE=desarrollo (por defecto) | produccion
+# produccion: PRAGMAS aplicadas al abrir cada conexión (gestion/base_datos.py),
+# transacciones con BEGIN IMMEDIATE y conexiones persistentes. Con un servidor
+# ASGI dejar BIBLIOTECA_CONN_MAX_AGE=0: cada petición corre en su propio hilo.
+
+BIBLIOTECA_SQLITE = os.environ.get('BIBLIOTECA_SQLITE', 'desarrollo')
+
+SQLITE_PRODUCCION = {
+    'OPTIONS': {
+        # atomic() toma el bloqueo de escritura al empezar: un escritor espera
+        # su turno (busy_timeout) en vez de fallar al pasar de lectura a escritura
+        'transaction_mode': 'IMMEDIATE',
+    },
+    'PRAGMAS': {
+        'journal_mode': 'WAL',       # los lectores no esperan a los escritores
+        'busy_timeout': 5000,        # ms esperando un bloqueo antes de "database is locked"
+        'synchronous': 'NORMAL',     # seguro con WAL; solo el checkpoint hace fsync
+        'mmap_size': 268435456,      # 256 MB leídos vía mmap
+        'cache_size': -65536,        # 64 MB de caché de páginas por conexión
+        'temp_store': 'MEMORY',      # ordenamientos e índices temporales en memoria
+    },
+    'CONN_MAX_AGE': int(os.environ.get('BIBLIOTECA_CONN_MAX_AGE', 600)),
+    'CONN_HEALTH_CHECKS': True,
+}
+
+if BIBLIOTECA_SQLITE == 'produccion':
+    DATABASES['default'].update(SQLITE_PRODUCCION)
+
+# Réplica de solo lectura para los reportes (gestion/replica.py), activada con
+# BIBLIOTECA_REPLICA=1. Es una copia que refresca `manage.py refrescar_replica`
+# (cron, p. ej. cada minuto); mientras no exista se lee de la principal.
+
+if os.environ.get('BIBLIOTECA_REPLICA') == '1':
+    DATABASES['replica'] = {
+        'ENGINE': 'django.db.backends.sqlite3',
+        'NAME': os.environ.get('BIBLIOTECA_REPLICA_RUTA', BASE_DIR / 'db_replica.sqlite3'),
+        'PRAGMAS': {
+            'query_only': 'ON',
+            'busy_timeout': 5000,
+            'mmap_size': 268435456,
+            'cache_size': -65536,
+            'temp_store': 'MEMORY',
+        },
+        'CONN_MAX_AGE': DATABASES['default'].get('CONN_MAX_AGE', 0),
+        'CONN_HEALTH_CHECKS': True,
+        'TEST': {'MIRROR': 'default'},
+    }
+
+DATABASE_ROUTERS = ['gestion.replica.EnrutadorReplica']
+
+# Tras una escritura el cliente lee de la principal durante estos segundos
+REPLICA_SEGUNDOS_TRAS_ESCRITURA = 120
+
+# Presupuesto de consultas SQL por petición (gestion/presupuesto.py): las peticiones
+# que lo exceden se avisan en el logger gestion.presupuesto. Ajustes por vista
+# (nombre de la URL o espacio de nombres) en PRESUPUESTO_CONSULTAS_VISTAS
+
+PRESUPUESTO_CONSULTAS = {'consultas': 12, 'duplicadas': 1, 'milisegundos': 250}
+PRESUPUESTO_CONSULTAS_VISTAS = {
+    # Devolución con multa: movimiento, saldo del lector (la primera vez se crea) y contadores
+    'registrar_devolucion': {'consultas': 25, 'duplicadas': 2},
+    # Lote de kiosco: consultas por conjunto, no por operación
+    'sincronizar_kiosco': {'consultas': 30},
+    # El admin de Django repite lecturas del objeto (formularios, inlines, permisos)
+    'admin': {'consultas': 30, 'duplicadas': 10},
+}
+
+LOGGING = {
+    'version': 1,
+    'disable_existing_loggers': False,
+    'handlers': {
+        'consola': {'class': 'logging.StreamHandler'},
+    },
+    'loggers': {
+        'gestion.presupuesto': {'handlers': ['consola'], 'level': 'WARNING', 'propagate': False},
+    },
+}
+
+
+# Caché (catálogo de libros, ver gestion/cache_catalogo.py)
+# BIBLIOTECA_CACHE=locmem (por defecto) | archivo | redis
+
+BIBLIOTECA_CACHE = os.environ.get('BIBLIOTECA_CACHE', 'locmem')
+
+if BIBLIOTECA_CACHE == 'archivo':
+    CACHES = {
+        'default': {
+            'BACKEND': 'django.core.cache.backends.filebased.FileBasedCache',
+            'LOCATION': os.environ.get('BIBLIOTECA_CACHE_DIR', str(BASE_DIR / 'cache')),
+        }
+    }
+elif BIBLIOTECA_CACHE == 'redis':
+    CACHES = {
+        'default': {
+            'BACKEND': 'django.core.cache.backends.redis.RedisCache',
+            'LOCATION': os.environ.get('REDIS_URL', 'redis://127.0.0.1:6379/1'),
+        }
+    }
+else:
+    CACHES = {
+        'default': {
+            'BACKEND': 'django.core.cache.backends.locmem.LocMemCache',
+            'LOCATION': 'biblioteca',
+        }
+    }
+
+# Segundos que dura una entrada del catálogo (además de la invalidación por generación)
+CATALOGO_CACHE_SEGUNDOS = 300
+
+
+# Autenticación: el usuario se carga junto con su perfil (un JOIN por petición)
+
+AUTHENTICATION_BACKENDS = [
+    'cuentas.backends.BackendConPerfil',
+]
+
 
 # Password validation
 # https://docs.djangoproject.com/en/5.2/ref/settings/#auth-password-validators
@@ -123,6 +249,41 @@ STATICFILES_DIRS = [
     BASE_DIR / "biblioteca" / "static"
 ]
 
+# Django REST Framework / SimpleJWT
+
+REST_FRAMEWORK = {
+    'DEFAULT_AUTHENTICATION_CLASSES': [
+        'rest_framework_simplejwt.authentication.JWTAuthentication',
+        'rest_framework.authentication.SessionAuthentication',
+    ],
+    'DEFAULT_PERMISSION_CLASSES': [
+        'rest_framework.permissions.IsAuthenticated',
+    ],
+    'DEFAULT_PAGINATION_CLASS': 'gestion.paginacion.PaginacionCursorAPI',
+    'PAGE_SIZE': 25,
+}
+
+SIMPLE_JWT = {
+    'ACCESS_TOKEN_LIFETIME': timedelta(minutes=30),
+    'REFRESH_TOKEN_LIFETIME': timedelta(days=7),
+}
+
+# Correo (recordatorios de préstamo). Por defecto se escribe en consola; en
+# producción EMAIL_BACKEND=django.core.mail.backends.smtp.EmailBackend y EMAIL_HOST etc.
+
+EMAIL_BACKEND = os.environ.get('EMAIL_BACKEND', 'django.core.mail.backends.console.EmailBackend')
+EMAIL_HOST = os.environ.get('EMAIL_HOST', 'localhost')
+EMAIL_PORT = int(os.environ.get('EMAIL_PORT', 25))
+EMAIL_HOST_USER = os.environ.get('EMAIL_HOST_USER', '')
+EMAIL_HOST_PASSWORD = os.environ.get('EMAIL_HOST_PASSWORD', '')
+EMAIL_USE_TLS = os.environ.get('EMAIL_USE_TLS', '') == '1'
+DEFAULT_FROM_EMAIL = os.environ.get('DEFAULT_FROM_EMAIL', 'biblioteca@localhost')
+
+RECORDATORIO_DIAS_ANTES = 2
+# Horas que una copia queda apartada para el lector que la reservó
+RESERVA_HORAS_RETIRO = 48
+
+
 # Default primary key field type
 # https://docs.djangoproject.com/en/5.2/ref/settings/#default-auto-field
 
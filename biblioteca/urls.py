@@ -23,6 +23,7 @@ urlpatterns = [
     path('admin/', admin.site.urls),
     path('', include('gestion.urls')), # Home + Dashboard
     path('', include('cuentas.urls')), # Login
+    path('api/v1/', include('gestion.api_urls')), # API REST (JWT)
 ]
 
 # Handler para error 403
@@ -0,0 +1,82 @@
+from django.contrib.auth import get_user_model
+from django.contrib.auth.backends import ModelBackend
+from django.db.models.functions import Lower
+
+UserModel = get_user_model()
+
+# Misma condición que el índice parcial de cuentas/migrations/0002_correo_unico.py;
+# debe ir literal en la consulta para que SQLite pueda usar ese índice
+CORREO_NO_VACIO = f"{UserModel._meta.db_table}.email <> ''"
+
+
+def usuarios_con_correo(email):
+    """Usuarios con ese correo sin distinguir mayúsculas (búsqueda en el índice único)"""
+    return (
+        UserModel._default_manager
+        .alias(correo=Lower("email"))
+        .filter(correo=(email or "").lower())
+        .extra(where=[CORREO_NO_VACIO])
+    )
+
+
+def correos_registrados(emails):
+    """De una lista de correos, los que ya están registrados (en minúsculas)"""
+    minusculas = {email.lower() for email in emails if email}
+    return set(
+        UserModel._default_manager
+        .alias(correo=Lower("email"))
+        .filter(correo__in=minusculas)
+        .extra(where=[CORREO_NO_VACIO])
+        .annotate(correo_min=Lower("email"))
+        .values_list("correo_min", flat=True)
+    )
+
+
+class BackendConPerfil(ModelBackend):
+    """
+    ModelBackend que acepta correo o nombre de usuario y carga el
+    PerfilUsuario junto con el usuario.
+
+    AuthenticationMiddleware obtiene request.user con get_user() (y las
+    vistas async con aget_user(), vía request.auser()), así que cada petición
+    trae usuario y perfil en una sola consulta con JOIN y los chequeos de rol
+    (cuentas/restringir.py, base.html) no consultan de nuevo.
+    """
+
+    def authenticate(self, request, username=None, password=None, **kwargs):
+        if username is None:
+            username = kwargs.get(UserModel.USERNAME_FIELD)
+        if username is None or password is None:
+            return None
+
+        # Una sola consulta: username (índice único) UNION ALL correo (índice LOWER(email))
+        candidatos = list(
+            UserModel._default_manager.filter(username=username)
+            .union(usuarios_con_correo(username), all=True)
+        )
+        # Como antes, el correo tiene prioridad sobre el nombre de usuario
+        candidatos.sort(key=lambda u: u.email.lower() != username.lower() or not u.email)
+        if not candidatos:
+            # Hash de relleno: una respuesta negativa tarda lo mismo que una contraseña incorrecta
+            UserModel().set_password(password)
+            return None
+
+        user = candidatos[0]
+        if user.check_password(password) and self.user_can_authenticate(user):
+            return user
+        return None
+
+    def get_user(self, user_id):
+        try:
+            user = UserModel._default_manager.select_related("perfil").get(pk=user_id)
+        except UserModel.DoesNotExist:
+            return None
+        return user if self.user_can_authenticate(user) else None
+
+    async def aget_user(self, user_id):
+        # ModelBackend.aget_user no pasa por get_user(): sin esto el perfil no vendría
+        try:
+            user = await UserModel._default_manager.select_related("perfil").aget(pk=user_id)
+        except UserModel.DoesNotExist:
+            return None
+        return user if self.user_can_authenticate(user) else None
@@ -0,0 +1,10 @@
+from .restringir import PERSONAL, rol_de
+
+
+def rol(request):
+    """Rol del usuario para las plantillas (navbar), sin consultas extra"""
+    rol_usuario = rol_de(request.user) if hasattr(request, "user") else None
+    return {
+        "rol_usuario": rol_usuario,
+        "es_personal": rol_usuario in PERSONAL,
+    }
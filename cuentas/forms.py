@@ -1,5 +1,7 @@
 from django import forms
-from django.contrib.auth.models import User
+from django.db import transaction
+from .backends import usuarios_con_correo
+from .usuarios import crear_usuario
 from .models import PerfilUsuario
 
 class CrearBibliotecarioForm(forms.Form):
@@ -24,7 +26,7 @@ class CrearBibliotecarioForm(forms.Form):
         # Validar que el email no esté repetido
         if not email:
             raise forms.ValidationError("El correo es obligatorio.")
-        if User.objects.filter(email=email).exists():
+        if usuarios_con_correo(email).exists():
             raise forms.ValidationError("Ese correo ya está registrado.")
         # Validar formato de correo (ya lo hace EmailField, pero por si acaso)
         if "@" not in email or "." not in email:
@@ -52,25 +54,16 @@ class CrearBibliotecarioForm(forms.Form):
     def save(self):
         data = self.cleaned_data
         email = data.get("email", "")
-        # Generar username automáticamente desde el email
-        username = email.split('@')[0].replace('.', '_')
-        contador = 1
-        username_original = username
-        while User.objects.filter(username=username).exists():
-            username = f"{username_original}{contador}"
-            contador += 1
-        user = User.objects.create_user(
-            username=username,
-            email=email,
-            password=data["password1"],
-        )
-        PerfilUsuario.objects.create(
-            usuario=user,
-            rol="bibliotecario",
-            rut=data.get("rut", ""),
-            direccion=data.get("direccion", ""),
-            telefono=data.get("telefono", ""),
-        )
+        with transaction.atomic():
+            # Username generado automáticamente desde el email
+            user = crear_usuario(email, data["password1"])
+            PerfilUsuario.objects.create(
+                usuario=user,
+                rol="bibliotecario",
+                rut=data.get("rut", ""),
+                direccion=data.get("direccion", ""),
+                telefono=data.get("telefono", ""),
+            )
         return user
     
     def __init__(self, *args, **kwargs):
@@ -0,0 +1,252 @@
+import csv
+import json
+import os
+import secrets
+import time
+from concurrent.futures import ProcessPoolExecutor
+from contextlib import ExitStack
+
+import django
+from django.contrib.auth.hashers import make_password
+from django.contrib.auth.models import User
+from django.core.exceptions import ValidationError
+from django.core.management.base import BaseCommand, CommandError
+from django.core.validators import validate_email
+from django.db import IntegrityError, transaction
+
+from cuentas.backends import correos_registrados
+from cuentas.models import PerfilUsuario
+from cuentas.usuarios import asignar_usernames
+from cuentas.validadores import limpiar_rut, validar_contrasena, validar_rut, validar_telefono
+from gestion import estadisticas
+
+REINTENTOS = 3
+
+
+def _iniciar_proceso():
+    # Con el método 'spawn' (macOS, Windows) el proceso hijo parte sin Django configurado
+    django.setup()
+
+
+def _leer(ruta, formato):
+    with open(ruta, newline='', encoding='utf-8-sig') as archivo:
+        if formato == 'csv':
+            yield from csv.DictReader(archivo)
+            return
+        for linea in archivo:
+            try:
+                yield json.loads(linea)
+            except ValueError:
+                yield None
+
+
+def _abrir_privado(ruta):
+    """Abre para escribir un archivo que solo puede leer su dueño (contiene contraseñas)"""
+    descriptor = os.open(ruta, os.O_WRONLY | os.O_CREAT | os.O_TRUNC, 0o600)
+    if hasattr(os, 'fchmod'):
+        # El modo de os.open solo aplica al crear: un archivo previo puede tener más permisos
+        os.fchmod(descriptor, 0o600)
+    return os.fdopen(descriptor, 'w', newline='')
+
+
+def _contrasena_generada():
+    # Cumple validar_contrasena: mayúscula, minúscula, número y carácter especial
+    return f'{secrets.token_urlsafe(9)}Aa1!'
+
+
+class Command(BaseCommand):
+    help = (
+        "Crea usuarios y perfiles en bloque desde un CSV o JSONL (columnas email, first_name, "
+        "last_name, rut, telefono, direccion y opcionalmente password), hasheando las "
+        "contraseñas en varios procesos"
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('archivo', help="Ruta del archivo .csv o .jsonl")
+        parser.add_argument('--formato', choices=['csv', 'jsonl'])
+        parser.add_argument('--rol', choices=['lector', 'bibliotecario'], default='lector')
+        parser.add_argument(
+            '--lote', type=int, default=1000,
+            help="Usuarios por transacción (por defecto 1000)",
+        )
+        parser.add_argument(
+            '--procesos', type=int, default=os.cpu_count() or 1,
+            help="Procesos para hashear contraseñas (por defecto, uno por núcleo)",
+        )
+        parser.add_argument(
+            '--credenciales',
+            help=(
+                "Archivo CSV donde escribir usuario y contraseña de las filas sin password; "
+                "sin esta opción esas filas se rechazan"
+            ),
+        )
+        parser.add_argument(
+            '--rechazados',
+            help="Archivo CSV donde copiar las filas rechazadas con el motivo",
+        )
+
+    def handle(self, *args, **options):
+        ruta = options['archivo']
+        if not os.path.exists(ruta):
+            raise CommandError(f"No existe el archivo '{ruta}'.")
+        formato = options['formato'] or ('jsonl' if ruta.endswith(('.jsonl', '.ndjson')) else 'csv')
+        if options['lote'] < 1 or options['procesos'] < 1:
+            raise CommandError("--lote y --procesos deben ser mayores que cero.")
+
+        self.rol = options['rol']
+        self.generar = bool(options['credenciales'])
+        self.creados = self.rechazados = 0
+        self.ruts_vistos, self.correos_vistos = set(), set()
+        self.inicio = time.monotonic()
+
+        with ExitStack() as archivos:
+            self.credenciales = self.salida_rechazados = None
+            if self.generar:
+                self.credenciales = csv.writer(archivos.enter_context(_abrir_privado(options['credenciales'])))
+                self.credenciales.writerow(['email', 'username', 'password'])
+            if options['rechazados']:
+                self.salida_rechazados = csv.writer(
+                    archivos.enter_context(open(options['rechazados'], 'w', newline=''))
+                )
+                self.salida_rechazados.writerow(['fila', 'email', 'rut', 'motivo'])
+
+            self.pool = archivos.enter_context(
+                ProcessPoolExecutor(max_workers=options['procesos'], initializer=_iniciar_proceso)
+            )
+            self.procesos = options['procesos']
+            lote = []
+            for numero, fila in enumerate(_leer(ruta, formato), start=1):
+                datos = self._validar(numero, fila)
+                if datos is not None:
+                    lote.append(datos)
+                if len(lote) >= options['lote']:
+                    self._procesar(lote)
+                    lote = []
+            self._procesar(lote)
+
+        segundos = time.monotonic() - self.inicio
+        self.stdout.write(self.style.SUCCESS(
+            f"{self.creados} usuarios creados, {self.rechazados} filas rechazadas en {segundos:.1f} s."
+        ))
+
+    def _rechazar(self, numero, fila, motivo):
+        self.rechazados += 1
+        fila = fila if isinstance(fila, dict) else {}
+        email, rut = fila.get('email') or '', fila.get('rut') or ''
+        self.stderr.write(f"Fila {numero} ({email or 'sin correo'}): {motivo}")
+        if self.salida_rechazados:
+            self.salida_rechazados.writerow([numero, email, rut, motivo])
+        return None
+
+    def _validar(self, numero, fila):
+        """Validaciones que no necesitan la base de datos (las mismas del registro)"""
+        if not isinstance(fila, dict):
+            return self._rechazar(numero, fila, "fila ilegible")
+        datos = {campo: str(fila.get(campo) or '').strip() for campo in (
+            'email', 'first_name', 'last_name', 'rut', 'telefono', 'direccion', 'password',
+        )}
+        datos['numero'] = numero
+        try:
+            validate_email(datos['email'])
+        except ValidationError:
+            return self._rechazar(numero, fila, "correo inválido")
+        if len(datos['first_name']) < 2 or len(datos['last_name']) < 2:
+            return self._rechazar(numero, fila, "nombre o apellido con menos de 2 caracteres")
+        if not validar_rut(datos['rut']):
+            return self._rechazar(numero, fila, "RUT inválido")
+        if not validar_telefono(datos['telefono']):
+            return self._rechazar(numero, fila, "el teléfono debe tener 9 dígitos")
+        if datos['password']:
+            es_valida, mensaje = validar_contrasena(datos['password'])
+            if not es_valida:
+                return self._rechazar(numero, fila, f"contraseña insegura: {mensaje}")
+        elif self.generar:
+            datos['password'] = _contrasena_generada()
+            datos['generada'] = True
+        else:
+            return self._rechazar(numero, fila, "sin contraseña (use --credenciales para generarla)")
+
+        datos['rut'] = limpiar_rut(datos['rut'])
+        correo = datos['email'].lower()
+        if datos['rut'] in self.ruts_vistos:
+            return self._rechazar(numero, fila, "RUT repetido en el archivo")
+        if correo in self.correos_vistos:
+            return self._rechazar(numero, fila, "correo repetido en el archivo")
+        self.ruts_vistos.add(datos['rut'])
+        self.correos_vistos.add(correo)
+        return datos
+
+    def _sin_duplicados_en_bd(self, lote):
+        """Rechaza las filas cuyo RUT o correo ya existe (dos consultas por lote)"""
+        ruts = set(PerfilUsuario.objects.filter(
+            rut__in=[datos['rut'] for datos in lote]
+        ).values_list('rut', flat=True))
+        correos = correos_registrados([datos['email'] for datos in lote])
+        validos = []
+        for datos in lote:
+            if datos['rut'] in ruts:
+                self._rechazar(datos['numero'], datos, "el RUT ya está registrado")
+            elif datos['email'].lower() in correos:
+                self._rechazar(datos['numero'], datos, "el correo ya está registrado")
+            else:
+                validos.append(datos)
+        return validos
+
+    def _procesar(self, lote):
+        lote = self._sin_duplicados_en_bd(lote)
+        if not lote:
+            return
+
+        # PBKDF2 es deliberadamente lento: repartirlo entre procesos escala con los núcleos
+        contrasenas = [datos['password'] for datos in lote]
+        tamano = max(1, len(contrasenas) // (self.procesos * 4))
+        hashes = list(self.pool.map(make_password, contrasenas, chunksize=tamano))
+
+        for intento in range(REINTENTOS):
+            try:
+                with transaction.atomic():
+                    usuarios = self._crear(lote, hashes)
+                break
+            except IntegrityError:
+                # Un registro web tomó el mismo username, correo o RUT: revalidar y reintentar
+                if intento == REINTENTOS - 1:
+                    raise
+                hash_de = {id(datos): hash_contrasena for datos, hash_contrasena in zip(lote, hashes)}
+                lote = self._sin_duplicados_en_bd(lote)
+                hashes = [hash_de[id(datos)] for datos in lote]
+
+        for datos, usuario in zip(lote, usuarios):
+            if self.credenciales and datos.get('generada'):
+                self.credenciales.writerow([datos['email'], usuario.username, datos['password']])
+        self.creados += len(usuarios)
+        segundos = max(time.monotonic() - self.inicio, 1e-6)
+        self.stdout.write(
+            f"{self.creados} usuarios creados, {self.rechazados} rechazados "
+            f"({self.creados / segundos:,.1f} usuarios/s)"
+        )
+
+    def _crear(self, lote, hashes):
+        usernames = asignar_usernames([datos['email'] for datos in lote])
+        usuarios = User.objects.bulk_create([
+            User(
+                username=username,
+                email=datos['email'],
+                first_name=datos['first_name'],
+                last_name=datos['last_name'],
+                password=hash_contrasena,
+            )
+            for datos, username, hash_contrasena in zip(lote, usernames, hashes)
+        ])
+        PerfilUsuario.objects.bulk_create([
+            PerfilUsuario(
+                usuario=usuario,
+                rut=datos['rut'],
+                direccion=datos['direccion'],
+                telefono=datos['telefono'],
+                rol=self.rol,
+            )
+            for datos, usuario in zip(lote, usuarios)
+        ])
+        # bulk_create no dispara señales: ajustar el contador aquí
+        estadisticas.ajustar(total_usuarios=len(usuarios))
+        return usuarios
@@ -0,0 +1,45 @@
+from django.db import migrations
+
+# Índice único sobre LOWER(email): el mismo correo no puede repetirse con otras
+# mayúsculas y el login por correo se resuelve con una búsqueda en el índice.
+# Es parcial porque Django guarda '' (no NULL) cuando el usuario no tiene correo.
+CREAR_INDICE = (
+    "CREATE UNIQUE INDEX IF NOT EXISTS auth_user_email_ci_uniq "
+    "ON auth_user (LOWER(email)) WHERE email <> ''"
+)
+ELIMINAR_INDICE = "DROP INDEX IF EXISTS auth_user_email_ci_uniq"
+
+
+def crear_indice(apps, schema_editor):
+    # Índices parciales sobre expresiones: SQLite y PostgreSQL
+    if schema_editor.connection.vendor not in ('sqlite', 'postgresql'):
+        return
+    User = apps.get_model('auth', 'User')
+    vistos = {}
+    for user_id, email in User.objects.exclude(email='').values_list('id', 'email').iterator():
+        clave = email.lower()
+        if clave in vistos:
+            raise RuntimeError(
+                f"Los usuarios {vistos[clave]} y {user_id} comparten el correo '{email}'; "
+                "corríjalo antes de aplicar esta migración."
+            )
+        vistos[clave] = user_id
+    schema_editor.execute(CREAR_INDICE)
+
+
+def eliminar_indice(apps, schema_editor):
+    if schema_editor.connection.vendor not in ('sqlite', 'postgresql'):
+        return
+    schema_editor.execute(ELIMINAR_INDICE)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('auth', '0012_alter_user_first_name_max_length'),
+        ('cuentas', '0001_initial'),
+    ]
+
+    operations = [
+        migrations.RunPython(crear_indice, eliminar_indice),
+    ]
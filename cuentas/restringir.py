@@ -1,5 +1,19 @@
+from asgiref.sync import iscoroutinefunction
 from django.contrib.auth import REDIRECT_FIELD_NAME
+from django.core.exceptions import ObjectDoesNotExist
 def login_exigido(view_func):
+    if iscoroutinefunction(view_func):
+        @wraps(view_func)
+        async def _wrapped_async(request, *args, **kwargs):
+            # Vista async: request.user es perezoso y síncrono; se resuelve aquí con
+            # auser() (usuario y perfil) para que la vista, las plantillas y los
+            # context processors no consulten la base de datos desde el event loop
+            request.user = await request.auser()
+            if not request.user.is_authenticated:
+                raise PermissionDenied
+            return await view_func(request, *args, **kwargs)
+        return _wrapped_async
+
     @wraps(view_func)
     def _wrapped(request, *args, **kwargs):
         if not request.user.is_authenticated:
@@ -12,14 +26,36 @@ from django.contrib.auth.decorators import login_required
 from functools import wraps
 from django.core.exceptions import PermissionDenied
 
+# Roles con acceso a las vistas de gestión
+PERSONAL = ("bibliotecario", "administrador")
+
+
+def perfil_de(user):
+    """
+    Perfil del usuario o None. El perfil llega junto con el usuario
+    (cuentas.backends.BackendConPerfil), así que no hace consultas extra.
+    """
+    try:
+        return user.perfil
+    except (AttributeError, ObjectDoesNotExist):
+        return None
+
+
+def rol_de(user):
+    perfil = perfil_de(user)
+    return perfil.rol if perfil else None
+
+
+def tiene_rol(user, *roles):
+    return rol_de(user) in roles
+
+
 def role_required(*roles):
     def restringir(view_func):
         @wraps(view_func)
         def _wrapped(request, *args, **kwargs):
-            if not hasattr(request.user, "perfil"):
-                raise PermissionDenied
-            if request.user.perfil.rol not in roles:
+            if not tiene_rol(request.user, *roles):
                 raise PermissionDenied
             return view_func(request, *args, **kwargs)
         return _wrapped
-    return restringir
\ No newline at end of file
+    return restringir
@@ -1,3 +1,234 @@
+import csv
+import io
+import json
+import os
+import tempfile
+from datetime import timedelta
+from decimal import Decimal
+from unittest import mock
+
+from django.contrib.auth import authenticate
+from django.contrib.auth.models import User
+from django.core.management import call_command
+from django.db import IntegrityError
 from django.test import TestCase
+from django.urls import reverse
+from django.utils import timezone
+
+from gestion.models import Libro, Prestamo
+
+from .backends import BackendConPerfil
+from .models import PerfilUsuario
+from .restringir import rol_de, tiene_rol
+from .usuarios import _rango, crear_usuario, siguiente_username
+
+
+class PerfilEnPeticionTests(TestCase):
+    def setUp(self):
+        self.usuario = User.objects.create_user('biblio', 'biblio@example.com', 'Clave123!')
+        PerfilUsuario.objects.create(
+            usuario=self.usuario, rut='11111111-1', direccion='Calle 1',
+            telefono='912345678', rol='bibliotecario',
+        )
+
+    def test_perfil_se_carga_con_el_usuario(self):
+        self.client.login(username='biblio', password='Clave123!')
+        with self.assertNumQueries(2):
+            # Sesión + usuario con su perfil (JOIN); el rol no vuelve a consultar
+            respuesta = self.client.get('/dashboard/')
+            self.assertEqual(respuesta.wsgi_request.user.perfil.rol, 'bibliotecario')
+
+    def test_roles_sin_perfil(self):
+        sin_perfil = User.objects.create_user('nadie', 'nadie@example.com', 'Clave123!')
+        self.assertIsNone(rol_de(sin_perfil))
+        self.assertFalse(tiene_rol(sin_perfil, 'lector'))
+        self.assertTrue(tiene_rol(self.usuario, 'bibliotecario', 'administrador'))
+
+    async def test_perfil_se_carga_con_el_usuario_async(self):
+        # request.auser() de las vistas async usa aget_user(): el perfil debe venir en el JOIN
+        usuario = await BackendConPerfil().aget_user(self.usuario.pk)
+        self.assertEqual(usuario.perfil.rol, 'bibliotecario')
+
+
+class LoginCorreoTests(TestCase):
+    def setUp(self):
+        self.usuario = User.objects.create_user('ana_perez', 'Ana.Perez@example.com', 'Clave123!')
+
+    def test_login_por_correo_sin_mayusculas_o_por_username(self):
+        for identificador in ('ana.perez@EXAMPLE.com', 'ana_perez'):
+            with self.assertNumQueries(1):
+                user = authenticate(username=identificador, password='Clave123!')
+            self.assertEqual(user, self.usuario)
+        self.assertIsNone(authenticate(username='ana_perez', password='otra'))
+        self.assertIsNone(authenticate(username='nadie@example.com', password='Clave123!'))
+
+    def test_correo_unico_sin_importar_mayusculas(self):
+        with self.assertRaises(IntegrityError):
+            User.objects.create_user('otra', 'ANA.PEREZ@example.com', 'Clave123!')
+
+    def test_varios_usuarios_sin_correo(self):
+        # El índice único de LOWER(email) es parcial: no cuenta los correos vacíos
+        User.objects.create_user('sin_correo_1', '', 'Clave123!')
+        User.objects.create_user('sin_correo_2', '', 'Clave123!')
+        self.assertEqual(
+            sorted(User.objects.filter(email='').values_list('username', flat=True)),
+            ['sin_correo_1', 'sin_correo_2'],
+        )
+
+
+class CrearBibliotecarioTests(TestCase):
+    def setUp(self):
+        admin = User.objects.create_user('admin', 'admin@example.com', 'Clave123!')
+        PerfilUsuario.objects.create(
+            usuario=admin, rut='22222222-2', direccion='Calle 2', telefono='912345678', rol='administrador',
+        )
+        self.client.force_login(admin)
+
+    def test_correo_tomado_entre_validar_y_guardar(self):
+        User.objects.create_user('ana', 'ana@example.com', 'Clave123!')
+        datos = {
+            'email': 'ANA@example.com', 'password1': 'Clave1234', 'password2': 'Clave1234',
+            'rut': '12.345.678-5', 'direccion': '', 'telefono': '',
+        }
+        # La otra petición aún no había guardado cuando se validó el formulario
+        with mock.patch('cuentas.forms.usuarios_con_correo', return_value=User.objects.none()):
+            respuesta = self.client.post(reverse('admin_crear_bibliotecario'), datos)
+        self.assertEqual(respuesta.status_code, 200)
+        self.assertIn('Ese correo o RUT ya está registrado.', respuesta.context['form'].non_field_errors())
+        self.assertFalse(PerfilUsuario.objects.filter(rol='bibliotecario').exists())
+
+
+class MultasTests(TestCase):
+    def setUp(self):
+        self.biblio = User.objects.create_user('biblio', 'biblio@example.com', 'Clave123!')
+        PerfilUsuario.objects.create(
+            usuario=self.biblio, rut='11111111-1', direccion='Calle 1', telefono='912345678', rol='bibliotecario',
+        )
+        self.lector = User.objects.create_user('lector', 'lector@example.com', 'Clave123!')
+        self.hoy = timezone.localdate()
+        # Vencidos hace 1, 3 y 10 días; uno al día y otro ya devuelto
+        for dias, devuelto in ((3, False), (1, False), (10, False), (-2, False), (5, True)):
+            Prestamo.objects.create(
+                usuario=self.lector,
+                libro=Libro.objects.create(titulo=f'Libro {dias}', autor='Autor'),
+                fecha_devolucion_esperada=self.hoy - timedelta(days=dias),
+                fecha_devolucion_real=self.hoy if devuelto else None,
+            )
+
+    def _exportar(self, **parametros):
+        respuesta = self.client.get(reverse('exportar_multas'), parametros)
+        self.assertTrue(respuesta.streaming)
+        return b''.join(respuesta.streaming_content).decode('utf-8')
+
+    def test_exporta_todos_los_vencidos_en_csv_y_jsonl(self):
+        self.client.force_login(self.biblio)
+        filas = list(csv.reader(io.StringIO(self._exportar())))
+        self.assertEqual(
+            filas[0], ['usuario', 'correo', 'libro', 'fecha_prestamo', 'vence', 'dias_atraso', 'multa_estimada']
+        )
+        self.assertEqual(
+            [(fila[2], int(fila[5]), Decimal(fila[6])) for fila in filas[1:]],
+            [('Libro 10', 10, Decimal('10000')), ('Libro 3', 3, Decimal('3000')), ('Libro 1', 1, Decimal('1000'))],
+        )
+
+        lineas = [json.loads(linea) for linea in self._exportar(formato='jsonl').splitlines()]
+        self.assertEqual([linea['libro'] for linea in lineas], ['Libro 10', 'Libro 3', 'Libro 1'])
+        self.assertEqual(
+            (lineas[0]['usuario'], lineas[0]['vence'], lineas[0]['dias_atraso'], Decimal(lineas[0]['multa_estimada'])),
+            ('lector', (self.hoy - timedelta(days=10)).isoformat(), 10, Decimal('10000')),
+        )
+
+    def test_total_de_vencidos_al_momento_aunque_ya_corrio_la_acumulacion(self):
+        call_command('acumular_multas', stdout=io.StringIO())
+        # Durante el día se devuelve un vencido y vence el que estaba al día
+        Prestamo.objects.filter(libro__titulo='Libro 10').update(fecha_devolucion_real=self.hoy)
+        Prestamo.objects.filter(libro__titulo='Libro -2').update(
+            fecha_devolucion_esperada=self.hoy - timedelta(days=2)
+        )
+        self.client.force_login(self.biblio)
+        respuesta = self.client.get(reverse('ver_multas'))
+        self.assertEqual(respuesta.context['total_estimado_vencidos'], Decimal('6000.00'))
+        self.assertEqual(len(respuesta.context['vencidos']), 3)
+
+    def test_exportar_solo_para_el_personal(self):
+        self.client.force_login(self.lector)
+        self.assertEqual(self.client.get(reverse('exportar_multas')).status_code, 403)
+        self.client.logout()
+        self.assertEqual(self.client.get(reverse('exportar_multas')).status_code, 403)
+
+
+class UsernameTests(TestCase):
+    def test_siguiente_sufijo_en_una_consulta(self):
+        for username in ('juan', 'juan1', 'juan7', 'juana', 'juan_perez'):
+            User.objects.create_user(username, '', 'Clave123!')
+        with self.assertNumQueries(1):
+            self.assertEqual(siguiente_username('juan'), 'juan8')
+        # Solo la base y sus sufijos numéricos, no todo lo que empieza con la base
+        self.assertEqual(
+            sorted(User.objects.filter(_rango('juan')).values_list('username', flat=True)),
+            ['juan', 'juan1', 'juan7'],
+        )
+        self.assertEqual(siguiente_username('pedro'), 'pedro')
+
+    def test_crear_usuario_desde_correo(self):
+        primero = crear_usuario('maria.jose@example.com', 'Clave123!')
+        segundo = crear_usuario('maria.jose@otro.cl', 'Clave123!')
+        self.assertEqual((primero.username, segundo.username), ('maria_jose', 'maria_jose1'))
+        with self.assertRaises(IntegrityError):
+            crear_usuario('MARIA.JOSE@example.com', 'Clave123!')
+
+
+class ImportarUsuariosTests(TestCase):
+    def test_crea_usuarios_y_reporta_rechazados(self):
+        PerfilUsuario.objects.create(
+            usuario=User.objects.create_user('existente', 'existente@example.com', 'Clave123!'),
+            rut='111111111', direccion='Calle 1', telefono='912345678',
+        )
+        with tempfile.NamedTemporaryFile('w', suffix='.csv', delete=False, encoding='utf-8') as archivo:
+            archivo.write(
+                'email,first_name,last_name,rut,telefono,direccion,password\n'
+                'ana.rojas@example.com,Ana,Rojas,12.345.678-5,912345678,Calle 2,Clave123!\n'
+                'otra@example.com,Otra,Persona,11.111.111-1,912345678,Calle 3,Clave123!\n'
+                'malo@example.com,Mal,Rut,12.345.678-0,912345678,Calle 4,Clave123!\n'
+                'EXISTENTE@example.com,Exi,Stente,7.654.321-6,912345678,Calle 5,Clave123!\n'
+            )
+        self.addCleanup(os.remove, archivo.name)
+        salida_rechazados = archivo.name + '.rechazados'
+        self.addCleanup(os.remove, salida_rechazados)
+
+        call_command(
+            'importar_usuarios', archivo.name, '--procesos', '1', '--rechazados', salida_rechazados,
+            stdout=open(os.devnull, 'w'), stderr=open(os.devnull, 'w'),
+        )
+
+        nuevo = User.objects.select_related('perfil').get(email='ana.rojas@example.com')
+        self.assertEqual((nuevo.username, nuevo.perfil.rut, nuevo.perfil.rol), ('ana_rojas', '123456785', 'lector'))
+        self.assertEqual(authenticate(username='ana.rojas@example.com', password='Clave123!'), nuevo)
+        with open(salida_rechazados, encoding='utf-8') as rechazados:
+            motivos = [linea.strip().split(',')[-1] for linea in rechazados][1:]
+        self.assertEqual(sorted(motivos), ['RUT inválido', 'el RUT ya está registrado', 'el correo ya está registrado'])
+
+    def test_credenciales_generadas_solo_legibles_por_el_dueno(self):
+        with tempfile.NamedTemporaryFile('w', suffix='.csv', delete=False, encoding='utf-8') as archivo:
+            archivo.write(
+                'email,first_name,last_name,rut,telefono,direccion\n'
+                'ana.rojas@example.com,Ana,Rojas,12.345.678-5,912345678,Calle 2\n'
+            )
+        self.addCleanup(os.remove, archivo.name)
+        salida_credenciales = archivo.name + '.credenciales'
+        # Un archivo previo con permisos amplios también queda privado
+        with open(salida_credenciales, 'w'):
+            pass
+        os.chmod(salida_credenciales, 0o644)
+        self.addCleanup(os.remove, salida_credenciales)
+
+        call_command(
+            'importar_usuarios', archivo.name, '--procesos', '1', '--credenciales', salida_credenciales,
+            stdout=open(os.devnull, 'w'), stderr=open(os.devnull, 'w'),
+        )
 
-# Create your tests here.
+        self.assertEqual(os.stat(salida_credenciales).st_mode & 0o777, 0o600)
+        with open(salida_credenciales, encoding='utf-8') as credenciales:
+            filas = list(csv.reader(credenciales))
+        self.assertEqual(filas[1][:2], ['ana.rojas@example.com', 'ana_rojas'])
+        self.assertEqual(authenticate(username='ana_rojas', password=filas[1][2]).email, 'ana.rojas@example.com')
@@ -13,6 +13,7 @@ urlpatterns = [
     # Paneles de usuario
     path('panel-bibliotecario/', views.panel_bibliotecario, name='panel_bibliotecario'),
     path("multas/", views.ver_multas, name="ver_multas"),
+    path("multas/exportar/", views.exportar_multas, name="exportar_multas"),
     path('panel-usuario/', views.panel_usuario, name='panel_usuario'),
     path('editar-perfil/', views.editar_perfil, name='editar_perfil'),
 
@@ -0,0 +1,104 @@
+"""
+Asignación de nombres de usuario a partir del correo.
+
+El username se arma con la parte local del correo ('juan.perez' -> 'juan_perez')
+y, si ya existe, se agrega el siguiente sufijo libre ('juan_perez1', ...).
+El sufijo se obtiene con una sola consulta por rango sobre el índice único
+de username; si dos registros simultáneos eligen el mismo nombre, el índice
+rechaza uno y ese reintenta con el siguiente sufijo.
+"""
+import bisect
+import re
+
+from django.contrib.auth.models import User
+from django.db import IntegrityError, transaction
+from django.db.models import Q
+
+MAX_BASE = 140  # deja espacio para el sufijo dentro de los 150 caracteres
+REINTENTOS = 5
+
+
+def username_desde_correo(email):
+    return email.split('@')[0].replace('.', '_')[:MAX_BASE]
+
+
+def _rango(base):
+    # La base y el rango [base + '0', base + ':') de los sufijos numéricos: usa el
+    # índice (a diferencia de LIKE en SQLite) y no trae 'juana' ni 'juan_perez' para 'juan'
+    return Q(username=base) | Q(username__gte=base + '0', username__lt=base + ':')
+
+
+def _mayor_sufijo(base, usernames):
+    """Mayor sufijo usado para base (0 si solo existe base, None si ninguno)"""
+    patron = re.compile(re.escape(base) + r'(\d*)$')
+    sufijos = [
+        int(coincide.group(1) or 0)
+        for coincide in map(patron.match, usernames) if coincide
+    ]
+    return max(sufijos) if sufijos else None
+
+
+def siguiente_username(base):
+    """Primer username libre de la forma base, base1, base2, ... (una consulta)"""
+    existentes = User.objects.filter(_rango(base)).values_list('username', flat=True)
+    mayor = _mayor_sufijo(base, existentes)
+    if mayor is None:
+        return base
+    return f'{base}{mayor + 1}'
+
+
+def asignar_usernames(emails, bases_por_consulta=200):
+    """
+    Usernames para una lista de correos (cargas masivas), en el mismo orden.
+    Una consulta por cada bases_por_consulta bases distintas; los nombres
+    repetidos dentro de la lista reciben sufijos consecutivos.
+    """
+    bases = [username_desde_correo(email) for email in emails]
+    distintas = list(dict.fromkeys(bases))
+    existentes = []
+    for i in range(0, len(distintas), bases_por_consulta):
+        filtro = Q()
+        for base in distintas[i:i + bases_por_consulta]:
+            filtro |= _rango(base)
+        existentes.extend(User.objects.filter(filtro).values_list('username', flat=True))
+
+    # Último sufijo usado por base (-1: la base misma está libre)
+    existentes.sort()
+    ultimo = {}
+    for base in distintas:
+        desde = bisect.bisect_left(existentes, base)
+        hasta = bisect.bisect_left(existentes, base + ':')
+        mayor = _mayor_sufijo(base, existentes[desde:hasta])
+        ultimo[base] = -1 if mayor is None else mayor
+
+    usados = set(existentes)
+    usernames = []
+    for base in bases:
+        # 'ana' + sufijo puede coincidir con la base de otro correo ('ana1@...')
+        while True:
+            ultimo[base] += 1
+            username = base if ultimo[base] == 0 else f'{base}{ultimo[base]}'
+            if username not in usados:
+                break
+        usados.add(username)
+        usernames.append(username)
+    return usernames
+
+
+def crear_usuario(email, password, **campos):
+    """
+    Crea el usuario con el primer username libre derivado del correo.
+    Si el IntegrityError no es por el username (p. ej. correo repetido) se relanza.
+    """
+    base = username_desde_correo(email)
+    for _ in range(REINTENTOS):
+        username = siguiente_username(base)
+        try:
+            with transaction.atomic():
+                return User.objects.create_user(
+                    username=username, email=email, password=password, **campos
+                )
+        except IntegrityError:
+            if not User.objects.filter(username=username).exists():
+                raise
+    raise IntegrityError(f"No se pudo asignar un nombre de usuario para '{email}'.")
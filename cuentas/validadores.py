@@ -0,0 +1,74 @@
+"""Validaciones de datos de usuarios chilenos (RUT, teléfono) y contraseñas"""
+import re
+
+
+def digito_verificador(rut_numero):
+    """Dígito verificador ('0'-'9' o 'K') del número de un RUT (algoritmo módulo 11)"""
+    suma = 0
+    multiplicador = 2
+    
+    for digito in reversed(str(rut_numero)):
+        suma += int(digito) * multiplicador
+        multiplicador += 1
+        if multiplicador > 7:
+            multiplicador = 2
+    
+    resto = suma % 11
+    dv_calculado = 11 - resto
+    
+    if dv_calculado == 11:
+        return '0'
+    if dv_calculado == 10:
+        return 'K'
+    return str(dv_calculado)
+
+
+def validar_rut(rut):
+    """Valida RUT chileno con dígito verificador"""
+    # Limpiar RUT (quitar puntos y guión)
+    rut = rut.replace(".", "").replace("-", "").upper()
+    
+    # Verificar largo
+    if len(rut) < 2:
+        return False
+    
+    # Separar número y dígito verificador
+    rut_numero = rut[:-1]
+    digito_verificador_rut = rut[-1]
+    
+    # Verificar que el número sea válido
+    if not rut_numero.isdigit():
+        return False
+    
+    return digito_verificador_rut == digito_verificador(rut_numero)
+
+
+def validar_contrasena(password):
+    """Valida que la contraseña sea segura"""
+    if len(password) < 8:
+        return False, "La contraseña debe tener al menos 8 caracteres"
+    
+    if not re.search(r'[A-Z]', password):
+        return False, "Debe contener al menos una mayúscula"
+    
+    if not re.search(r'[a-z]', password):
+        return False, "Debe contener al menos una minúscula"
+    
+    if not re.search(r'[0-9]', password):
+        return False, "Debe contener al menos un número"
+    
+    if not re.search(r'[!@#$%^&*(),.?":{}|<>]', password):
+        return False, "Debe contener al menos un carácter especial (!@#$%^&*)"
+    
+    return True, "Contraseña válida"
+
+
+def validar_telefono(telefono):
+    """Valida teléfono chileno (9 dígitos)"""
+    telefono_limpio = re.sub(r'\D', '', telefono)
+    return len(telefono_limpio) == 9 and telefono_limpio.isdigit()
+
+
+def limpiar_rut(rut):
+    """RUT tal como se guarda en PerfilUsuario: sin puntos ni guión, en mayúsculas"""
+    return rut.replace(".", "").replace("-", "").upper()
@@ -1,19 +1,31 @@
 from django.shortcuts import render, redirect
+from django.http import StreamingHttpResponse
 from django.core.exceptions import PermissionDenied
 from django.contrib.auth import authenticate, login, logout
 from django.contrib.auth.models import User
-from cuentas.restringir import login_exigido
+from cuentas.restringir import PERSONAL, login_exigido, perfil_de, rol_de, tiene_rol
 from django.contrib import messages
 from django.utils import timezone
-from django.db.models import Count
+from django.db.models import Sum
+from django.db import IntegrityError, transaction
 from .models import PerfilUsuario
 from django.shortcuts import render, redirect, get_object_or_404
 from .restringir import role_required
+from .backends import usuarios_con_correo
+from .usuarios import crear_usuario
+from .validadores import limpiar_rut, validar_contrasena, validar_rut, validar_telefono
 from .forms import CrearBibliotecarioForm
-from decimal import Decimal
 from django.db.models import Q
 from django.shortcuts import render
-from gestion.models import Libro, Prestamo
+from gestion.models import Estadisticas, Prestamo
+from gestion.estadisticas import conteo_por_genero
+from gestion.multas import MULTA_POR_DIA, anotar_atraso, asaldo_de
+from gestion.paginacion import paginar
+from gestion.replica import leer_de_replica
+import asyncio
+import csv
+import itertools
+import json
 import re
 
 
@@ -21,11 +33,10 @@ import re
 @login_exigido
 def dashboard(request):
     # Seguridad: si no tiene perfil
-    if not hasattr(request.user, "perfil"):
+    rol = rol_de(request.user)
+    if rol is None:
         return redirect("panel_usuario")
 
-    rol = request.user.perfil.rol
-
     if rol == "administrador":
         return redirect("panel_admin")
 
@@ -38,28 +49,23 @@ def dashboard(request):
 
 @login_exigido
 def dashboard_admin(request):
-    if request.user.perfil.rol != "administrador":
+    if not tiene_rol(request.user, "administrador"):
         messages.error(request, "No tienes permisos para acceder a este panel.")
         return redirect("dashboard")
 
     hoy = timezone.now().date()
 
-    total_libros = Libro.objects.count()
-    total_usuarios = User.objects.count()
+    stats = Estadisticas.obtener()
     prestamos_vencidos = Prestamo.objects.filter(
         fecha_devolucion_real__isnull=True,
         fecha_devolucion_esperada__lt=hoy
     ).count()
 
-    total_multas = sum(
-        p.multa for p in Prestamo.objects.filter(multa__gt=0)
-    )
-
     context = {
-        "total_libros": total_libros,
-        "total_usuarios": total_usuarios,
+        "total_libros": stats.total_libros,
+        "total_usuarios": stats.total_usuarios,
         "prestamos_vencidos": prestamos_vencidos,
-        "total_multas": total_multas,
+        "total_multas": stats.total_multas,
     }
 
     return render(request, "dashboard_admin.html", context)
@@ -67,8 +73,9 @@ def dashboard_admin(request):
 
 @role_required("administrador")
 def admin_usuarios(request):
-    usuarios = User.objects.select_related("perfil").all().order_by("username")
-    return render(request, "admin/usuarios.html", {"usuarios": usuarios})
+    usuarios = User.objects.select_related("perfil").all()
+    pagina = paginar(request, usuarios, ("username",))
+    return render(request, "admin/usuarios.html", {"usuarios": pagina, "pagina": pagina})
 
 @role_required("administrador")
 def admin_toggle_usuario(request, user_id):
@@ -86,9 +93,14 @@ def admin_crear_bibliotecario(request):
     if request.method == "POST":
         form = CrearBibliotecarioForm(request.POST)
         if form.is_valid():
-            form.save()
-            messages.success(request, "Bibliotecario creado correctamente.")
-            return redirect("admin_usuarios")
+            try:
+                form.save()
+            except IntegrityError:
+                # Otro registro con el mismo correo o RUT pasó las validaciones a la vez
+                form.add_error(None, "Ese correo o RUT ya está registrado.")
+            else:
+                messages.success(request, "Bibliotecario creado correctamente.")
+                return redirect("admin_usuarios")
     else:
         form = CrearBibliotecarioForm()
     return render(request, "admin/crear_bibliotecario.html", {"form": form})
@@ -124,86 +136,14 @@ def admin_cambiar_rol(request, user_id, rol):
     return redirect("admin_usuarios")
 
 
-def validar_rut(rut):
-    """Valida RUT chileno con dígito verificador"""
-    # Limpiar RUT (quitar puntos y guión)
-    rut = rut.replace(".", "").replace("-", "").upper()
-    
-    # Verificar largo
-    if len(rut) < 2:
-        return False
-    
-    # Separar número y dígito verificador
-    rut_numero = rut[:-1]
-    digito_verificador = rut[-1]
-    
-    # Verificar que el número sea válido
-    if not rut_numero.isdigit():
-        return False
-    
-    # Calcular dígito verificador esperado (algoritmo módulo 11)
-    suma = 0
-    multiplicador = 2
-    
-    for digito in reversed(rut_numero):
-        suma += int(digito) * multiplicador
-        multiplicador += 1
-        if multiplicador > 7:
-            multiplicador = 2
-    
-    resto = suma % 11
-    dv_calculado = 11 - resto
-    
-    if dv_calculado == 11:
-        dv_calculado = '0'
-    elif dv_calculado == 10:
-        dv_calculado = 'K'
-    else:
-        dv_calculado = str(dv_calculado)
-    
-    return digito_verificador == dv_calculado
-
-
-def validar_contrasena(password):
-    """Valida que la contraseña sea segura"""
-    if len(password) < 8:
-        return False, "La contraseña debe tener al menos 8 caracteres"
-    
-    if not re.search(r'[A-Z]', password):
-        return False, "Debe contener al menos una mayúscula"
-    
-    if not re.search(r'[a-z]', password):
-        return False, "Debe contener al menos una minúscula"
-    
-    if not re.search(r'[0-9]', password):
-        return False, "Debe contener al menos un número"
-    
-    if not re.search(r'[!@#$%^&*(),.?":{}|<>]', password):
-        return False, "Debe contener al menos un carácter especial (!@#$%^&*)"
-    
-    return True, "Contraseña válida"
-
-
-def validar_telefono(telefono):
-    """Valida teléfono chileno (9 dígitos)"""
-    telefono_limpio = re.sub(r'\D', '', telefono)
-    return len(telefono_limpio) == 9 and telefono_limpio.isdigit()
-
 def login_view(request):
     """Vista de Login"""
     if request.method == "POST":
         email_or_username = request.POST.get("username")  # Puede ser email o username
         password = request.POST.get("password")
 
-        # Intentar encontrar usuario por email primero
-        user_obj = User.objects.filter(email=email_or_username).first()
-        
-        if user_obj:
-            # Si encontró por email, autenticar con el username de ese usuario
-            user = authenticate(request, username=user_obj.username, password=password)
-        else:
-            # Si no existe el email, intentar por username directamente
-            user = authenticate(request, username=email_or_username, password=password)
+        # El backend (cuentas/backends.py) resuelve correo o username en una consulta
+        user = authenticate(request, username=email_or_username, password=password)
 
         if user is not None:
             login(request, user)
@@ -240,18 +180,10 @@ def registro_view(request):
             return render(request, "registro.html")
         
         # VALIDACIÓN 2: Email
-        if User.objects.filter(email=email).exists():
+        if usuarios_con_correo(email).exists():
             messages.error(request, "El correo electrónico ya está registrado")
             return render(request, "registro.html")
         
-        # Generar username desde email (automático)
-        username = email.split('@')[0].replace('.', '_')
-        contador = 1
-        username_original = username
-        while User.objects.filter(username=username).exists():
-            username = f"{username_original}{contador}"
-            contador += 1
-        
         # VALIDACIÓN 3: Contraseñas coinciden
         if password != password2:
             messages.error(request, "Las contraseñas no coinciden")
@@ -269,7 +201,7 @@ def registro_view(request):
             return render(request, "registro.html")
         
         # Limpiar RUT para guardarlo sin puntos ni guión
-        rut_limpio = rut.replace(".", "").replace("-", "").upper()
+        rut_limpio = limpiar_rut(rut)
         
         if PerfilUsuario.objects.filter(rut=rut_limpio).exists():
             messages.error(request, "El RUT ya está registrado")
@@ -282,26 +214,31 @@ def registro_view(request):
         
         # Crear usuario
         try:
-            user = User.objects.create_user(
-                username=username,
-                password=password,
-                first_name=first_name,
-                last_name=last_name,
-                email=email
-            )
-            
-            # Crear perfil con rol "lector" por defecto
-            PerfilUsuario.objects.create(
-                usuario=user,
-                rut=rut_limpio,
-                direccion=direccion,
-                telefono=telefono,
-                rol='lector'
-            )
+            with transaction.atomic():
+                # Username generado desde el email (cuentas/usuarios.py)
+                user = crear_usuario(
+                    email,
+                    password,
+                    first_name=first_name,
+                    last_name=last_name,
+                )
+                
+                # Crear perfil con rol "lector" por defecto
+                PerfilUsuario.objects.create(
+                    usuario=user,
+                    rut=rut_limpio,
+                    direccion=direccion,
+                    telefono=telefono,
+                    rol='lector'
+                )
             
             messages.success(request, f"Cuenta creada exitosamente. Ya puedes iniciar sesión con tu correo: {email}")
             return redirect("login")
             
+        except IntegrityError:
+            # Otro registro con el mismo correo (sin importar mayúsculas) ganó la carrera
+            messages.error(request, "El correo electrónico ya está registrado")
+            return render(request, "registro.html")
         except Exception as e:
             messages.error(request, f"Error al crear la cuenta: {str(e)}")
             return render(request, "registro.html")
@@ -423,99 +360,162 @@ def editar_perfil(request):
 # ==================== PANEL DE BIBLIOTECARIO ====================
 
 @login_exigido
+@leer_de_replica
 def panel_bibliotecario(request):
     """
     Panel exclusivo para bibliotecarios y administradores
     Muestra estadísticas y opciones de gestión del sistema
     """
     # Verificar que el usuario es bibliotecario o administrador
-    if not hasattr(request.user, 'perfil') or request.user.perfil.rol not in ['bibliotecario', 'administrador']:
+    if not tiene_rol(request.user, *PERSONAL):
         raise PermissionDenied
     
-    # Importar modelos de gestion
-    from gestion.models import Libro, Prestamo
-    
-    # Estadísticas generales
-    total_libros = Libro.objects.count()
-    libros_por_genero = Libro.objects.values('genero').annotate(total=Count('genero')).order_by('-total')
-    prestamos_activos = Prestamo.objects.filter(fecha_devolucion_real__isnull=True).count()
+    # Estadísticas generales (contadores mantenidos por señales)
+    stats = Estadisticas.obtener()
+    libros_por_genero = conteo_por_genero()
     prestamos_vencidos = Prestamo.objects.filter(
         fecha_devolucion_real__isnull=True,
         fecha_devolucion_esperada__lt=timezone.now().date()
     ).count()
     
     context = {
-        'total_libros': total_libros,
+        'total_libros': stats.total_libros,
         'libros_por_genero': libros_por_genero,
-        'prestamos_activos': prestamos_activos,
+        'prestamos_activos': stats.prestamos_activos,
         'prestamos_vencidos': prestamos_vencidos,
     }
     return render(request, 'panel_bibliotecario.html', context)
 
 
+def _prestamos_vencidos(hoy):
+    return Prestamo.objects.filter(
+        fecha_devolucion_real__isnull=True,
+        fecha_devolucion_esperada__lt=hoy
+    )
+
+
 @login_exigido
+@leer_de_replica
 def ver_multas(request):
     # Solo bibliotecario/admin
-    if not hasattr(request.user, "perfil") or request.user.perfil.rol not in ["bibliotecario", "administrador"]:
+    if not tiene_rol(request.user, *PERSONAL):
         raise PermissionDenied
 
-    from gestion.models import Prestamo
-
     hoy = timezone.now().date()
-    multa_por_dia = Decimal("1000.00")
 
-    # 1) Préstamos vencidos (activos, no devueltos)
-    vencidos = Prestamo.objects.filter(
-        fecha_devolucion_real__isnull=True,
-        fecha_devolucion_esperada__lt=hoy
-    ).select_related("usuario", "libro").order_by("fecha_devolucion_esperada")
+    # 1) Préstamos vencidos (activos, no devueltos), con días de atraso y
+    #    multa estimada calculados en la consulta
+    vencidos = anotar_atraso(
+        _prestamos_vencidos(hoy).select_related("usuario", "libro"), hoy
+    )
+
+    # El total estimado considera todos los vencidos, no solo la página visible.
+    # Se calcula al momento (una consulta sobre el índice de activos): el registro
+    # de acumular_multas queda desfasado con las devoluciones y vencimientos del día
+    total_dias_atraso = anotar_atraso(_prestamos_vencidos(hoy), hoy).aggregate(
+        total=Sum("dias_atraso")
+    )["total"] or 0
+    total_estimado_vencidos = MULTA_POR_DIA * total_dias_atraso
 
-    # calcular multa estimada al día
-    for p in vencidos:
-        dias_atraso = (hoy - p.fecha_devolucion_esperada).days
-        p.dias_atraso = dias_atraso
-        p.multa_estimada = multa_por_dia * dias_atraso
+    pagina_vencidos = paginar(request, vencidos, ("fecha_devolucion_esperada",))
 
     # 2) Multas registradas (ya devueltos y multa > 0)
     multas_registradas = Prestamo.objects.filter(
         fecha_devolucion_real__isnull=False,
         multa__gt=0
-    ).select_related("usuario", "libro").order_by("-fecha_devolucion_real")[:50]
+    ).select_related("usuario", "libro")
 
-    total_estimado_vencidos = sum((p.multa_estimada for p in vencidos), Decimal("0.00"))
-    total_multas_registradas = sum((p.multa for p in multas_registradas), Decimal("0.00"))
+    # Total histórico del libro de multas (una fila)
+    total_multas_registradas = Estadisticas.obtener().total_multas
+
+    pagina_multas = paginar(
+        request, multas_registradas, ("-fecha_devolucion_real",), parametro="cursor_multas"
+    )
 
     context = {
         "hoy": hoy,
-        "vencidos": vencidos,
-        "multas_registradas": multas_registradas,
+        "vencidos": pagina_vencidos,
+        "pagina_vencidos": pagina_vencidos,
+        "multas_registradas": pagina_multas,
+        "pagina_multas": pagina_multas,
         "total_estimado_vencidos": total_estimado_vencidos,
         "total_multas_registradas": total_multas_registradas,
     }
     return render(request, "ver_multas.html", context)
 
 
+class _Eco:
+    """Pseudo-archivo para csv.writer: retorna la línea en vez de guardarla"""
+    def write(self, valor):
+        return valor
+
+
+@login_exigido
+def exportar_multas(request):
+    """
+    Exporta los préstamos vencidos en CSV (por defecto) o JSONL (?formato=jsonl).
+    Se transmite fila a fila con .iterator(), así la memoria no crece con el reporte.
+    """
+    if not tiene_rol(request.user, *PERSONAL):
+        raise PermissionDenied
+
+    hoy = timezone.now().date()
+    formato = request.GET.get("formato", "csv")
+    columnas = [
+        "usuario__username", "usuario__email", "libro__titulo",
+        "fecha_prestamo", "fecha_devolucion_esperada", "dias_atraso", "multa_estimada",
+    ]
+    encabezados = ["usuario", "correo", "libro", "fecha_prestamo", "vence", "dias_atraso", "multa_estimada"]
+    filas = anotar_atraso(_prestamos_vencidos(hoy), hoy).order_by(
+        "fecha_devolucion_esperada", "id"
+    ).values_list(*columnas).iterator(chunk_size=2000)
+
+    if formato == "jsonl":
+        lineas = (
+            json.dumps(dict(zip(encabezados, fila)), default=str, ensure_ascii=False) + "\n"
+            for fila in filas
+        )
+        tipo, extension = "application/x-ndjson", "jsonl"
+    else:
+        escritor = csv.writer(_Eco())
+        lineas = itertools.chain([escritor.writerow(encabezados)], (escritor.writerow(fila) for fila in filas))
+        tipo, extension = "text/csv; charset=utf-8", "csv"
+
+    respuesta = StreamingHttpResponse(lineas, content_type=tipo)
+    respuesta["Content-Disposition"] = f'attachment; filename="multas_vencidas_{hoy.isoformat()}.{extension}"'
+    return respuesta
+
+
 # ==================== PANEL DE USUARIO ====================
 
 @login_exigido
-def panel_usuario(request):
+async def panel_usuario(request):
     """
     Panel personal del usuario (lector)
     Muestra su información y préstamos activos
+    (async: préstamos, historial y saldo se piden juntos con asyncio.gather)
     """
     from gestion.models import Prestamo
     
     # Obtener perfil del usuario
-    perfil = None
-    if hasattr(request.user, 'perfil'):
-        perfil = request.user.perfil
+    perfil = perfil_de(request.user)
     
     # Préstamos activos del usuario
-    mis_prestamos = Prestamo.objects.filter(
+    activos = Prestamo.objects.filter(
         usuario=request.user,
         fecha_devolucion_real__isnull=True
     ).select_related('libro').order_by('fecha_devolucion_esperada')
     
+    # Historial de préstamos (últimos 5 devueltos)
+    devueltos = Prestamo.objects.filter(
+        usuario=request.user,
+        fecha_devolucion_real__isnull=False
+    ).select_related('libro').order_by('-fecha_devolucion_real')[:5]
+    
+    mis_prestamos, historial, saldo_multas = await asyncio.gather(
+        _listar(activos), _listar(devueltos), asaldo_de(request.user),
+    )
+    
     # Calcular días restantes para cada préstamo
     fecha_actual = timezone.now().date()
     for prestamo in mis_prestamos:
@@ -524,39 +524,33 @@ def panel_usuario(request):
         prestamo.esta_vencido = dias_restantes < 0
         prestamo.dias_restantes_abs = abs(dias_restantes)
     
-    # Historial de préstamos (últimos 5 devueltos)
-    historial = Prestamo.objects.filter(
-        usuario=request.user,
-        fecha_devolucion_real__isnull=False
-    ).select_related('libro').order_by('-fecha_devolucion_real')[:5]
-    
     context = {
         'perfil': perfil,
+        'saldo_multas': saldo_multas,
         'mis_prestamos': mis_prestamos,
         'historial': historial,
-        'total_prestamos_activos': mis_prestamos.count(),
+        'total_prestamos_activos': len(mis_prestamos),
     }
     return render(request, 'panel_usuario.html', context)
 
 
+async def _listar(queryset):
+    return [fila async for fila in queryset.aiterator()]
+
+
 
 @login_exigido
+@leer_de_replica
 def panel_admin(request):
-    if not hasattr(request.user, "perfil") or request.user.perfil.rol != "administrador":
+    if not tiene_rol(request.user, "administrador"):
         messages.error(request, "No tienes permisos para acceder a este panel.")
         return redirect("dashboard")
 
-    total_libros = Libro.objects.count()
-    total_usuarios = User.objects.count()
-    prestamos_activos = Prestamo.objects.filter(fecha_devolucion_real__isnull=True).count()
-    multas_totales = Prestamo.objects.filter(multa__gt=0)
-
-    total_multas = sum(p.multa for p in multas_totales)
-
+    stats = Estadisticas.obtener()
     context = {
-        "total_libros": total_libros,
-        "total_usuarios": total_usuarios,
-        "prestamos_activos": prestamos_activos,
-        "total_multas": total_multas,
+        "total_libros": stats.total_libros,
+        "total_usuarios": stats.total_usuarios,
+        "prestamos_activos": stats.prestamos_activos,
+        "total_multas": stats.total_multas,
     }
     return render(request, "dashboard_admin.html", context)
@@ -1,20 +1,54 @@
+from django import forms
 from django.contrib import admin
-from .models import Libro, Prestamo
+from django.db import transaction
+from .circulacion import sincronizar_prestamo
+from .estadisticas import recalcular_copias
+from .models import Ejemplar, Libro, MovimientoMulta, Prestamo, Reserva, SaldoMulta
+from .multas import registrar_cargo, registrar_pago, saldo_de
+
+
+class DisponibleFilter(admin.SimpleListFilter):
+    title = 'disponible'
+    parameter_name = 'disponible'
+
+    def lookups(self, request, model_admin):
+        return (('1', 'Sí'), ('0', 'No'))
+
+    def queryset(self, request, queryset):
+        if self.value() in ('1', '0'):
+            return queryset.filter(copias_disponibles__gt=0) if self.value() == '1' else queryset.filter(copias_disponibles=0)
+        return queryset
+
+
+class EjemplarInline(admin.TabularInline):
+    model = Ejemplar
+    extra = 0
+    readonly_fields = ('prestamo_activo', 'reserva_activa')
+
 
 @admin.register(Libro)
 class LibroAdmin(admin.ModelAdmin):
     # Campos a mostrar en la lista
-    list_display = ('titulo', 'autor', 'genero', 'disponible')
+    list_display = ('titulo', 'autor', 'genero', 'copias_disponibles', 'copias_total', 'disponible')
     # Filtros laterales
-    list_filter = ('disponible', 'genero')
+    list_filter = (DisponibleFilter, 'genero')
     # Barra de búsqueda
     search_fields = ('titulo', 'autor')
-    # Campos editables directamente desde la lista
-    list_editable = ('disponible',)
     # Ordenar por título
     ordering = ('titulo',)
-    # Campos a mostrar en el formulario
-    fields = ('titulo', 'autor', 'genero', 'disponible')
+    # Campos a mostrar en el formulario (las copias se agregan o retiran como ejemplares)
+    fields = ('titulo', 'autor', 'genero', 'copias_total', 'copias_disponibles')
+    readonly_fields = ('copias_total', 'copias_disponibles')
+    inlines = [EjemplarInline]
+
+    @admin.display(boolean=True, description='Disponible', ordering='copias_disponibles')
+    def disponible(self, obj):
+        return obj.disponible
+
+    def save_related(self, request, form, formsets, change):
+        super().save_related(request, form, formsets, change)
+        # Ejemplares agregados o eliminados en el inline
+        recalcular_copias([form.instance.pk])
 
 @admin.register(Prestamo)
 class PrestamoAdmin(admin.ModelAdmin):
@@ -27,12 +61,14 @@ class PrestamoAdmin(admin.ModelAdmin):
     search_fields = ('usuario__username', 'libro__titulo')
     # Campos de solo lectura
     readonly_fields = ('fecha_prestamo', 'multa')
+    # El ejemplar se elige por id (o se asigna una copia libre al guardar)
+    raw_id_fields = ('ejemplar',)
     # Ordenar por fecha más reciente
     ordering = ('-fecha_prestamo',)
     # Agrupar campos en el formulario
     fieldsets = (
         ('Información del Préstamo', {
-            'fields': ('usuario', 'libro')
+            'fields': ('usuario', 'libro', 'ejemplar')
         }),
         ('Fechas', {
             'fields': ('fecha_prestamo', 'fecha_devolucion_esperada', 'fecha_devolucion_real')
@@ -42,9 +78,90 @@ class PrestamoAdmin(admin.ModelAdmin):
         }),
     )
     
+    def save_model(self, request, obj, form, change):
+        with transaction.atomic():
+            super().save_model(request, obj, form, change)
+            sincronizar_prestamo(obj)
+
     # Método personalizado para mostrar el estado
     def estado_prestamo(self, obj):
         if obj.fecha_devolucion_real:
             return "Devuelto"
         return "Activo"
-    estado_prestamo.short_description = 'Estado'
\ No newline at end of file
+    estado_prestamo.short_description = 'Estado'
+
+class MovimientoMultaForm(forms.ModelForm):
+    class Meta:
+        model = MovimientoMulta
+        fields = ('usuario', 'tipo', 'monto', 'descripcion')
+
+    def clean(self):
+        cleaned = super().clean()
+        usuario = cleaned.get('usuario')
+        monto = cleaned.get('monto')
+        if cleaned.get('tipo') == 'pago' and usuario and monto and monto > saldo_de(usuario):
+            raise forms.ValidationError("El pago supera el saldo pendiente del usuario.")
+        return cleaned
+
+
+@admin.register(MovimientoMulta)
+class MovimientoMultaAdmin(admin.ModelAdmin):
+    # El libro de multas solo admite agregar movimientos (cargos o pagos)
+    form = MovimientoMultaForm
+    list_display = ('fecha', 'usuario', 'tipo', 'monto', 'prestamo', 'descripcion')
+    list_filter = ('tipo', 'fecha')
+    search_fields = ('usuario__username', 'descripcion')
+    list_select_related = ('usuario', 'prestamo__libro')
+    raw_id_fields = ('usuario',)
+    ordering = ('-fecha',)
+
+    def has_change_permission(self, request, obj=None):
+        return obj is None and super().has_change_permission(request, obj)
+
+    def has_delete_permission(self, request, obj=None):
+        return False
+
+    def save_model(self, request, obj, form, change):
+        # Pasar por el servicio para actualizar saldo y totales en la misma transacción
+        if obj.tipo == 'pago':
+            movimiento = registrar_pago(obj.usuario, obj.monto, descripcion=obj.descripcion)
+        else:
+            movimiento = registrar_cargo(obj.usuario, obj.monto, descripcion=obj.descripcion)
+        obj.pk = movimiento.pk
+        obj.fecha = movimiento.fecha
+
+
+@admin.register(SaldoMulta)
+class SaldoMultaAdmin(admin.ModelAdmin):
+    list_display = ('usuario', 'saldo', 'total_cargado', 'total_pagado')
+    search_fields = ('usuario__username',)
+    list_select_related = ('usuario',)
+    ordering = ('-saldo',)
+
+    def has_add_permission(self, request):
+        return False
+
+    def has_change_permission(self, request, obj=None):
+        return False
+
+    def has_delete_permission(self, request, obj=None):
+        return False
+
+
+@admin.register(Reserva)
+class ReservaAdmin(admin.ModelAdmin):
+    # Las colas se mueven solo a través de gestion/reservas.py (copias y contadores)
+    list_display = ('fecha', 'usuario', 'libro', 'estado', 'ejemplar', 'expira')
+    list_filter = ('estado',)
+    search_fields = ('usuario__username', 'libro__titulo')
+    list_select_related = ('usuario', 'libro')
+    ordering = ('-fecha',)
+
+    def has_add_permission(self, request):
+        return False
+
+    def has_change_permission(self, request, obj=None):
+        return False
+
+    def has_delete_permission(self, request, obj=None):
+        return False
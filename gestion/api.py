@@ -0,0 +1,134 @@
+"""
+API REST v1 (Django REST Framework + SimpleJWT) para catálogo y préstamos.
+
+- Paginación por cursor (costo constante por página).
+- ?campos=a,b,c devuelve solo esos campos y se traduce en .only() /
+  select_related mínimos, para no leer columnas ni tablas que no se envían.
+"""
+from rest_framework import generics, permissions, viewsets
+from rest_framework.exceptions import ValidationError
+
+from cuentas.restringir import PERSONAL, tiene_rol
+
+from .busqueda import buscar_libros
+from .models import Ejemplar, Libro, Prestamo
+from .paginacion import PaginacionCatalogoAPI, PaginacionCursorAPI
+from .serializers import LibroSerializer, PrestamoSerializer, campos_solicitados
+
+
+def _es_personal(user):
+    return tiene_rol(user, *PERSONAL)
+
+
+class EsPersonalOSoloLectura(permissions.BasePermission):
+    """Cualquier usuario autenticado lee; solo bibliotecarios y administradores escriben"""
+
+    def has_permission(self, request, view):
+        if request.method in permissions.SAFE_METHODS:
+            return True
+        return _es_personal(request.user)
+
+
+class EsPersonal(permissions.BasePermission):
+    def has_permission(self, request, view):
+        return _es_personal(request.user)
+
+
+# Campos del serializer que dependen de cada columna / relación
+CAMPOS_LIBRO = {
+    'id': ('id',),
+    'titulo': ('titulo',),
+    'autor': ('autor',),
+    'genero': ('genero',),
+    'genero_display': ('genero',),
+    'disponible': ('copias_disponibles',),
+    'copias_total': ('copias_total',),
+    'copias_disponibles': ('copias_disponibles',),
+}
+
+CAMPOS_PRESTAMO = {
+    'id': ('id',),
+    'libro': ('libro',),
+    'libro_titulo': ('libro__titulo',),
+    'usuario': ('usuario__username',),
+    'fecha_prestamo': ('fecha_prestamo',),
+    'fecha_devolucion_esperada': ('fecha_devolucion_esperada',),
+    'fecha_devolucion_real': ('fecha_devolucion_real',),
+    'multa': ('multa',),
+    'activo': ('fecha_devolucion_real',),
+}
+
+
+def _solo_campos(queryset, request, mapa, orden):
+    """Aplica .only() (y select_related si hace falta) según ?campos="""
+    campos = [campo for campo in campos_solicitados(request) if campo in mapa]
+    columnas = {'id', *orden}
+    for campo in campos or mapa:
+        columnas.update(mapa[campo])
+    relaciones = {columna.split('__')[0] for columna in columnas if '__' in columna}
+    if relaciones:
+        queryset = queryset.select_related(*relaciones)
+    return queryset.only(*columnas)
+
+
+def _prestamos_filtrados(request, prestamos):
+    activos = request.query_params.get('activos')
+    if activos in ('1', 'true'):
+        prestamos = prestamos.filter(fecha_devolucion_real__isnull=True)
+    elif activos in ('0', 'false'):
+        prestamos = prestamos.filter(fecha_devolucion_real__isnull=False)
+    return _solo_campos(prestamos, request, CAMPOS_PRESTAMO, ())
+
+
+class LibroViewSet(viewsets.ModelViewSet):
+    """
+    Catálogo. Filtros: ?buscar=texto (texto completo), ?disponible=1|0
+    """
+    serializer_class = LibroSerializer
+    permission_classes = [permissions.IsAuthenticated, EsPersonalOSoloLectura]
+    pagination_class = PaginacionCatalogoAPI
+
+    def get_queryset(self):
+        libros = Libro.objects.all()
+        disponible = self.request.query_params.get('disponible')
+        if disponible in ('1', 'true'):
+            libros = libros.filter(copias_disponibles__gt=0)
+        elif disponible in ('0', 'false'):
+            libros = libros.filter(copias_disponibles=0)
+        libros = buscar_libros(libros, self.request.query_params.get('buscar', ''))
+        if self.action == 'list':
+            libros = _solo_campos(libros, self.request, CAMPOS_LIBRO, ('titulo',))
+        return libros
+
+    def perform_destroy(self, instance):
+        # A copias_disponibles le faltan tanto las copias prestadas como las apartadas
+        # para una reserva: solo entonces se consulta cuál de las dos lo impide
+        if instance.tiene_prestamo_activo():
+            ocupadas = list(
+                instance.ejemplares.exclude(Ejemplar.EN_ESTANTERIA).values_list('prestamo_activo', flat=True)
+            )
+            if any(prestamo is not None for prestamo in ocupadas):
+                raise ValidationError("No se puede eliminar un libro con préstamos activos.")
+            if ocupadas:
+                raise ValidationError("No se puede eliminar un libro con copias apartadas para reservas.")
+        instance.delete()
+
+
+class PrestamoViewSet(viewsets.ReadOnlyModelViewSet):
+    """Todos los préstamos (solo personal). Filtro: ?activos=1|0"""
+    serializer_class = PrestamoSerializer
+    permission_classes = [permissions.IsAuthenticated, EsPersonal]
+    pagination_class = PaginacionCursorAPI
+
+    def get_queryset(self):
+        return _prestamos_filtrados(self.request, Prestamo.objects.all())
+
+
+class MisPrestamosView(generics.ListAPIView):
+    """Préstamos del usuario autenticado. Filtro: ?activos=1|0"""
+    serializer_class = PrestamoSerializer
+    permission_classes = [permissions.IsAuthenticated]
+    pagination_class = PaginacionCursorAPI
+
+    def get_queryset(self):
+        return _prestamos_filtrados(self.request, Prestamo.objects.filter(usuario=self.request.user))
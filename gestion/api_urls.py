@@ -0,0 +1,18 @@
+from django.urls import include, path
+from rest_framework.routers import DefaultRouter
+from rest_framework_simplejwt.views import TokenObtainPairView, TokenRefreshView
+
+from . import api
+
+router = DefaultRouter()
+router.register('libros', api.LibroViewSet, basename='api-libros')
+router.register('prestamos', api.PrestamoViewSet, basename='api-prestamos')
+
+urlpatterns = [
+    # Autenticación JWT
+    path('token/', TokenObtainPairView.as_view(), name='api-token'),
+    path('token/refrescar/', TokenRefreshView.as_view(), name='api-token-refrescar'),
+
+    path('mis-prestamos/', api.MisPrestamosView.as_view(), name='api-mis-prestamos'),
+    path('', include(router.urls)),
+]
@@ -0,0 +1,22 @@
+"""
+PRAGMAS de SQLite por conexión (perfil de producción en biblioteca/settings.py).
+
+Cada entrada de DATABASES puede traer una clave PRAGMAS; se aplican al abrir
+la conexión (señal connection_created), así que con conexiones persistentes
+(CONN_MAX_AGE) se pagan una vez por conexión y no por petición. journal_mode
+queda guardado en el archivo; las demás valen solo para la conexión.
+"""
+from django.db.backends.signals import connection_created
+from django.dispatch import receiver
+
+
+@receiver(connection_created)
+def aplicar_pragmas(sender, connection, **kwargs):
+    if connection.vendor != 'sqlite':
+        return
+    pragmas = connection.settings_dict.get('PRAGMAS')
+    if not pragmas:
+        return
+    with connection.cursor() as cursor:
+        for nombre, valor in pragmas.items():
+            cursor.execute(f'PRAGMA {nombre} = {valor}')
@@ -0,0 +1,139 @@
+"""
+Búsqueda de texto completo sobre el catálogo de libros.
+
+En SQLite se usa la tabla virtual FTS5 ``gestion_libro_fts`` (creada en la
+migración 0003), que se mantiene sincronizada con ``gestion_libro`` mediante
+triggers, por lo que también cubre ``bulk_create`` y ``update()``. En otros
+motores se recurre a la búsqueda con ``icontains``.
+"""
+import re
+import unicodedata
+
+from django.db import connections
+from django.db.models import FloatField, Q
+from django.db.models.expressions import RawSQL
+
+TABLA_FTS = 'gestion_libro_fts'
+
+# Peso de cada columna en el ranking bm25: título, autor, género
+PESOS_RELEVANCIA = (10.0, 5.0, 1.0)
+
+# Triggers que sincronizan el índice (los mismos de la migración 0003)
+TRIGGERS_FTS = {
+    'gestion_libro_fts_ai': """
+        CREATE TRIGGER IF NOT EXISTS gestion_libro_fts_ai AFTER INSERT ON gestion_libro BEGIN
+            INSERT INTO gestion_libro_fts(rowid, titulo, autor, genero)
+            VALUES (new.id, new.titulo, new.autor, new.genero);
+        END
+    """,
+    'gestion_libro_fts_ad': """
+        CREATE TRIGGER IF NOT EXISTS gestion_libro_fts_ad AFTER DELETE ON gestion_libro BEGIN
+            INSERT INTO gestion_libro_fts(gestion_libro_fts, rowid, titulo, autor, genero)
+            VALUES ('delete', old.id, old.titulo, old.autor, old.genero);
+        END
+    """,
+    'gestion_libro_fts_au': """
+        CREATE TRIGGER IF NOT EXISTS gestion_libro_fts_au AFTER UPDATE OF titulo, autor, genero ON gestion_libro BEGIN
+            INSERT INTO gestion_libro_fts(gestion_libro_fts, rowid, titulo, autor, genero)
+            VALUES ('delete', old.id, old.titulo, old.autor, old.genero);
+            INSERT INTO gestion_libro_fts(rowid, titulo, autor, genero)
+            VALUES (new.id, new.titulo, new.autor, new.genero);
+        END
+    """,
+}
+
+
+def normalizar(texto):
+    """Pasa a minúsculas y quita tildes: 'Canción' -> 'cancion', 'Ñuñoa' -> 'nunoa'"""
+    texto = texto or ''
+    if texto.isascii():
+        # Camino rápido (la mayoría de los textos): no hay tildes que quitar
+        return texto.lower()
+    texto = unicodedata.normalize('NFKD', texto)
+    return ''.join(c for c in texto if not unicodedata.combining(c)).lower()
+
+
+def consulta_fts(texto):
+    """
+    Convierte lo escrito por el usuario en una consulta FTS5 segura.
+    Cada palabra se busca como prefijo y todas deben aparecer (AND implícito).
+    """
+    terminos = re.findall(r'\w+', normalizar(texto))
+    return ' '.join(f'"{termino}"*' for termino in terminos)
+
+
+def buscar_libros(libros, texto):
+    """
+    Filtra el queryset de libros por el texto buscado y lo ordena por relevancia.
+    Retorna el mismo queryset sin cambios si no hay nada que buscar.
+    """
+    consulta = consulta_fts(texto)
+    if not consulta:
+        return libros
+
+    if connections[libros.db].vendor != 'sqlite':
+        filtro = Q()
+        for termino in texto.split():
+            filtro &= (
+                Q(titulo__icontains=termino) |
+                Q(autor__icontains=termino) |
+                Q(genero__icontains=termino)
+            )
+        return libros.filter(filtro)
+
+    tabla_libro = libros.model._meta.db_table
+    pesos = ', '.join(str(peso) for peso in PESOS_RELEVANCIA)
+    return libros.extra(
+        tables=[TABLA_FTS],
+        where=[f'{TABLA_FTS}.rowid = {tabla_libro}.id', f'{TABLA_FTS} MATCH %s'],
+        params=[consulta],
+    ).annotate(
+        # FloatField: los cursores (p. ej. el de DRF, que es texto) se comparan como número
+        relevancia=RawSQL(f'bm25({TABLA_FTS}, {pesos})', (), output_field=FloatField())
+    ).order_by('relevancia', 'id')
+
+
+def reconstruir_indice(using='default'):
+    """
+    Regenera por completo el índice FTS5 a partir de gestion_libro y vuelve a
+    crear los triggers si fueron suspendidos.
+    """
+    connection = connections[using]
+    if connection.vendor != 'sqlite':
+        return
+    with connection.cursor() as cursor:
+        for sentencia in TRIGGERS_FTS.values():
+            cursor.execute(sentencia)
+        cursor.execute(f"INSERT INTO {TABLA_FTS}({TABLA_FTS}) VALUES('rebuild')")
+
+
+def sincronizacion_suspendida(using='default'):
+    """
+    True si falta alguno de los triggers del índice: una carga masiva que no
+    alcanzó a restaurarlos (proceso terminado a la fuerza, conexión caída)
+    """
+    connection = connections[using]
+    if connection.vendor != 'sqlite':
+        return False
+    nombres = list(TRIGGERS_FTS)
+    with connection.cursor() as cursor:
+        cursor.execute(
+            f"SELECT COUNT(*) FROM sqlite_master WHERE type = 'trigger' "
+            f"AND name IN ({', '.join(['%s'] * len(nombres))})",
+            nombres,
+        )
+        return cursor.fetchone()[0] < len(nombres)
+
+
+def suspender_sincronizacion(using='default'):
+    """
+    Elimina los triggers del índice para cargas masivas: mantenerlo fila a fila
+    cuesta varias veces más que el propio INSERT. Mientras tanto las búsquedas
+    no ven los cambios; reconstruir_indice() restaura los triggers y el índice.
+    """
+    connection = connections[using]
+    if connection.vendor != 'sqlite':
+        return
+    with connection.cursor() as cursor:
+        for nombre in TRIGGERS_FTS:
+            cursor.execute(f'DROP TRIGGER IF EXISTS {nombre}')
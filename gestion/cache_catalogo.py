@@ -0,0 +1,102 @@
+"""
+Caché de consultas del catálogo (listados, búsqueda y disponibilidad).
+
+Cada clave incluye un número de generación. Guardar o eliminar un Libro o un
+Prestamo incrementa la generación (una sola operación en la caché, ver
+gestion/signals.py) y las entradas anteriores quedan huérfanas hasta que
+expiran: no hay que recorrer ni borrar claves.
+
+El backend se elige en settings.CACHES (locmem, archivo o Redis). Los
+contadores de aciertos/fallos viven en la misma caché, así que con un
+backend compartido suman las de todos los procesos.
+"""
+import hashlib
+import time
+
+from asgiref.sync import sync_to_async
+from django.conf import settings
+from django.core.cache import cache
+
+CLAVE_GENERACION = 'catalogo:generacion'
+CLAVE_ACIERTOS = 'catalogo:aciertos'
+CLAVE_FALLOS = 'catalogo:fallos'
+
+
+def _incrementar(clave, inicial=0):
+    try:
+        return cache.incr(clave)
+    except ValueError:
+        # La clave no existe (primer uso o fue expulsada de la caché)
+        cache.add(clave, inicial, timeout=None)
+        return cache.incr(clave)
+
+
+def generacion():
+    """Generación actual del catálogo"""
+    actual = cache.get(CLAVE_GENERACION)
+    if actual is None:
+        # Si la clave se perdió, partir de un valor nuevo (basado en la hora) para
+        # no reutilizar una generación que pudo tener entradas ya obsoletas
+        cache.add(CLAVE_GENERACION, int(time.time() * 1000), timeout=None)
+        actual = cache.get(CLAVE_GENERACION)
+    return actual
+
+
+def invalidar():
+    """Deja obsoletas todas las entradas del catálogo"""
+    _incrementar(CLAVE_GENERACION, inicial=int(time.time() * 1000))
+
+
+def _clave(nombre, parametros):
+    """Clave a partir del nombre de la consulta y sus parámetros (p. ej. request.GET)"""
+    if hasattr(parametros, 'lists'):
+        parametros = sorted(parametros.lists())
+    resumen = hashlib.md5(repr(parametros).encode()).hexdigest()
+    return f'catalogo:{generacion()}:{nombre}:{resumen}'
+
+
+def _leer(nombre, parametros):
+    """(clave, valor guardado o None), contando el acierto o el fallo"""
+    clave = _clave(nombre, parametros)
+    valor = cache.get(clave)
+    _incrementar(CLAVE_ACIERTOS if valor is not None else CLAVE_FALLOS)
+    return clave, valor
+
+
+def _segundos():
+    return getattr(settings, 'CATALOGO_CACHE_SEGUNDOS', 300)
+
+
+def obtener(nombre, parametros, calcular):
+    """
+    Retorna el resultado guardado para (nombre, parametros) en la generación
+    actual; si no existe, lo calcula con calcular() y lo guarda.
+    """
+    clave, valor = _leer(nombre, parametros)
+    if valor is None:
+        valor = calcular()
+        cache.set(clave, valor, timeout=_segundos())
+    return valor
+
+
+async def aobtener(nombre, parametros, calcular):
+    """obtener para las vistas async: calcular es una función async"""
+    # Generación, lectura y contador en un solo salto al hilo síncrono
+    clave, valor = await sync_to_async(_leer)(nombre, parametros)
+    if valor is None:
+        valor = await calcular()
+        await cache.aset(clave, valor, timeout=_segundos())
+    return valor
+
+
+def estadisticas():
+    """Aciertos, fallos y porcentaje de aciertos de la caché del catálogo"""
+    valores = cache.get_many([CLAVE_ACIERTOS, CLAVE_FALLOS])
+    aciertos = valores.get(CLAVE_ACIERTOS, 0)
+    fallos = valores.get(CLAVE_FALLOS, 0)
+    total = aciertos + fallos
+    return {
+        'aciertos': aciertos,
+        'fallos': fallos,
+        'porcentaje': round(100 * aciertos / total, 1) if total else 0,
+    }
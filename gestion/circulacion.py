@@ -0,0 +1,428 @@
+"""
+Servicio de préstamo (checkout) sin condiciones de carrera.
+
+Dentro de transaction.atomic el libro se "toma" con un UPDATE condicional
+(WHERE copias_disponibles > 0) que descuenta una copia; si dos lectores piden
+la última copia a la vez, solo uno logra actualizar la fila. Luego se inserta
+el préstamo y se marca una copia libre (Ejemplar) como prestada. Las
+restricciones únicas de préstamo activo por ejemplar y por lector/libro
+respaldan las mismas reglas en la base de datos.
+
+Las copias que vuelven a circular pasan primero por la cola de reservas del
+libro (ver gestion/reservas.py); un lector con una copia apartada la retira
+sin tocar el contador, que ya la había descontado.
+"""
+from collections import defaultdict
+from dataclasses import dataclass
+from datetime import timedelta
+
+from django.contrib.auth.models import User
+from django.db import IntegrityError, transaction
+from django.db.models import F
+from django.utils import timezone
+
+from . import cache_catalogo, estadisticas
+from .models import Ejemplar, Libro, OperacionKiosco, Prestamo, Reserva
+from .multas import calcular_multa, registrar_cargos_en_lote
+from .reservas import repartir_copias, retirar_reserva
+
+PRESTADO = 'prestado'
+NO_EXISTE = 'no_existe'
+NO_DISPONIBLE = 'no_disponible'
+YA_LO_TIENE = 'ya_lo_tiene'
+
+
+class _SinCopia(Exception):
+    """No quedó una copia libre: revierte la transacción de prestar_libro"""
+
+
+@dataclass(frozen=True)
+class ResultadoPrestamo:
+    """Resultado de prestar_libro; estado es una de las constantes del módulo"""
+    estado: str
+    titulo: str = ''
+    prestamo: Prestamo = None
+
+    @property
+    def ok(self):
+        return self.estado == PRESTADO
+
+
+def prestar_libro(usuario, libro_id, dias_prestamo):
+    """
+    Presta una copia del libro al usuario si queda alguna disponible.
+    En el camino feliz el contador, la copia libre y el préstamo se resuelven
+    en una transacción; solo cuando falla se consulta el motivo.
+    """
+    ahora = timezone.now()
+    fecha_devolucion_esperada = ahora.date() + timedelta(days=dias_prestamo)
+    try:
+        with transaction.atomic():
+            # Copia apartada por una reserva del lector: el contador ya la descontó
+            ejemplar_id = retirar_reserva(usuario, libro_id, ahora)
+            copia = Ejemplar.objects.filter(pk=ejemplar_id, prestamo_activo__isnull=True)
+            if ejemplar_id is None:
+                tomado = Libro.objects.filter(pk=libro_id, copias_disponibles__gt=0).update(
+                    copias_disponibles=F('copias_disponibles') - 1
+                )
+                if not tomado:
+                    raise _SinCopia
+                ejemplar_id = Ejemplar.objects.filter(
+                    Ejemplar.EN_ESTANTERIA, libro_id=libro_id
+                ).values_list('id', flat=True).first()
+                copia = Ejemplar.objects.filter(Ejemplar.EN_ESTANTERIA, pk=ejemplar_id)
+            prestamo = Prestamo.objects.create(
+                usuario=usuario,
+                libro_id=libro_id,
+                ejemplar_id=ejemplar_id,
+                fecha_devolucion_esperada=fecha_devolucion_esperada,
+            )
+            if not copia.update(prestamo_activo=prestamo, reserva_activa=None):
+                raise _SinCopia
+            # Si además esperaba en la cola del libro, ya no: una copia asignada a esa
+            # reserva quedaría apartada sin que el lector pudiera retirarla
+            Reserva.objects.filter(
+                usuario=usuario, libro_id=libro_id, estado=Reserva.EN_ESPERA
+            ).update(estado=Reserva.CANCELADA)
+    except (IntegrityError, _SinCopia):
+        # Sin copias, el lector ya tiene el libro (restricción única) o el libro
+        # no existe: la transacción se revierte
+        prestamo = None
+    except (ValueError, TypeError):
+        return ResultadoPrestamo(NO_EXISTE)
+
+    titulo = Libro.objects.filter(pk=libro_id).values_list('titulo', flat=True).first()
+    if prestamo is not None:
+        return ResultadoPrestamo(PRESTADO, titulo=titulo, prestamo=prestamo)
+    if titulo is None:
+        return ResultadoPrestamo(NO_EXISTE)
+    if Prestamo.objects.filter(
+        usuario=usuario,
+        libro_id=libro_id,
+        fecha_devolucion_real__isnull=True
+    ).exists():
+        return ResultadoPrestamo(YA_LO_TIENE, titulo=titulo)
+    return ResultadoPrestamo(NO_DISPONIBLE, titulo=titulo)
+
+
+def liberar_ejemplar(prestamo):
+    """
+    Devolución: la copia se asigna a la primera reserva en espera del libro o,
+    si no hay, vuelve a la estantería y el contador sube. Solo se mueve si la
+    copia seguía apuntando al préstamo, así que llamarla dos veces no descuadra
+    nada. Retorna los ids de las reservas asignadas.
+    """
+    if Ejemplar.objects.filter(pk=prestamo.ejemplar_id, prestamo_activo=prestamo).update(prestamo_activo=None):
+        return repartir_copias(prestamo.libro_id, [prestamo.ejemplar_id])
+    return []
+
+
+def ajustar_copias(libro, copias):
+    """
+    Agrega o retira ejemplares hasta que el libro tenga 'copias'. Las copias
+    nuevas atienden primero la cola de reservas. Solo se retiran copias en
+    estantería: si no alcanzan no cambia nada y retorna False.
+    """
+    with transaction.atomic():
+        diferencia = copias - libro.copias_total
+        if diferencia > 0:
+            nuevas = Ejemplar.objects.bulk_create([Ejemplar(libro=libro) for _ in range(diferencia)])
+            Libro.objects.filter(pk=libro.pk).update(copias_total=F('copias_total') + diferencia)
+            repartir_copias(libro.pk, [ejemplar.pk for ejemplar in nuevas])
+        elif diferencia < 0:
+            sobrantes = list(Ejemplar.objects.filter(
+                Ejemplar.EN_ESTANTERIA, libro=libro
+            ).order_by('-id').values_list('id', flat=True)[:-diferencia])
+            # Volver a exigir "en estantería" por si alguna se prestó entretanto
+            _, borrados = Ejemplar.objects.filter(Ejemplar.EN_ESTANTERIA, id__in=sobrantes).delete()
+            if borrados.get(Ejemplar._meta.label, 0) != -diferencia:
+                transaction.set_rollback(True)
+                return False
+            Libro.objects.filter(pk=libro.pk).update(
+                copias_total=F('copias_total') + diferencia,
+                copias_disponibles=F('copias_disponibles') + diferencia,
+            )
+        if diferencia:
+            # update() no dispara señales
+            transaction.on_commit(cache_catalogo.invalidar)
+    return True
+
+
+def sincronizar_prestamo(prestamo):
+    """
+    Deja copias y contadores coherentes con un préstamo creado o editado fuera
+    de prestar_libro (p. ej. desde el admin)
+    """
+    libro_ids = {prestamo.libro_id, *Ejemplar.objects.filter(
+        prestamo_activo=prestamo
+    ).values_list('libro_id', flat=True)}
+    Ejemplar.objects.filter(prestamo_activo=prestamo).update(prestamo_activo=None)
+    if prestamo.fecha_devolucion_real is None:
+        if prestamo.ejemplar_id is None or prestamo.ejemplar.libro_id != prestamo.libro_id:
+            prestamo.ejemplar = Ejemplar.objects.filter(
+                Ejemplar.EN_ESTANTERIA, libro_id=prestamo.libro_id
+            ).first()
+            Prestamo.objects.filter(pk=prestamo.pk).update(ejemplar=prestamo.ejemplar)
+        if prestamo.ejemplar_id is not None:
+            Ejemplar.objects.filter(pk=prestamo.ejemplar_id).update(prestamo_activo=prestamo)
+    estadisticas.recalcular_copias(libro_ids)
+
+
+# ==================== LOTES DE KIOSCO ====================
+
+DEVUELTO = 'devuelto'
+SIN_PRESTAMO = 'sin_prestamo'
+INVALIDA = 'invalida'
+
+MAX_OPERACIONES_LOTE = 500
+
+
+class ConflictoLote(Exception):
+    """Otro proceso cambió la disponibilidad durante el lote; se puede reintentar"""
+
+
+def _entero(valor):
+    try:
+        return int(valor)
+    except (TypeError, ValueError):
+        return None
+
+
+def _validar(operacion):
+    """Normaliza una operación del lote; retorna None si no es válida"""
+    if not isinstance(operacion, dict):
+        return None
+    clave = str(operacion.get('clave') or '')[:64]
+    tipo = operacion.get('tipo')
+    libro_id = _entero(operacion.get('libro_id'))
+    if not clave or tipo not in ('prestamo', 'devolucion') or libro_id is None:
+        return None
+    datos = {'clave': clave, 'tipo': tipo, 'libro_id': libro_id}
+    datos['usuario_id'] = _entero(operacion.get('usuario_id'))
+    if tipo == 'prestamo':
+        datos['dias'] = _entero(operacion.get('dias', 7))
+        if datos['usuario_id'] is None or not datos['dias'] or datos['dias'] < 1:
+            return None
+    else:
+        # Con varias copias prestadas, la copia (o el lector) identifica el préstamo
+        datos['ejemplar_id'] = _entero(operacion.get('ejemplar_id'))
+    return datos
+
+
+def _prestamo_a_devolver(op, por_ejemplar, por_lector, por_libro):
+    """Préstamo activo al que se refiere una devolución; None si no hay; False si es ambiguo"""
+    if op['ejemplar_id'] is not None:
+        prestamo = por_ejemplar.get(op['ejemplar_id'])
+        return prestamo if prestamo is not None and prestamo.libro_id == op['libro_id'] else None
+    if op['usuario_id'] is not None:
+        return por_lector.get((op['libro_id'], op['usuario_id']))
+    activos = por_libro[op['libro_id']]
+    if len(activos) > 1:
+        return False
+    return activos[0] if activos else None
+
+
+def procesar_lote(operaciones):
+    """
+    Aplica una lista de préstamos/devoluciones de kiosco en una sola transacción.
+
+    Cada operación lleva una 'clave' de idempotencia: si ya fue aplicada se
+    responde el resultado guardado sin volver a aplicarla. Las operaciones se
+    evalúan en orden (una devolución libera la copia para un préstamo posterior
+    del mismo lote) y se escriben con bulk_create/bulk_update. La multa se
+    calcula igual que en registrar_devolucion. Una devolución indica la copia
+    (ejemplar_id) o el lector (usuario_id) cuando el libro tiene varias copias
+    prestadas. Si el libro tiene reservas en espera la copia devuelta se les
+    asigna al final del lote; un préstamo retira la copia apartada del lector.
+
+    Retorna la lista de resultados (un dict por operación, en el mismo orden).
+    Lanza ConflictoLote si otro proceso tomó alguna de las copias mientras tanto.
+    """
+    ahora = timezone.now()
+    hoy = ahora.date()
+    validas = [_validar(operacion) for operacion in operaciones]
+    claves = {op['clave'] for op in validas if op}
+
+    with transaction.atomic():
+        previas = dict(
+            OperacionKiosco.objects.filter(clave__in=claves).values_list('clave', 'resultado')
+        )
+        pendientes = [op for op in validas if op and op['clave'] not in previas]
+
+        libro_ids = {op['libro_id'] for op in pendientes}
+        libros = set(Libro.objects.filter(id__in=libro_ids).values_list('id', flat=True))
+        por_ejemplar, por_lector, por_libro = {}, {}, defaultdict(list)
+
+        def activar(prestamo):
+            por_ejemplar[prestamo.ejemplar_id] = prestamo
+            por_lector[(prestamo.libro_id, prestamo.usuario_id)] = prestamo
+            por_libro[prestamo.libro_id].append(prestamo)
+
+        def desactivar(prestamo):
+            por_ejemplar.pop(prestamo.ejemplar_id, None)
+            por_lector.pop((prestamo.libro_id, prestamo.usuario_id), None)
+            por_libro[prestamo.libro_id].remove(prestamo)
+
+        for prestamo in Prestamo.objects.filter(libro_id__in=libro_ids, fecha_devolucion_real__isnull=True):
+            activar(prestamo)
+        a_prestar = {op['libro_id'] for op in pendientes if op['tipo'] == 'prestamo'}
+        lectores = {op['usuario_id'] for op in pendientes if op['tipo'] == 'prestamo'}
+        # Copias libres de los libros a prestar
+        libres = defaultdict(list)
+        for libro_id, ejemplar_id in Ejemplar.objects.filter(
+            Ejemplar.EN_ESTANTERIA, libro_id__in=a_prestar,
+        ).order_by('-id').values_list('libro_id', 'id'):
+            libres[libro_id].append(ejemplar_id)
+        # Copias apartadas por reservas de los lectores del lote
+        apartadas = {
+            (libro_id, usuario_id): (reserva_id, ejemplar_id)
+            for libro_id, usuario_id, reserva_id, ejemplar_id in Reserva.objects.filter(
+                estado=Reserva.ASIGNADA, expira__gt=ahora, libro_id__in=a_prestar, usuario_id__in=lectores,
+            ).values_list('libro_id', 'usuario_id', 'id', 'ejemplar_id')
+        }
+        # Libros con reservas en espera: sus copias devueltas van a la cola, no a la estantería
+        con_cola = set(Reserva.objects.filter(
+            estado=Reserva.EN_ESPERA,
+            libro_id__in={op['libro_id'] for op in pendientes if op['tipo'] == 'devolucion'},
+        ).values_list('libro_id', flat=True).distinct())
+        usuarios_validos = set(
+            User.objects.filter(id__in=lectores, is_active=True).values_list('id', flat=True)
+        )
+
+        nuevos, devueltos, resultados_por_clave = [], [], {}
+        retiradas, para_cola = [], defaultdict(list)
+        # Variación de copias_disponibles por libro (copias que salen o vuelven a la estantería)
+        variacion = defaultdict(int)
+
+        for op in pendientes:
+            if op['clave'] in resultados_por_clave:
+                continue  # clave repetida dentro del mismo lote
+            libro_id = op['libro_id']
+            if libro_id not in libros:
+                resultado = {'estado': NO_EXISTE}
+            elif op['tipo'] == 'prestamo':
+                apartada = apartadas.get((libro_id, op['usuario_id']))
+                if op['usuario_id'] not in usuarios_validos:
+                    resultado = {'estado': INVALIDA, 'detalle': 'usuario inexistente o inactivo'}
+                elif apartada is None and not libres[libro_id]:
+                    resultado = {'estado': NO_DISPONIBLE}
+                elif (libro_id, op['usuario_id']) in por_lector:
+                    resultado = {'estado': YA_LO_TIENE}
+                else:
+                    if apartada is not None:
+                        # La copia apartada ya estaba fuera del contador
+                        del apartadas[(libro_id, op['usuario_id'])]
+                        reserva_id, ejemplar_id = apartada
+                        retiradas.append(reserva_id)
+                    else:
+                        ejemplar_id = libres[libro_id].pop()
+                        variacion[libro_id] -= 1
+                    prestamo = Prestamo(
+                        usuario_id=op['usuario_id'],
+                        libro_id=libro_id,
+                        ejemplar_id=ejemplar_id,
+                        fecha_devolucion_esperada=hoy + timedelta(days=op['dias']),
+                    )
+                    nuevos.append(prestamo)
+                    activar(prestamo)
+                    resultado = {
+                        'estado': PRESTADO,
+                        'ejemplar_id': prestamo.ejemplar_id,
+                        'fecha_devolucion_esperada': prestamo.fecha_devolucion_esperada.isoformat(),
+                        '_prestamo': prestamo,
+                    }
+            else:
+                prestamo = _prestamo_a_devolver(op, por_ejemplar, por_lector, por_libro)
+                if prestamo is False:
+                    resultado = {'estado': INVALIDA, 'detalle': 'varias copias prestadas: indique ejemplar_id o usuario_id'}
+                elif prestamo is None:
+                    resultado = {'estado': SIN_PRESTAMO}
+                else:
+                    desactivar(prestamo)
+                    dias_atraso, prestamo.multa = calcular_multa(prestamo.fecha_devolucion_esperada, hoy)
+                    prestamo.fecha_devolucion_real = hoy
+                    if prestamo.pk:
+                        devueltos.append(prestamo)
+                    if prestamo.ejemplar_id is not None and libro_id in con_cola:
+                        para_cola[libro_id].append(prestamo.ejemplar_id)
+                    elif prestamo.ejemplar_id is not None:
+                        libres[libro_id].append(prestamo.ejemplar_id)
+                        variacion[libro_id] += 1
+                    resultado = {
+                        'estado': DEVUELTO,
+                        'dias_atraso': dias_atraso,
+                        'multa': str(prestamo.multa),
+                        '_prestamo': prestamo,
+                    }
+            resultados_por_clave[op['clave']] = dict(resultado, tipo=op['tipo'], libro_id=libro_id)
+
+        # Escrituras en bloque. Primero las devoluciones para liberar las restricciones
+        # únicas; si otro proceso prestó una de las copias entretanto, lo detectan ellas
+        # (o el CHECK de copias_disponibles >= 0 del contador).
+        if devueltos:
+            Prestamo.objects.bulk_update(devueltos, ['fecha_devolucion_real', 'multa'])
+        activos_nuevos = [p for p in nuevos if p.fecha_devolucion_real is None]
+        if retiradas and Reserva.objects.filter(
+            pk__in=retiradas, estado=Reserva.ASIGNADA
+        ).update(estado=Reserva.RETIRADA) != len(retiradas):
+            raise ConflictoLote("Una reserva del lote expiró o fue cancelada por otro proceso.")
+        try:
+            with transaction.atomic():
+                Prestamo.objects.bulk_create(nuevos)
+                # Contadores de copias: un UPDATE por cada variación distinta (normalmente +1 / -1)
+                por_variacion = defaultdict(list)
+                for libro_id, delta in variacion.items():
+                    if delta:
+                        por_variacion[delta].append(libro_id)
+                for delta, ids in por_variacion.items():
+                    Libro.objects.filter(id__in=ids).update(copias_disponibles=F('copias_disponibles') + delta)
+        except IntegrityError:
+            raise ConflictoLote("Una copia del lote fue prestada por otro proceso.")
+
+        # Estado final de cada copia tocada por el lote
+        ocupadas = {p.ejemplar_id: p for p in activos_nuevos}
+        liberadas = {
+            p.ejemplar_id for p in devueltos + nuevos
+            if p.fecha_devolucion_real is not None and p.ejemplar_id is not None
+        } - ocupadas.keys()
+        if liberadas:
+            # (una copia retirada de una reserva y devuelta en el mismo lote deja de estar apartada)
+            Ejemplar.objects.filter(id__in=liberadas).update(prestamo_activo=None, reserva_activa=None)
+        if ocupadas:
+            Ejemplar.objects.bulk_update(
+                [Ejemplar(id=ejemplar_id, prestamo_activo=p, reserva_activa=None) for ejemplar_id, p in ocupadas.items()],
+                ['prestamo_activo', 'reserva_activa'],
+            )
+        # Copias devueltas de libros con cola: a la siguiente reserva de cada una
+        for libro_id, ejemplar_ids in para_cola.items():
+            repartir_copias(libro_id, ejemplar_ids, ahora)
+
+        todos = nuevos + devueltos
+        registrar_cargos_en_lote([
+            (p.usuario_id, p.multa, p.pk, 'Devolución en kiosco')
+            for p in todos if p.fecha_devolucion_real is not None
+        ])
+        # bulk_create/bulk_update no disparan señales: ajustar contadores y caché aquí
+        estadisticas.ajustar(prestamos_activos=len(activos_nuevos) - len(devueltos))
+        if todos:
+            transaction.on_commit(cache_catalogo.invalidar)
+
+        for resultado in resultados_por_clave.values():
+            prestamo = resultado.pop('_prestamo', None)
+            if prestamo is not None:
+                resultado['prestamo_id'] = prestamo.pk
+        OperacionKiosco.objects.bulk_create([
+            OperacionKiosco(clave=clave, tipo=resultado['tipo'], resultado=resultado)
+            for clave, resultado in resultados_por_clave.items()
+        ])
+
+    salida = []
+    for operacion, op in zip(operaciones, validas):
+        if op is None:
+            clave = operacion.get('clave') if isinstance(operacion, dict) else None
+            salida.append({'clave': clave, 'estado': INVALIDA})
+        elif op['clave'] in previas:
+            salida.append(dict(previas[op['clave']], clave=op['clave'], repetida=True))
+        else:
+            salida.append(dict(resultados_por_clave[op['clave']], clave=op['clave']))
+    return salida
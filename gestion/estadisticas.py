@@ -0,0 +1,120 @@
+"""
+Mantenimiento de los contadores de Estadisticas, ConteoGenero y de las copias
+de cada Libro (copias_total / copias_disponibles).
+
+Los ajustes se hacen con UPDATE ... SET campo = campo + n, por lo que son
+seguros ante escrituras concurrentes y quedan dentro de la transacción de
+quien los llama (la vista que crea el préstamo, el libro, etc.).
+"""
+from django.contrib.auth.models import User
+from decimal import Decimal
+
+from django.db.models import Count, F, OuterRef, Q, Subquery, Sum, Value
+from django.db.models.functions import Coalesce
+
+from .models import ConteoGenero, Ejemplar, Estadisticas, Libro, MovimientoMulta, Prestamo
+
+
+def ajustar(**deltas):
+    """Suma los deltas indicados a la fila de estadísticas: ajustar(total_libros=1)"""
+    cambios = {campo: F(campo) + delta for campo, delta in deltas.items() if delta}
+    if not cambios:
+        return
+    if not Estadisticas.objects.filter(pk=1).update(**cambios):
+        Estadisticas.objects.get_or_create(pk=1)
+        Estadisticas.objects.filter(pk=1).update(**cambios)
+
+
+def ajustar_genero(genero, delta):
+    """Suma delta al conteo de un género"""
+    if not delta:
+        return
+    if not ConteoGenero.objects.filter(genero=genero).update(total=F('total') + delta):
+        ConteoGenero.objects.get_or_create(genero=genero)
+        ConteoGenero.objects.filter(genero=genero).update(total=F('total') + delta)
+
+
+def _copias_reales(solo_libres=False):
+    """Subconsulta: ejemplares (o ejemplares en estantería) del libro externo"""
+    ejemplares = Ejemplar.objects.filter(libro=OuterRef('pk'))
+    if solo_libres:
+        ejemplares = ejemplares.filter(Ejemplar.EN_ESTANTERIA)
+    return Coalesce(
+        Subquery(ejemplares.order_by().values('libro').annotate(total=Count('id')).values('total')),
+        Value(0),
+    )
+
+
+def recalcular_copias(libro_ids=None):
+    """Recalcula copias_total y copias_disponibles desde los ejemplares (un UPDATE)"""
+    libros = Libro.objects.all() if libro_ids is None else Libro.objects.filter(id__in=libro_ids)
+    return libros.update(
+        copias_total=_copias_reales(),
+        copias_disponibles=_copias_reales(solo_libres=True),
+    )
+
+
+def copias_desfasadas():
+    """Libros cuyos contadores de copias no coinciden con sus ejemplares"""
+    return Libro.objects.alias(
+        total_real=_copias_reales(), libres_reales=_copias_reales(solo_libres=True)
+    ).exclude(copias_total=F('total_real'), copias_disponibles=F('libres_reales'))
+
+
+def calcular_desde_cero():
+    """Cuenta directamente en las tablas. Retorna (contadores, conteo_por_genero)"""
+    multas = MovimientoMulta.objects.aggregate(
+        cargos=Sum('monto', filter=Q(tipo='cargo'), default=Decimal('0.00')),
+        pagos=Sum('monto', filter=Q(tipo='pago'), default=Decimal('0.00')),
+    )
+    contadores = {
+        'total_libros': Libro.objects.count(),
+        'total_usuarios': User.objects.count(),
+        'prestamos_activos': Prestamo.objects.filter(fecha_devolucion_real__isnull=True).count(),
+        'total_multas': multas['cargos'],
+        'saldo_multas': multas['cargos'] - multas['pagos'],
+    }
+    por_genero = dict(
+        Libro.objects.values_list('genero').annotate(total=Count('id')).order_by()
+    )
+    return contadores, por_genero
+
+
+def recalcular():
+    """Reconstruye los contadores a partir de las tablas"""
+    contadores, por_genero = calcular_desde_cero()
+    Estadisticas.objects.update_or_create(pk=1, defaults=contadores)
+    recalcular_copias()
+    ConteoGenero.objects.exclude(genero__in=por_genero).update(total=0)
+    for genero, total in por_genero.items():
+        ConteoGenero.objects.update_or_create(genero=genero, defaults={'total': total})
+    return contadores, por_genero
+
+
+def verificar():
+    """
+    Compara los contadores guardados con los reales.
+    Retorna una lista de (nombre, guardado, real) con las diferencias.
+    """
+    contadores, por_genero = calcular_desde_cero()
+    estadisticas = Estadisticas.obtener()
+    diferencias = [
+        (campo, getattr(estadisticas, campo), real)
+        for campo, real in contadores.items()
+        if getattr(estadisticas, campo) != real
+    ]
+    guardado_por_genero = dict(ConteoGenero.objects.values_list('genero', 'total'))
+    for genero in set(por_genero) | set(guardado_por_genero):
+        guardado = guardado_por_genero.get(genero, 0)
+        real = por_genero.get(genero, 0)
+        if guardado != real:
+            diferencias.append((f'genero:{genero}', guardado, real))
+    desfasados = copias_desfasadas().count()
+    if desfasados:
+        diferencias.append(('libros con copias desfasadas', desfasados, 0))
+    return diferencias
+
+
+def conteo_por_genero():
+    """Géneros con libros, de mayor a menor (formato de values())"""
+    return ConteoGenero.objects.filter(total__gt=0).values('genero', 'total').order_by('-total')
@@ -0,0 +1,79 @@
+import time
+from datetime import date
+
+from django.core.management.base import BaseCommand, CommandError
+from django.db import transaction
+from django.utils import timezone
+
+from gestion.models import EjecucionMultas
+from gestion.multas import acumular_multas
+
+
+class Command(BaseCommand):
+    help = (
+        "Acumula la multa de todos los préstamos vencidos no devueltos con un solo UPDATE. "
+        "Pensado para cron: una ejecución por día (repetirla el mismo día no hace nada)"
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--fecha',
+            help="Fecha de corte AAAA-MM-DD (por defecto, hoy)",
+        )
+        parser.add_argument(
+            '--forzar', action='store_true',
+            help="Vuelve a acumular aunque ya exista una ejecución completada para la fecha",
+        )
+
+    def handle(self, *args, **options):
+        if options['fecha']:
+            try:
+                fecha = date.fromisoformat(options['fecha'])
+            except ValueError:
+                raise CommandError(f"Fecha inválida: '{options['fecha']}' (use AAAA-MM-DD).")
+        else:
+            fecha = timezone.now().date()
+
+        if not options['forzar'] and EjecucionMultas.objects.filter(
+            fecha=fecha, estado=EjecucionMultas.COMPLETADA
+        ).exists():
+            self.stdout.write(f"Las multas del {fecha} ya fueron acumuladas; nada que hacer.")
+            return
+
+        inicio = timezone.now()
+        cronometro = time.monotonic()
+        try:
+            # El UPDATE y su registro se confirman juntos
+            with transaction.atomic():
+                actualizados, total = acumular_multas(fecha)
+                EjecucionMultas.objects.update_or_create(
+                    fecha=fecha,
+                    defaults={
+                        'estado': EjecucionMultas.COMPLETADA,
+                        'inicio': inicio,
+                        'fin': timezone.now(),
+                        'prestamos_actualizados': actualizados,
+                        'total_acumulado': total,
+                        'mensaje': '',
+                    },
+                )
+        except Exception as error:
+            # Un reintento forzado que falla no borra el registro de la ejecución
+            # completada: su acumulación sigue aplicada
+            if not EjecucionMultas.objects.filter(fecha=fecha, estado=EjecucionMultas.COMPLETADA).exists():
+                EjecucionMultas.objects.update_or_create(
+                    fecha=fecha,
+                    defaults={
+                        'estado': EjecucionMultas.FALLIDA,
+                        'inicio': inicio,
+                        'fin': timezone.now(),
+                        'prestamos_actualizados': 0,
+                        'mensaje': str(error),
+                    },
+                )
+            raise CommandError(f"No se pudieron acumular las multas del {fecha}: {error}")
+
+        segundos = time.monotonic() - cronometro
+        self.stdout.write(self.style.SUCCESS(
+            f"Multas del {fecha}: {actualizados} préstamos vencidos, total ${total} en {segundos:.1f} s."
+        ))
@@ -0,0 +1,57 @@
+import time
+
+from django.conf import settings
+from django.core.management.base import BaseCommand, CommandError
+from django.utils import timezone
+
+from gestion.recordatorios import enviar_recordatorios, prestamos_a_recordar
+
+
+class Command(BaseCommand):
+    help = (
+        "Envía por correo los recordatorios de préstamos por vencer y vencidos "
+        "(un recordatorio de cada tipo por préstamo). Pensado para cron"
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--dias', type=int, default=settings.RECORDATORIO_DIAS_ANTES,
+            help="Avisar los préstamos que vencen dentro de estos días (además de los vencidos)",
+        )
+        parser.add_argument(
+            '--lote', type=int, default=100,
+            help="Correos por lote enviado con la misma conexión (por defecto 100)",
+        )
+        parser.add_argument(
+            '--por-segundo', type=float,
+            help="Máximo de correos por segundo (límite del servidor SMTP)",
+        )
+        parser.add_argument(
+            '--maximo', type=int,
+            help="Máximo de correos en esta ejecución; el resto queda para la siguiente",
+        )
+        parser.add_argument(
+            '--simular', action='store_true',
+            help="Solo informa cuántos recordatorios hay pendientes",
+        )
+
+    def handle(self, *args, **options):
+        if options['dias'] < 0 or options['lote'] < 1:
+            raise CommandError("--dias no puede ser negativo y --lote debe ser mayor que cero.")
+        hoy = timezone.now().date()
+
+        if options['simular']:
+            pendientes = prestamos_a_recordar(hoy, options['dias']).count()
+            self.stdout.write(f"{pendientes} recordatorios pendientes.")
+            return
+
+        inicio = time.monotonic()
+        enviados = enviar_recordatorios(
+            hoy,
+            options['dias'],
+            lote=options['lote'],
+            por_segundo=options['por_segundo'],
+            maximo=options['maximo'],
+        )
+        segundos = time.monotonic() - inicio
+        self.stdout.write(self.style.SUCCESS(f"{enviados} recordatorios enviados en {segundos:.1f} s."))
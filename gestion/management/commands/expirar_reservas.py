@@ -0,0 +1,29 @@
+import time
+
+from django.core.management.base import BaseCommand, CommandError
+
+from gestion.reservas import expirar_reservas
+
+
+class Command(BaseCommand):
+    help = (
+        "Expira las reservas cuya copia apartada no se retiró a tiempo y pasa cada copia "
+        "a la siguiente reserva de su cola (o a la estantería). Pensado para cron, p. ej. cada hora"
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--lote', type=int, default=1000,
+            help="Reservas por transacción (por defecto 1000)",
+        )
+
+    def handle(self, *args, **options):
+        if options['lote'] < 1:
+            raise CommandError("--lote debe ser mayor que cero.")
+        cronometro = time.monotonic()
+        expiradas, reasignadas = expirar_reservas(lote=options['lote'])
+        segundos = time.monotonic() - cronometro
+        self.stdout.write(self.style.SUCCESS(
+            f"{expiradas} reservas expiradas, {reasignadas} copias asignadas a la siguiente reserva "
+            f"en {segundos:.1f} s."
+        ))
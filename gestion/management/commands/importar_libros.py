@@ -0,0 +1,254 @@
+import csv
+import hashlib
+import json
+import os
+import time
+from collections import Counter
+
+from django.core.management.base import BaseCommand, CommandError
+from django.db import connection, transaction
+from django.db.models import Max
+
+from gestion import cache_catalogo, estadisticas
+from gestion.busqueda import (
+    normalizar, reconstruir_indice, sincronizacion_suspendida, suspender_sincronizacion,
+)
+from gestion.models import Ejemplar, Libro
+
+MAX_ERRORES_MOSTRADOS = 20
+MAX_COPIAS = 500
+
+
+def _clave(titulo, autor):
+    """
+    Título + autor normalizados (sin tildes, mayúsculas ni espacios repetidos).
+    Se guarda un resumen de 16 bytes en vez del texto para que el conjunto de
+    vistos ocupe poco aun con catálogos grandes; a diferencia de hash(), dos
+    libros distintos no comparten clave en la práctica
+    """
+    normalizado = ' '.join(normalizar(f'{titulo} \x00 {autor}').split())
+    return hashlib.blake2b(normalizado.encode(), digest_size=16).digest()
+
+
+def _generos_validos():
+    """Acepta tanto el código ('no_ficcion') como la etiqueta ('No Ficción')"""
+    generos = {}
+    for codigo, etiqueta in Libro.GENEROS:
+        generos[codigo] = codigo
+        generos[normalizar(etiqueta)] = codigo
+    return generos
+
+
+def _leer_csv(archivo):
+    for fila in csv.DictReader(archivo):
+        yield fila
+
+
+def _leer_jsonl(archivo):
+    for linea in archivo:
+        linea = linea.strip()
+        if not linea:
+            yield None
+            continue
+        try:
+            yield json.loads(linea)
+        except ValueError:
+            yield None
+
+
+def _sql_insertar():
+    tabla = connection.ops.quote_name(Libro._meta.db_table)
+    columnas = ', '.join(
+        connection.ops.quote_name(Libro._meta.get_field(campo).column)
+        for campo in ('titulo', 'autor', 'genero', 'copias_total', 'copias_disponibles')
+    )
+    return f'INSERT INTO {tabla} ({columnas}) VALUES (%s, %s, %s, %s, %s)'
+
+
+def _sql_ejemplares():
+    """
+    Crea los ejemplares de los libros con id > %s en un solo INSERT ... SELECT
+    (una fila por copia, con una serie 1..%s generada por la propia consulta)
+    """
+    nombre = connection.ops.quote_name
+    ejemplar = nombre(Ejemplar._meta.db_table)
+    libro = nombre(Libro._meta.db_table)
+    return (
+        f'INSERT INTO {ejemplar} ({nombre("libro_id")}) '
+        f'WITH RECURSIVE serie(n) AS (SELECT 1 UNION ALL SELECT n + 1 FROM serie WHERE n < %s) '
+        f'SELECT l.{nombre("id")} FROM {libro} l JOIN serie ON serie.n <= l.{nombre("copias_total")} '
+        f'WHERE l.{nombre("id")} > %s'
+    )
+
+
+class Command(BaseCommand):
+    help = (
+        "Importa libros desde un archivo CSV o JSONL (columnas titulo, autor, genero y "
+        "opcionalmente copias) "
+        "leyéndolo en streaming e insertando por lotes"
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('archivo', help="Ruta del archivo .csv o .jsonl")
+        parser.add_argument(
+            '--formato', choices=['csv', 'jsonl'],
+            help="Formato del archivo (por defecto se deduce de la extensión)",
+        )
+        parser.add_argument(
+            '--lote', type=int, default=5000,
+            help="Libros por transacción / INSERT en bloque (por defecto 5000)",
+        )
+        parser.add_argument(
+            '--genero-por-defecto', default='otro',
+            help="Género para las filas sin género (por defecto 'otro')",
+        )
+        parser.add_argument(
+            '--reanudar', action='store_true',
+            help="Continúa desde el último lote confirmado según el archivo de progreso",
+        )
+        parser.add_argument(
+            '--suspender-indice', action='store_true',
+            help=(
+                "Suspende el índice de búsqueda durante la carga y lo reconstruye al final, en vez "
+                "de mantenerlo fila a fila (más rápido para cargas masivas; si el proceso muere, "
+                "la próxima importación o reindexar_libros lo restauran)"
+            ),
+        )
+
+    def handle(self, *args, **options):
+        ruta = options['archivo']
+        if not os.path.exists(ruta):
+            raise CommandError(f"No existe el archivo '{ruta}'.")
+        formato = options['formato'] or ('jsonl' if ruta.endswith(('.jsonl', '.ndjson')) else 'csv')
+        tamano_lote = options['lote']
+        if tamano_lote < 1:
+            raise CommandError("--lote debe ser mayor que cero.")
+
+        generos = _generos_validos()
+        genero_defecto = generos.get(normalizar(options['genero_por_defecto']))
+        if genero_defecto is None:
+            raise CommandError(f"Género por defecto inválido: '{options['genero_por_defecto']}'.")
+
+        # Progreso: filas ya confirmadas, para reanudar tras una falla
+        ruta_progreso = f'{ruta}.progreso'
+        saltar = 0
+        if options['reanudar'] and os.path.exists(ruta_progreso):
+            with open(ruta_progreso) as archivo_progreso:
+                saltar = json.load(archivo_progreso).get('filas', 0)
+            self.stdout.write(f"Reanudando después de la fila {saltar}.")
+
+        # Libros ya existentes (también hace idempotente una reimportación completa)
+        vistos = {
+            _clave(titulo, autor)
+            for titulo, autor in Libro.objects.values_list('titulo', 'autor').iterator(chunk_size=10000)
+        }
+
+        # Una carga anterior con --suspender-indice pudo morir sin restaurar los triggers
+        if sincronizacion_suspendida():
+            self.stderr.write("Faltan los triggers del índice de búsqueda: reconstruyéndolo...")
+            reconstruir_indice()
+
+        self.filas = saltar
+        self.insertados = self.duplicados = self.invalidos = 0
+        self.inicio = time.monotonic()
+        lote = []
+
+        if options['suspender_indice']:
+            suspender_sincronizacion()
+        try:
+            with open(ruta, newline='', encoding='utf-8-sig') as archivo:
+                lector = _leer_jsonl(archivo) if formato == 'jsonl' else _leer_csv(archivo)
+                for numero, fila in enumerate(lector, start=1):
+                    if numero <= saltar:
+                        continue
+                    self.filas = numero
+
+                    libro = self._validar(numero, fila, generos, genero_defecto)
+                    if libro is None:
+                        continue
+                    clave = _clave(libro[0], libro[1])
+                    if clave in vistos:
+                        self.duplicados += 1
+                        continue
+                    vistos.add(clave)
+                    lote.append(libro)
+
+                    if len(lote) >= tamano_lote:
+                        self._guardar(lote, ruta_progreso)
+                        lote = []
+
+            self._guardar(lote, ruta_progreso)
+        finally:
+            # También tras una falla: lo ya confirmado queda buscable
+            # (si el proceso muere, la próxima importación o reindexar_libros lo restauran)
+            if options['suspender_indice']:
+                self.stdout.write("Reconstruyendo el índice de búsqueda...")
+                reconstruir_indice()
+        if os.path.exists(ruta_progreso):
+            os.remove(ruta_progreso)
+
+        segundos = time.monotonic() - self.inicio
+        self.stdout.write(self.style.SUCCESS(
+            f"Importación terminada: {self.insertados} libros nuevos, {self.duplicados} duplicados, "
+            f"{self.invalidos} inválidos en {segundos:.1f} s."
+        ))
+
+    def _validar(self, numero, fila, generos, genero_defecto):
+        """Retorna (titulo, autor, genero, copias, copias) o None si la fila no es válida"""
+        if not isinstance(fila, dict):
+            return self._invalida(numero, "fila ilegible")
+        titulo = str(fila.get('titulo') or '').strip()
+        autor = str(fila.get('autor') or '').strip()
+        genero_texto = str(fila.get('genero') or '').strip()
+        copias_texto = str(fila.get('copias') or '').strip()
+        if not titulo or not autor:
+            return self._invalida(numero, "falta el título o el autor")
+        if len(titulo) > Libro._meta.get_field('titulo').max_length:
+            return self._invalida(numero, "título demasiado largo")
+        if len(autor) > Libro._meta.get_field('autor').max_length:
+            return self._invalida(numero, "autor demasiado largo")
+        genero = generos.get(normalizar(genero_texto)) if genero_texto else genero_defecto
+        if genero is None:
+            return self._invalida(numero, f"género desconocido '{genero_texto}'")
+        copias = int(copias_texto) if copias_texto.isdigit() else (None if copias_texto else 1)
+        if copias is None or not 1 <= copias <= MAX_COPIAS:
+            return self._invalida(numero, f"cantidad de copias inválida '{copias_texto}'")
+        return (titulo, autor, genero, copias, copias)
+
+    def _invalida(self, numero, motivo):
+        self.invalidos += 1
+        if self.invalidos <= MAX_ERRORES_MOSTRADOS:
+            self.stderr.write(f"Fila {numero}: {motivo}")
+        elif self.invalidos == MAX_ERRORES_MOSTRADOS + 1:
+            self.stderr.write("(no se muestran más errores)")
+        return None
+
+    def _guardar(self, lote, ruta_progreso):
+        """
+        Inserta un lote en su propia transacción y registra el avance.
+        Se usa executemany con filas ya validadas en vez de bulk_create: construir
+        un Libro por fila y compilar el INSERT era la mayor parte del tiempo.
+        Los ejemplares se crean con un INSERT ... SELECT sobre los ids nuevos (en
+        SQLite la transacción de escritura impide que se intercalen otros libros).
+        """
+        if lote:
+            with transaction.atomic():
+                ultimo_id = Libro.objects.aggregate(ultimo=Max('id'))['ultimo'] or 0
+                with connection.cursor() as cursor:
+                    cursor.executemany(_sql_insertar(), lote)
+                    cursor.execute(_sql_ejemplares(), [max(libro[3] for libro in lote), ultimo_id])
+                # Sin señales: ajustar contadores y caché aquí
+                estadisticas.ajustar(total_libros=len(lote))
+                for genero, cantidad in Counter(libro[2] for libro in lote).items():
+                    estadisticas.ajustar_genero(genero, cantidad)
+                transaction.on_commit(cache_catalogo.invalidar)
+            self.insertados += len(lote)
+
+        with open(ruta_progreso, 'w') as archivo_progreso:
+            json.dump({'filas': self.filas}, archivo_progreso)
+
+        segundos = max(time.monotonic() - self.inicio, 1e-6)
+        self.stdout.write(
+            f"{self.filas} filas leídas, {self.insertados} insertadas "
+            f"({self.insertados / segundos:,.0f} libros/s)"
+        )
@@ -0,0 +1,161 @@
+import asyncio
+import itertools
+import statistics
+import threading
+import time
+import urllib.error
+import urllib.request
+from concurrent.futures import ThreadPoolExecutor
+from importlib import import_module
+
+from asgiref.sync import ThreadSensitiveContext
+from django.conf import settings
+from django.contrib.auth import BACKEND_SESSION_KEY, HASH_SESSION_KEY, SESSION_KEY
+from django.contrib.auth.models import User
+from django.core.management.base import BaseCommand, CommandError
+from django.test import AsyncClient, Client, override_settings
+from django.urls import reverse
+
+# Vistas async (y la mezcla que se reparte entre las peticiones)
+VISTAS = ('disponibilidad_libros', 'registrar_prestamo', 'panel_usuario')
+
+
+def _resumen(etiqueta, latencias, errores, segundos):
+    latencias = sorted(latencias)
+    p95 = latencias[max(int(len(latencias) * 0.95) - 1, 0)]
+    return (
+        f"{etiqueta}: {len(latencias)} peticiones en {segundos:.2f} s "
+        f"({len(latencias) / segundos:,.0f} req/s), "
+        f"p50 {statistics.median(latencias) * 1000:.1f} ms, p95 {p95 * 1000:.1f} ms, "
+        f"{errores} respuestas distintas de 200"
+    )
+
+
+class Command(BaseCommand):
+    help = (
+        "Compara peticiones por segundo de las vistas async bajo WSGI (hilos) y ASGI "
+        "(tareas asyncio). Sin --servidor usa los handlers de Django en el mismo proceso; "
+        "con --servidor mide un servidor real (p. ej. uvicorn biblioteca.asgi:application "
+        "frente a gunicorn biblioteca.wsgi:application)"
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('usuario', help="Usuario con el que se hacen las peticiones")
+        parser.add_argument(
+            '--peticiones', type=int, default=300,
+            help="Peticiones por modo (por defecto 300)",
+        )
+        parser.add_argument(
+            '--concurrencia', type=int, default=8,
+            help="Hilos (WSGI) o tareas (ASGI) simultáneas (por defecto 8)",
+        )
+        parser.add_argument(
+            '--servidor', action='append', default=[], metavar='URL',
+            help="URL base de un servidor en marcha; se puede repetir para comparar varios",
+        )
+
+    def handle(self, *args, **options):
+        if options['peticiones'] < 1 or options['concurrencia'] < 1:
+            raise CommandError("--peticiones y --concurrencia deben ser mayores que cero.")
+        usuario = User.objects.filter(username=options['usuario'], is_active=True).first()
+        if usuario is None:
+            raise CommandError(f"No existe el usuario activo '{options['usuario']}'.")
+
+        rutas = list(itertools.islice(
+            itertools.cycle(reverse(vista) for vista in VISTAS), options['peticiones']
+        ))
+        concurrencia = options['concurrencia']
+
+        if options['servidor']:
+            cookie = self._cookie_de_sesion(usuario)
+            for servidor in options['servidor']:
+                self.stdout.write(_resumen(
+                    servidor, *self._medir_servidor(servidor.rstrip('/'), cookie, rutas, concurrencia)
+                ))
+            return
+
+        # Los clientes de prueba usan el host 'testserver'
+        with override_settings(ALLOWED_HOSTS=[*settings.ALLOWED_HOSTS, 'testserver']):
+            self.stdout.write(_resumen('WSGI', *self._medir_wsgi(usuario, rutas, concurrencia)))
+            self.stdout.write(_resumen('ASGI', *asyncio.run(self._medir_asgi(usuario, rutas, concurrencia))))
+
+    def _medir_wsgi(self, usuario, rutas, concurrencia):
+        """Un Client (WSGIHandler) por hilo, como los workers con hilos de gunicorn"""
+        locales = threading.local()
+        clientes = []
+
+        def pedir(ruta):
+            if not hasattr(locales, 'cliente'):
+                locales.cliente = Client()
+                locales.cliente.force_login(usuario)
+                clientes.append(locales.cliente)
+            inicio = time.perf_counter()
+            codigo = locales.cliente.get(ruta).status_code
+            return time.perf_counter() - inicio, codigo
+
+        with ThreadPoolExecutor(concurrencia) as hilos:
+            list(hilos.map(pedir, rutas[:concurrencia]))  # calentamiento y sesiones
+            inicio = time.perf_counter()
+            resultados = list(hilos.map(pedir, rutas))
+            segundos = time.perf_counter() - inicio
+        for cliente in clientes:
+            cliente.logout()
+        return [r[0] for r in resultados], sum(r[1] != 200 for r in resultados), segundos
+
+    async def _medir_asgi(self, usuario, rutas, concurrencia):
+        """
+        Tareas asyncio sobre AsyncClient (ASGIHandler). Cada petición va en su propio
+        ThreadSensitiveContext, como hace el servidor ASGI, para que el código síncrono
+        (middleware, ORM) de peticiones distintas no compartan un solo hilo.
+        """
+        cliente = AsyncClient()
+        await cliente.aforce_login(usuario)
+        cola = asyncio.Queue()
+        for ruta in rutas:
+            cola.put_nowait(ruta)
+        resultados = []
+
+        async def trabajador():
+            while not cola.empty():
+                ruta = cola.get_nowait()
+                async with ThreadSensitiveContext():
+                    inicio = time.perf_counter()
+                    codigo = (await cliente.get(ruta)).status_code
+                resultados.append((time.perf_counter() - inicio, codigo))
+
+        for ruta in rutas[:concurrencia]:  # calentamiento
+            async with ThreadSensitiveContext():
+                await cliente.get(ruta)
+        inicio = time.perf_counter()
+        await asyncio.gather(*(trabajador() for _ in range(concurrencia)))
+        segundos = time.perf_counter() - inicio
+        await cliente.alogout()
+        return [r[0] for r in resultados], sum(r[1] != 200 for r in resultados), segundos
+
+    def _medir_servidor(self, base, cookie, rutas, concurrencia):
+        def pedir(ruta):
+            peticion = urllib.request.Request(base + ruta, headers={'Cookie': cookie})
+            inicio = time.perf_counter()
+            try:
+                with urllib.request.urlopen(peticion) as respuesta:
+                    respuesta.read()
+                    codigo = respuesta.status
+            except urllib.error.HTTPError as error:
+                codigo = error.code
+            return time.perf_counter() - inicio, codigo
+
+        with ThreadPoolExecutor(concurrencia) as hilos:
+            list(hilos.map(pedir, rutas[:concurrencia]))
+            inicio = time.perf_counter()
+            resultados = list(hilos.map(pedir, rutas))
+            segundos = time.perf_counter() - inicio
+        return [r[0] for r in resultados], sum(r[1] != 200 for r in resultados), segundos
+
+    def _cookie_de_sesion(self, usuario):
+        """Sesión iniciada para el usuario (lo mismo que hace Client.force_login)"""
+        sesion = import_module(settings.SESSION_ENGINE).SessionStore()
+        sesion[SESSION_KEY] = usuario._meta.pk.value_to_string(usuario)
+        sesion[BACKEND_SESSION_KEY] = settings.AUTHENTICATION_BACKENDS[0]
+        sesion[HASH_SESSION_KEY] = usuario.get_session_auth_hash()
+        sesion.save()
+        return f'{settings.SESSION_COOKIE_NAME}={sesion.session_key}'
@@ -0,0 +1,127 @@
+import os
+import random
+import shutil
+import sqlite3
+import tempfile
+import threading
+import time
+
+from django.conf import settings
+from django.core.management.base import BaseCommand, CommandError
+from django.db import OperationalError, connections, transaction
+
+from gestion.models import Libro
+
+PERFILES = ('desarrollo', 'produccion')
+
+
+class Command(BaseCommand):
+    help = (
+        "Mide lecturas y escrituras por segundo con lectores y escritores concurrentes "
+        "sobre copias de la base, con el perfil de SQLite de desarrollo y el de producción "
+        "(settings.SQLITE_PRODUCCION). La base real no se modifica"
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--segundos', type=float, default=5, help="Duración por perfil (por defecto 5)")
+        parser.add_argument('--lectores', type=int, default=8, help="Hilos lectores (por defecto 8)")
+        parser.add_argument('--escritores', type=int, default=2, help="Hilos escritores (por defecto 2)")
+        parser.add_argument(
+            '--reconectar', action='store_true',
+            help="Abre una conexión por operación (como CONN_MAX_AGE=0) en vez de reutilizarla",
+        )
+
+    def handle(self, *args, **options):
+        if options['segundos'] <= 0 or options['lectores'] < 0 or options['escritores'] < 0:
+            raise CommandError("--segundos debe ser positivo y los hilos no pueden ser negativos.")
+        if connections['default'].vendor != 'sqlite':
+            raise CommandError("Este comando solo mide bases SQLite.")
+        ids = list(Libro.objects.values_list('id', flat=True)[:10000])
+        if not ids:
+            raise CommandError("El catálogo está vacío: carga libros primero (importar_libros).")
+
+        directorio = tempfile.mkdtemp(prefix='medir_sqlite_')
+        try:
+            for perfil in PERFILES:
+                alias = self._preparar(perfil, directorio)
+                try:
+                    lecturas, escrituras, bloqueos, segundos = self._medir(alias, ids, options)
+                finally:
+                    connections[alias].close()
+                    del connections.settings[alias]
+                self.stdout.write(
+                    f"{perfil}: {lecturas / segundos:,.0f} lecturas/s, {escrituras / segundos:,.0f} "
+                    f"escrituras/s, {bloqueos} errores \"database is locked\""
+                )
+        finally:
+            shutil.rmtree(directorio, ignore_errors=True)
+
+    def _preparar(self, perfil, directorio):
+        """Copia la base (API de respaldo de SQLite) y registra un alias con el perfil"""
+        ruta = os.path.join(directorio, f'{perfil}.sqlite3')
+        origen = connections['default']
+        origen.ensure_connection()
+        destino = sqlite3.connect(ruta)
+        try:
+            origen.connection.backup(destino)
+            # El modo WAL queda guardado en el archivo copiado: partir siempre del modo por defecto
+            destino.execute('PRAGMA journal_mode = DELETE')
+        finally:
+            destino.close()
+
+        configuracion = {**origen.settings_dict, 'NAME': ruta, 'OPTIONS': {}, 'PRAGMAS': {}}
+        if perfil == 'produccion':
+            configuracion.update(settings.SQLITE_PRODUCCION)
+        alias = f'medir_{perfil}'
+        connections.settings[alias] = configuracion
+        return alias
+
+    def _medir(self, alias, ids, options):
+        totales = {'lecturas': 0, 'escrituras': 0, 'bloqueos': 0}
+        candado = threading.Lock()
+        fin = time.monotonic() + options['segundos']
+
+        def leer(azar):
+            # Lo que hace el catálogo: una página por título y un libro puntual
+            list(Libro.objects.using(alias).order_by('titulo').values_list('id', 'titulo')[:25])
+            Libro.objects.using(alias).filter(pk=azar.choice(ids)).values_list('copias_disponibles').first()
+
+        def escribir(azar):
+            # Lee y luego escribe en la misma transacción (como un préstamo): con BEGIN
+            # diferido, dos escritores así chocan al pasar de lectura a escritura
+            libro_id = azar.choice(ids)
+            with transaction.atomic(using=alias):
+                copias = Libro.objects.using(alias).filter(pk=libro_id).values_list(
+                    'copias_disponibles', flat=True
+                ).first()
+                Libro.objects.using(alias).filter(pk=libro_id).update(copias_disponibles=copias)
+
+        def trabajar(operacion, contador):
+            azar = random.Random()
+            hechas = bloqueos = 0
+            try:
+                while time.monotonic() < fin:
+                    try:
+                        operacion(azar)
+                        hechas += 1
+                    except OperationalError as error:
+                        if 'locked' not in str(error):
+                            raise
+                        bloqueos += 1
+                    if options['reconectar']:
+                        connections[alias].close()
+            finally:
+                connections[alias].close()
+                with candado:
+                    totales[contador] += hechas
+                    totales['bloqueos'] += bloqueos
+
+        hilos = [threading.Thread(target=trabajar, args=(leer, 'lecturas')) for _ in range(options['lectores'])]
+        hilos += [threading.Thread(target=trabajar, args=(escribir, 'escrituras')) for _ in range(options['escritores'])]
+        inicio = time.monotonic()
+        for hilo in hilos:
+            hilo.start()
+        for hilo in hilos:
+            hilo.join()
+        segundos = time.monotonic() - inicio
+        return totales['lecturas'], totales['escrituras'], totales['bloqueos'], segundos
@@ -0,0 +1,32 @@
+from django.core.management.base import BaseCommand, CommandError
+from django.db import transaction
+
+from gestion import estadisticas
+
+
+class Command(BaseCommand):
+    help = "Reconstruye los contadores de los dashboards desde las tablas, o los verifica"
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--verificar',
+            action='store_true',
+            help="Solo compara los contadores con los datos reales, sin modificarlos",
+        )
+
+    def handle(self, *args, **options):
+        if options['verificar']:
+            diferencias = estadisticas.verificar()
+            if diferencias:
+                for nombre, guardado, real in diferencias:
+                    self.stderr.write(f"{nombre}: guardado={guardado} real={real}")
+                raise CommandError(f"{len(diferencias)} contador(es) no coinciden.")
+            self.stdout.write(self.style.SUCCESS("Los contadores coinciden con los datos."))
+            return
+
+        with transaction.atomic():
+            contadores, por_genero = estadisticas.recalcular()
+        for nombre, valor in contadores.items():
+            self.stdout.write(f"{nombre}: {valor}")
+        self.stdout.write(f"géneros: {len(por_genero)}")
+        self.stdout.write(self.style.SUCCESS("Contadores reconstruidos."))
@@ -0,0 +1,62 @@
+import sqlite3
+import time
+
+from django.core.management.base import BaseCommand, CommandError
+from django.db import DEFAULT_DB_ALIAS, connections
+
+from gestion import replica
+
+
+class Command(BaseCommand):
+    help = (
+        "Copia la base principal sobre la réplica de solo lectura de los reportes "
+        "(API de respaldo de SQLite, sin detener a lectores ni escritores). Pensado "
+        "para cron, p. ej. cada minuto, o con --cada como proceso permanente"
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--cada', type=float, metavar='SEGUNDOS',
+            help="Repite la copia cada tantos segundos en vez de copiar una vez",
+        )
+
+    def handle(self, *args, **options):
+        if replica.ALIAS not in connections.settings:
+            raise CommandError("No hay réplica configurada (BIBLIOTECA_REPLICA=1).")
+        origen = connections[DEFAULT_DB_ALIAS]
+        if origen.vendor != 'sqlite' or connections[replica.ALIAS].vendor != 'sqlite':
+            raise CommandError("La réplica por copia solo funciona con SQLite.")
+        if options['cada'] is not None and options['cada'] <= 0:
+            raise CommandError("--cada debe ser mayor que cero.")
+
+        while True:
+            cronometro = time.monotonic()
+            try:
+                paginas = self._copiar(origen, connections[replica.ALIAS].settings_dict['NAME'])
+            except sqlite3.OperationalError as error:
+                # P. ej. la réplica ocupada más allá del timeout: con --cada se reintenta
+                # en la siguiente vuelta en vez de dejar la réplica sin actualizar
+                if options['cada'] is None:
+                    raise CommandError(f"No se pudo copiar la réplica: {error}")
+                self.stderr.write(f"No se pudo copiar la réplica ({error}); se reintenta en {options['cada']} s.")
+            else:
+                self.stdout.write(self.style.SUCCESS(
+                    f"Réplica actualizada: {paginas} páginas en {time.monotonic() - cronometro:.2f} s."
+                ))
+            if options['cada'] is None:
+                break
+            time.sleep(options['cada'])
+
+    def _copiar(self, origen, ruta):
+        """
+        Copia en el mismo archivo (no en uno nuevo que lo reemplace): las conexiones
+        persistentes de la réplica ven los datos nuevos sin reabrirse. La copia se
+        hace en un solo paso, así que un lector ve la versión anterior o la nueva.
+        """
+        origen.ensure_connection()
+        destino = sqlite3.connect(ruta, timeout=30)
+        try:
+            origen.connection.backup(destino)
+            return destino.execute('PRAGMA page_count').fetchone()[0]
+        finally:
+            destino.close()
@@ -0,0 +1,400 @@
+import random
+import time
+from array import array
+from collections import Counter
+from datetime import datetime, timedelta
+from decimal import Decimal
+
+from django.contrib.auth.hashers import make_password
+from django.contrib.auth.models import User
+from django.core.management.base import BaseCommand, CommandError
+from django.db import IntegrityError, connection, transaction
+from django.db.models import Max
+from django.utils import timezone
+
+from cuentas.models import PerfilUsuario
+from cuentas.validadores import digito_verificador
+from gestion import cache_catalogo, estadisticas
+from gestion.busqueda import reconstruir_indice, suspender_sincronizacion
+from gestion.models import Ejemplar, Libro, MovimientoMulta, Prestamo, SaldoMulta
+from gestion.multas import MULTA_POR_DIA
+
+INICIOS = (
+    'El', 'La', 'Los', 'Las', 'Un', 'Una', 'Crónica de', 'Historia de', 'Memorias de',
+    'El último', 'La otra', 'Breve tratado de', 'Cartas de', 'El regreso de',
+)
+NUCLEOS = (
+    'jardín', 'sombra', 'ciudad', 'río', 'silencio', 'viaje', 'noche', 'casa', 'guerra',
+    'invierno', 'mar', 'desierto', 'espejo', 'bosque', 'tiempo', 'isla', 'camino', 'fuego',
+    'memoria', 'montaña', 'puerto', 'biblioteca', 'laberinto', 'tormenta',
+)
+COMPLEMENTOS = (
+    'de los olvidados', 'sin nombre', 'del sur', 'de cristal', 'en llamas', 'perdido',
+    'de las horas', 'del norte', 'de papel', 'infinito', 'de sal', 'a medianoche', '',
+)
+NOMBRES = (
+    'Ana', 'Benjamín', 'Camila', 'Diego', 'Elena', 'Felipe', 'Gabriela', 'Héctor', 'Isabel',
+    'Javiera', 'Martín', 'Lucía', 'Matías', 'Valentina', 'Tomás', 'Sofía', 'Vicente', 'Josefa',
+)
+APELLIDOS = (
+    'González', 'Muñoz', 'Rojas', 'Díaz', 'Pérez', 'Soto', 'Contreras', 'Silva', 'Martínez',
+    'Sepúlveda', 'Morales', 'Rodríguez', 'López', 'Fuentes', 'Hernández', 'Torres', 'Araya',
+)
+CALLES = ('Av. Providencia', 'Los Aromos', 'San Martín', 'O\'Higgins', 'Los Carrera', 'Pedro de Valdivia')
+
+# Copias por libro: la mayoría tiene una o dos
+COPIAS = (1, 1, 1, 2, 2, 3, 4)
+PLAZOS = (7, 14)
+# Un préstamo vencido hace más días que esto ya se devolvió (los vencidos sin devolver son recientes)
+MAX_DIAS_VENCIDO = 90
+# Los RUT sembrados se toman de este rango (personas naturales)
+RUT_DESDE, RUT_HASTA = 5_000_000, 26_000_000
+
+
+def _sin_tildes(texto):
+    return texto.lower().translate(str.maketrans('áéíóúñ', 'aeioun'))
+
+
+class Command(BaseCommand):
+    help = (
+        "Puebla la base con datos sintéticos a escala (libros con sus ejemplares, lectores "
+        "con RUT válido e historial de préstamos con atrasos, multas y pagos) para reproducir "
+        "localmente el volumen de producción. Con la misma semilla sobre la misma base genera "
+        "los mismos datos"
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--libros', type=int, default=10000, help="Libros a crear (por defecto 10000)")
+        parser.add_argument('--usuarios', type=int, default=2000, help="Lectores a crear (por defecto 2000)")
+        parser.add_argument(
+            '--prestamos-por-usuario', type=float, default=8,
+            help="Préstamos promedio en el historial de cada lector (por defecto 8)",
+        )
+        parser.add_argument(
+            '--dias', type=int, default=730,
+            help="Antigüedad máxima del historial en días (por defecto 730)",
+        )
+        parser.add_argument(
+            '--atrasados', type=float, default=0.12,
+            help="Fracción de devoluciones hechas con atraso (por defecto 0.12)",
+        )
+        parser.add_argument(
+            '--vencidos', type=float, default=0.05,
+            help="Fracción de préstamos ya vencidos que siguen sin devolverse (por defecto 0.05)",
+        )
+        parser.add_argument(
+            '--pagados', type=float, default=0.6,
+            help="Fracción de lectores con multas que ya pagaron su saldo (por defecto 0.6)",
+        )
+        parser.add_argument('--semilla', type=int, default=1, help="Semilla del generador (por defecto 1)")
+        parser.add_argument(
+            '--lote', type=int, default=5000,
+            help="Libros o lectores por transacción (por defecto 5000)",
+        )
+        parser.add_argument(
+            '--contrasena', default='Sembrado1!',
+            help="Contraseña de todos los lectores creados (se hashea una sola vez)",
+        )
+
+    def handle(self, *args, **options):
+        if min(options['libros'], options['usuarios'], options['dias']) < 0 or options['lote'] < 1:
+            raise CommandError("Las cantidades no pueden ser negativas y --lote debe ser mayor que cero.")
+        for opcion in ('atrasados', 'vencidos', 'pagados'):
+            if not 0 <= options[opcion] <= 1:
+                raise CommandError(f"--{opcion} debe estar entre 0 y 1.")
+        if options['usuarios'] and options['prestamos_por_usuario'] > 0 and not options['libros']:
+            raise CommandError("Los préstamos se hacen sobre los libros sembrados: use --libros mayor que cero.")
+
+        self.opciones = options
+        self.azar = random.Random(options['semilla'])
+        self.hoy = timezone.localdate()
+        self.inicio = time.monotonic()
+        self.totales = Counter()
+
+        # Por libro sembrado (en orden): id, primer ejemplar, copias y copias prestadas.
+        # Los ejemplares de cada libro se insertan seguidos, así que sus ids son consecutivos
+        self.libro_ids, self.primer_ejemplar = array('q'), array('q')
+        self.copias, self.prestadas = array('b'), array('b')
+
+        suspender_sincronizacion()
+        try:
+            for desde in range(0, options['libros'], options['lote']):
+                self._sembrar_libros(min(options['lote'], options['libros'] - desde))
+        finally:
+            self.stdout.write("Reconstruyendo el índice de búsqueda...")
+            reconstruir_indice()
+
+        contrasena = make_password(options['contrasena'])
+        self.ruts = self._ruts_libres(options['usuarios'])
+        self.siguiente_usuario = (User.objects.aggregate(ultimo=Max('id'))['ultimo'] or 0) + 1
+        for desde in range(0, options['usuarios'], options['lote']):
+            self._sembrar_lectores(min(options['lote'], options['usuarios'] - desde), contrasena)
+
+        segundos = time.monotonic() - self.inicio
+        self.stdout.write(self.style.SUCCESS(
+            f"Siembra terminada en {segundos:.1f} s: {self.totales['libros']} libros "
+            f"({self.totales['ejemplares']} ejemplares), {self.totales['usuarios']} lectores, "
+            f"{self.totales['prestamos']} préstamos ({self.totales['activos']} activos, "
+            f"{self.totales['vencidos']} vencidos), {self.totales['cargos']} multas. "
+            f"Contraseña de los lectores: {options['contrasena']}"
+        ))
+
+    def _progreso(self, que):
+        segundos = max(time.monotonic() - self.inicio, 1e-6)
+        filas = sum(self.totales[tabla] for tabla in ('libros', 'ejemplares', 'usuarios', 'prestamos', 'cargos'))
+        self.stdout.write(f"{self.totales[que]} {que} ({filas / segundos:,.0f} filas/s)")
+
+    def _nuevos_ids(self, modelo, ultimo_id):
+        return list(modelo.objects.filter(id__gt=ultimo_id).order_by('id').values_list('id', flat=True))
+
+    def _sembrar_libros(self, cantidad):
+        """
+        Un lote de libros y sus ejemplares con executemany, como importar_libros
+        (bulk_create pasaba la mayor parte del tiempo construyendo instancias).
+        Las copias_disponibles se descuentan después, al sembrar los préstamos activos.
+        """
+        azar = self.azar
+        generos = [codigo for codigo, _ in Libro.GENEROS]
+        libros = []
+        for _ in range(cantidad):
+            titulo = f'{azar.choice(INICIOS)} {azar.choice(NUCLEOS)} {azar.choice(COMPLEMENTOS)}'.strip()
+            autor = f'{azar.choice(NOMBRES)} {azar.choice(APELLIDOS)} {azar.choice(APELLIDOS)}'
+            copias = azar.choice(COPIAS)
+            libros.append((titulo, autor, azar.choice(generos), copias, copias))
+
+        nombre = connection.ops.quote_name
+        with transaction.atomic():
+            ultimo_libro = Libro.objects.aggregate(ultimo=Max('id'))['ultimo'] or 0
+            ultimo_ejemplar = Ejemplar.objects.aggregate(ultimo=Max('id'))['ultimo'] or 0
+            with connection.cursor() as cursor:
+                cursor.executemany(
+                    f'INSERT INTO {nombre(Libro._meta.db_table)} '
+                    f'({nombre("titulo")}, {nombre("autor")}, {nombre("genero")}, '
+                    f'{nombre("copias_total")}, {nombre("copias_disponibles")}) VALUES (%s, %s, %s, %s, %s)',
+                    libros,
+                )
+                libro_ids = self._nuevos_ids(Libro, ultimo_libro)
+                cursor.executemany(
+                    f'INSERT INTO {nombre(Ejemplar._meta.db_table)} ({nombre("libro_id")}) VALUES (%s)',
+                    [(libro_id,) for libro_id, libro in zip(libro_ids, libros) for _ in range(libro[3])],
+                )
+            ejemplar_ids = self._nuevos_ids(Ejemplar, ultimo_ejemplar)
+            # Sin señales: ajustar contadores y caché aquí
+            estadisticas.ajustar(total_libros=len(libros))
+            for genero, total in Counter(libro[2] for libro in libros).items():
+                estadisticas.ajustar_genero(genero, total)
+            transaction.on_commit(cache_catalogo.invalidar)
+
+        posicion = 0
+        for libro_id, libro in zip(libro_ids, libros):
+            self.libro_ids.append(libro_id)
+            self.primer_ejemplar.append(ejemplar_ids[posicion])
+            self.copias.append(libro[3])
+            self.prestadas.append(0)
+            posicion += libro[3]
+        self.totales['libros'] += len(libros)
+        self.totales['ejemplares'] += len(ejemplar_ids)
+        self._progreso('libros')
+
+    def _ruts_libres(self, cantidad):
+        """Números de RUT distintos, sin repetir los ya registrados"""
+        registrados = set(PerfilUsuario.objects.values_list('rut', flat=True).iterator(chunk_size=10000))
+        ruts = []
+        while len(ruts) < cantidad:
+            for numero in self.azar.sample(range(RUT_DESDE, RUT_HASTA), cantidad - len(ruts)):
+                rut = f'{numero}{digito_verificador(numero)}'
+                if rut not in registrados:
+                    registrados.add(rut)
+                    ruts.append(rut)
+        return ruts
+
+    def _sembrar_lectores(self, cantidad, contrasena):
+        """Un lote de lectores con su historial de préstamos, multas y pagos (una transacción)"""
+        azar = self.azar
+        usuarios, perfiles = [], []
+        fecha_alta = timezone.now() - timedelta(days=self.opciones['dias'])
+        for _ in range(cantidad):
+            indice = self.siguiente_usuario
+            self.siguiente_usuario += 1
+            nombre, apellido = azar.choice(NOMBRES), azar.choice(APELLIDOS)
+            username = f'{_sin_tildes(nombre)}_{_sin_tildes(apellido)}_{indice}'
+            usuarios.append(User(
+                username=username,
+                email=f'{username}@ejemplo.cl',
+                first_name=nombre,
+                last_name=apellido,
+                password=contrasena,
+                date_joined=fecha_alta,
+            ))
+            perfiles.append(dict(
+                rut=self.ruts.pop(),
+                direccion=f'{azar.choice(CALLES)} {azar.randint(1, 9999)}',
+                telefono=f'9{azar.randint(10000000, 99999999)}',
+            ))
+
+        try:
+            with transaction.atomic():
+                usuarios = User.objects.bulk_create(usuarios, batch_size=self.opciones['lote'])
+                PerfilUsuario.objects.bulk_create([
+                    PerfilUsuario(usuario=usuario, rol='lector', **perfil)
+                    for usuario, perfil in zip(usuarios, perfiles)
+                ], batch_size=self.opciones['lote'])
+                estadisticas.ajustar(total_usuarios=len(usuarios))
+                self._sembrar_prestamos([usuario.pk for usuario in usuarios])
+        except IntegrityError as error:
+            raise CommandError(
+                f"Conflicto con datos existentes ({error}); pruebe con otra --semilla o una base vacía."
+            )
+        self.totales['usuarios'] += len(usuarios)
+        self._progreso('usuarios')
+
+    def _historial(self):
+        """
+        Préstamos de un lector: (indice_libro, ejemplar_id, fecha_prestamo, esperada,
+        real, multa, multa_acumulada). Los que aún no vencen siguen activos; de los vencidos
+        recientes, la fracción --vencidos sigue sin devolverse. De los devueltos, la fracción
+        --atrasados se devolvió tarde. Un préstamo activo necesita una copia libre y no
+        repetir libro con otro activo del lector.
+        """
+        azar = self.azar
+        opciones = self.opciones
+        media = opciones['prestamos_por_usuario']
+        cantidad = azar.randint(0, round(2 * media)) if media > 0 else 0
+        activos_del_usuario = set()
+        for _ in range(cantidad):
+            indice = azar.randrange(len(self.libro_ids))
+            prestamo = self.hoy - timedelta(days=azar.randint(0, opciones['dias']))
+            esperada = prestamo + timedelta(days=azar.choice(PLAZOS))
+            activo = esperada >= self.hoy or (
+                (self.hoy - esperada).days <= MAX_DIAS_VENCIDO and azar.random() < opciones['vencidos']
+            )
+            if activo and (
+                indice in activos_del_usuario or self.prestadas[indice] >= self.copias[indice]
+            ):
+                activo = False
+            if activo:
+                activos_del_usuario.add(indice)
+                ejemplar_id = self.primer_ejemplar[indice] + self.prestadas[indice]
+                self.prestadas[indice] += 1
+                atraso = (self.hoy - esperada).days
+                acumulada = MULTA_POR_DIA * atraso if atraso > 0 else Decimal('0.00')
+                yield indice, ejemplar_id, prestamo, esperada, None, Decimal('0.00'), acumulada
+                continue
+            plazo = (esperada - prestamo).days
+            if azar.random() < opciones['atrasados']:
+                real = min(esperada + timedelta(days=azar.randint(1, 30)), self.hoy)
+            else:
+                real = min(prestamo + timedelta(days=azar.randint(0, plazo)), self.hoy)
+            atraso = max((real - esperada).days, 0)
+            yield indice, None, prestamo, esperada, real, MULTA_POR_DIA * atraso, Decimal('0.00')
+
+    def _sembrar_prestamos(self, usuario_ids):
+        """
+        Inserta el historial de los lectores del lote y deja los contadores como los
+        dejarían préstamos y devoluciones reales: ejemplar marcado y copia descontada
+        por cada activo, un cargo por cada multa, saldos y estadísticas.
+        """
+        if not self.libro_ids:
+            return
+        ops = connection.ops
+        filas, historial = [], []
+        for usuario_id in usuario_ids:
+            for indice, ejemplar_id, prestamo, esperada, real, multa, acumulada in self._historial():
+                filas.append((
+                    usuario_id, self.libro_ids[indice], ejemplar_id,
+                    ops.adapt_datefield_value(prestamo), ops.adapt_datefield_value(esperada),
+                    ops.adapt_datefield_value(real), str(multa), str(acumulada),
+                ))
+                historial.append((usuario_id, indice, ejemplar_id, esperada, real, multa))
+        if not filas:
+            return
+
+        nombre = ops.quote_name
+        campos = (
+            'usuario_id', 'libro_id', 'ejemplar_id', 'fecha_prestamo', 'fecha_devolucion_esperada',
+            'fecha_devolucion_real', 'multa', 'multa_acumulada',
+        )
+        ultimo_prestamo = Prestamo.objects.aggregate(ultimo=Max('id'))['ultimo'] or 0
+        with connection.cursor() as cursor:
+            cursor.executemany(
+                f'INSERT INTO {nombre(Prestamo._meta.db_table)} ({", ".join(map(nombre, campos))}) '
+                f'VALUES ({", ".join(["%s"] * len(campos))})',
+                filas,
+            )
+            prestamo_ids = self._nuevos_ids(Prestamo, ultimo_prestamo)
+
+            activos = [
+                (prestamo_id, ejemplar_id)
+                for prestamo_id, (_, _, ejemplar_id, _, real, _) in zip(prestamo_ids, historial)
+                if real is None
+            ]
+            cursor.executemany(
+                f'UPDATE {nombre(Ejemplar._meta.db_table)} SET {nombre("prestamo_activo_id")} = %s '
+                f'WHERE {nombre("id")} = %s',
+                activos,
+            )
+            prestadas = Counter(self.libro_ids[indice] for _, indice, _, _, real, _ in historial if real is None)
+            cursor.executemany(
+                f'UPDATE {nombre(Libro._meta.db_table)} '
+                f'SET {nombre("copias_disponibles")} = {nombre("copias_disponibles")} - %s '
+                f'WHERE {nombre("id")} = %s',
+                [(total, libro_id) for libro_id, total in prestadas.items()],
+            )
+
+        self._sembrar_multas(prestamo_ids, historial)
+        estadisticas.ajustar(prestamos_activos=len(activos))
+        transaction.on_commit(cache_catalogo.invalidar)
+        self.totales['prestamos'] += len(filas)
+        self.totales['activos'] += len(activos)
+        self.totales['vencidos'] += sum(1 for *_, esperada, real, _ in historial if real is None and esperada < self.hoy)
+
+    def _sembrar_multas(self, prestamo_ids, historial):
+        """
+        Un cargo por devolución atrasada y, para la fracción --pagados de los lectores
+        con multas, un pago por todo su saldo. Los movimientos van con executemany:
+        bulk_create pondría la fecha de hoy (auto_now_add) en vez de la de la devolución.
+        """
+        ops = connection.ops
+        movimientos, saldos = [], []
+        por_usuario = {}
+        for prestamo_id, (usuario_id, *_, real, multa) in zip(prestamo_ids, historial):
+            if multa > 0:
+                por_usuario.setdefault(usuario_id, []).append((prestamo_id, real, multa))
+        for usuario_id, cargos in por_usuario.items():
+            cargado = sum((multa for _, _, multa in cargos), Decimal('0.00'))
+            for prestamo_id, real, multa in cargos:
+                movimientos.append((
+                    usuario_id, prestamo_id, 'cargo', str(multa),
+                    f'Atraso de {int(multa / MULTA_POR_DIA)} días', self._momento(real),
+                ))
+            pagado = cargado if self.azar.random() < self.opciones['pagados'] else Decimal('0.00')
+            if pagado:
+                ultima = max(real for _, real, _ in cargos)
+                movimientos.append((usuario_id, None, 'pago', str(pagado), 'Pago en mesón', self._momento(ultima)))
+            saldos.append((usuario_id, str(cargado - pagado), str(cargado), str(pagado)))
+        if not saldos:
+            return
+
+        nombre = ops.quote_name
+        with connection.cursor() as cursor:
+            cursor.executemany(
+                f'INSERT INTO {nombre(MovimientoMulta._meta.db_table)} ({nombre("usuario_id")}, '
+                f'{nombre("prestamo_id")}, {nombre("tipo")}, {nombre("monto")}, {nombre("descripcion")}, '
+                f'{nombre("fecha")}) VALUES (%s, %s, %s, %s, %s, %s)',
+                movimientos,
+            )
+            cursor.executemany(
+                f'INSERT INTO {nombre(SaldoMulta._meta.db_table)} ({nombre("usuario_id")}, {nombre("saldo")}, '
+                f'{nombre("total_cargado")}, {nombre("total_pagado")}) VALUES (%s, %s, %s, %s)',
+                saldos,
+            )
+        total = sum((Decimal(saldo[2]) for saldo in saldos), Decimal('0.00'))
+        pendiente = sum((Decimal(saldo[1]) for saldo in saldos), Decimal('0.00'))
+        estadisticas.ajustar(total_multas=total, saldo_multas=pendiente)
+        self.totales['cargos'] += sum(len(cargos) for cargos in por_usuario.values())
+
+    def _momento(self, fecha):
+        """Mediodía de la fecha, como lo guarda un DateTimeField"""
+        return connection.ops.adapt_datetimefield_value(
+            timezone.make_aware(datetime(fecha.year, fecha.month, fecha.day, 12))
+        )
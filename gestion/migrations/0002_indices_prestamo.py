@@ -0,0 +1,39 @@
+# Generated by Django 5.2.8 on 2026-10-18 06:42
+
+from django.conf import settings
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('gestion', '0001_initial'),
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+    ]
+
+    operations = [
+        migrations.AddIndex(
+            model_name='prestamo',
+            index=models.Index(condition=models.Q(('fecha_devolucion_real__isnull', True)), fields=['fecha_devolucion_esperada'], name='prestamo_activo_venc_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='prestamo',
+            index=models.Index(condition=models.Q(('fecha_devolucion_real__isnull', True)), fields=['fecha_prestamo'], name='prestamo_activo_fecha_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='prestamo',
+            index=models.Index(condition=models.Q(('fecha_devolucion_real__isnull', True)), fields=['usuario', 'fecha_devolucion_esperada'], name='prestamo_activo_usuario_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='prestamo',
+            index=models.Index(fields=['usuario', '-fecha_devolucion_real'], name='prestamo_historial_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='prestamo',
+            index=models.Index(condition=models.Q(('multa__gt', 0)), fields=['-fecha_devolucion_real'], name='prestamo_multa_idx'),
+        ),
+        migrations.AddConstraint(
+            model_name='prestamo',
+            constraint=models.UniqueConstraint(condition=models.Q(('fecha_devolucion_real__isnull', True)), fields=('libro',), name='prestamo_activo_unico_libro'),
+        ),
+    ]
@@ -0,0 +1,63 @@
+from django.db import migrations
+
+
+CREAR_FTS = [
+    """
+    CREATE VIRTUAL TABLE IF NOT EXISTS gestion_libro_fts USING fts5(
+        titulo, autor, genero,
+        content='gestion_libro',
+        content_rowid='id',
+        tokenize='unicode61 remove_diacritics 2'
+    )
+    """,
+    """
+    CREATE TRIGGER IF NOT EXISTS gestion_libro_fts_ai AFTER INSERT ON gestion_libro BEGIN
+        INSERT INTO gestion_libro_fts(rowid, titulo, autor, genero)
+        VALUES (new.id, new.titulo, new.autor, new.genero);
+    END
+    """,
+    """
+    CREATE TRIGGER IF NOT EXISTS gestion_libro_fts_ad AFTER DELETE ON gestion_libro BEGIN
+        INSERT INTO gestion_libro_fts(gestion_libro_fts, rowid, titulo, autor, genero)
+        VALUES ('delete', old.id, old.titulo, old.autor, old.genero);
+    END
+    """,
+    """
+    CREATE TRIGGER IF NOT EXISTS gestion_libro_fts_au AFTER UPDATE OF titulo, autor, genero ON gestion_libro BEGIN
+        INSERT INTO gestion_libro_fts(gestion_libro_fts, rowid, titulo, autor, genero)
+        VALUES ('delete', old.id, old.titulo, old.autor, old.genero);
+        INSERT INTO gestion_libro_fts(rowid, titulo, autor, genero)
+        VALUES (new.id, new.titulo, new.autor, new.genero);
+    END
+    """,
+    # Indexar los libros que ya existían
+    "INSERT INTO gestion_libro_fts(gestion_libro_fts) VALUES('rebuild')",
+]
+
+ELIMINAR_FTS = [
+    "DROP TRIGGER IF EXISTS gestion_libro_fts_au",
+    "DROP TRIGGER IF EXISTS gestion_libro_fts_ad",
+    "DROP TRIGGER IF EXISTS gestion_libro_fts_ai",
+    "DROP TABLE IF EXISTS gestion_libro_fts",
+]
+
+
+def ejecutar(sentencias):
+    def _ejecutar(apps, schema_editor):
+        # FTS5 solo existe en SQLite; en otros motores la búsqueda usa icontains
+        if schema_editor.connection.vendor != 'sqlite':
+            return
+        for sentencia in sentencias:
+            schema_editor.execute(sentencia)
+    return _ejecutar
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('gestion', '0002_indices_prestamo'),
+    ]
+
+    operations = [
+        migrations.RunPython(ejecutar(CREAR_FTS), ejecutar(ELIMINAR_FTS)),
+    ]
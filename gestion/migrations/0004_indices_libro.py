@@ -0,0 +1,21 @@
+# Generated by Django 5.2.8 on 2026-10-18 06:44
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('gestion', '0003_libro_fts'),
+    ]
+
+    operations = [
+        migrations.AddIndex(
+            model_name='libro',
+            index=models.Index(fields=['titulo'], name='libro_titulo_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='libro',
+            index=models.Index(fields=['disponible', 'titulo'], name='libro_disponible_titulo_idx'),
+        ),
+    ]
@@ -0,0 +1,60 @@
+# Generated by Django 5.2.8 on 2026-10-18 06:45
+
+from django.conf import settings
+from django.db import migrations, models
+from django.db.models import Count
+
+
+def calcular_estadisticas(apps, schema_editor):
+    Libro = apps.get_model('gestion', 'Libro')
+    Prestamo = apps.get_model('gestion', 'Prestamo')
+    User = apps.get_model(settings.AUTH_USER_MODEL)
+    Estadisticas = apps.get_model('gestion', 'Estadisticas')
+    ConteoGenero = apps.get_model('gestion', 'ConteoGenero')
+
+    Estadisticas.objects.update_or_create(pk=1, defaults={
+        'total_libros': Libro.objects.count(),
+        'total_usuarios': User.objects.count(),
+        'prestamos_activos': Prestamo.objects.filter(fecha_devolucion_real__isnull=True).count(),
+    })
+    por_genero = Libro.objects.values_list('genero').annotate(total=Count('id')).order_by()
+    ConteoGenero.objects.bulk_create([
+        ConteoGenero(genero=genero, total=total) for genero, total in por_genero
+    ])
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('gestion', '0004_indices_libro'),
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='ConteoGenero',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('genero', models.CharField(choices=[('ficcion', 'Ficción'), ('no_ficcion', 'No Ficción'), ('ciencia', 'Ciencia'), ('historia', 'Historia'), ('biografia', 'Biografía'), ('fantasia', 'Fantasía'), ('romance', 'Romance'), ('terror', 'Terror'), ('poesia', 'Poesía'), ('otro', 'Otro')], max_length=20, unique=True)),
+                ('total', models.IntegerField(default=0)),
+            ],
+            options={
+                'verbose_name': 'Conteo por género',
+                'verbose_name_plural': 'Conteos por género',
+            },
+        ),
+        migrations.CreateModel(
+            name='Estadisticas',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('total_libros', models.IntegerField(default=0)),
+                ('total_usuarios', models.IntegerField(default=0)),
+                ('prestamos_activos', models.IntegerField(default=0)),
+            ],
+            options={
+                'verbose_name': 'Estadísticas',
+                'verbose_name_plural': 'Estadísticas',
+            },
+        ),
+        migrations.RunPython(calcular_estadisticas, migrations.RunPython.noop),
+    ]
@@ -0,0 +1,97 @@
+# Generated by Django 5.2.8 on 2026-10-18 06:47
+
+import django.core.validators
+import django.db.models.deletion
+from decimal import Decimal
+from django.conf import settings
+from django.db import migrations, models
+from django.db.models import Sum
+
+
+def cargar_multas_existentes(apps, schema_editor):
+    """
+    Las multas guardadas en Prestamo pasan al libro como cargos. Antes no se
+    registraban pagos, así que todas quedan como saldo pendiente.
+    """
+    Prestamo = apps.get_model('gestion', 'Prestamo')
+    MovimientoMulta = apps.get_model('gestion', 'MovimientoMulta')
+    SaldoMulta = apps.get_model('gestion', 'SaldoMulta')
+    Estadisticas = apps.get_model('gestion', 'Estadisticas')
+
+    con_multa = Prestamo.objects.filter(multa__gt=0)
+    MovimientoMulta.objects.bulk_create(
+        (
+            MovimientoMulta(
+                usuario_id=prestamo.usuario_id,
+                prestamo_id=prestamo.id,
+                tipo='cargo',
+                monto=prestamo.multa,
+                descripcion='Multa registrada antes del libro de multas',
+            )
+            for prestamo in con_multa.iterator()
+        ),
+        batch_size=1000,
+    )
+    SaldoMulta.objects.bulk_create(
+        (
+            SaldoMulta(usuario_id=fila['usuario_id'], saldo=fila['total'], total_cargado=fila['total'])
+            for fila in con_multa.values('usuario_id').annotate(total=Sum('multa')).order_by()
+        ),
+        batch_size=1000,
+    )
+    total = con_multa.aggregate(total=Sum('multa'))['total'] or Decimal('0.00')
+    Estadisticas.objects.filter(pk=1).update(total_multas=total, saldo_multas=total)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('gestion', '0005_estadisticas'),
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='estadisticas',
+            name='saldo_multas',
+            field=models.DecimalField(decimal_places=2, default=Decimal('0.00'), max_digits=14),
+        ),
+        migrations.AddField(
+            model_name='estadisticas',
+            name='total_multas',
+            field=models.DecimalField(decimal_places=2, default=Decimal('0.00'), max_digits=14),
+        ),
+        migrations.CreateModel(
+            name='MovimientoMulta',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('tipo', models.CharField(choices=[('cargo', 'Cargo'), ('pago', 'Pago')], max_length=10)),
+                ('monto', models.DecimalField(decimal_places=2, max_digits=10, validators=[django.core.validators.MinValueValidator(Decimal('0.01'))])),
+                ('descripcion', models.CharField(blank=True, max_length=200)),
+                ('fecha', models.DateTimeField(auto_now_add=True)),
+                ('prestamo', models.ForeignKey(blank=True, null=True, on_delete=django.db.models.deletion.SET_NULL, to='gestion.prestamo')),
+                ('usuario', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='movimientos_multa', to=settings.AUTH_USER_MODEL)),
+            ],
+            options={
+                'verbose_name': 'Movimiento de multa',
+                'verbose_name_plural': 'Movimientos de multas',
+                'indexes': [models.Index(fields=['usuario', '-fecha'], name='movimiento_usuario_idx')],
+            },
+        ),
+        migrations.CreateModel(
+            name='SaldoMulta',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('saldo', models.DecimalField(decimal_places=2, default=Decimal('0.00'), max_digits=12)),
+                ('total_cargado', models.DecimalField(decimal_places=2, default=Decimal('0.00'), max_digits=12)),
+                ('total_pagado', models.DecimalField(decimal_places=2, default=Decimal('0.00'), max_digits=12)),
+                ('usuario', models.OneToOneField(on_delete=django.db.models.deletion.CASCADE, related_name='saldo_multa', to=settings.AUTH_USER_MODEL)),
+            ],
+            options={
+                'verbose_name': 'Saldo de multas',
+                'verbose_name_plural': 'Saldos de multas',
+                'indexes': [models.Index(condition=models.Q(('saldo__gt', 0)), fields=['-saldo'], name='saldo_pendiente_idx')],
+            },
+        ),
+        migrations.RunPython(cargar_multas_existentes, migrations.RunPython.noop),
+    ]
@@ -0,0 +1,27 @@
+# Generated by Django 5.2.8 on 2026-10-18 06:50
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('gestion', '0006_libro_multas'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='OperacionKiosco',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('clave', models.CharField(max_length=64, unique=True)),
+                ('tipo', models.CharField(choices=[('prestamo', 'Préstamo'), ('devolucion', 'Devolución')], max_length=10)),
+                ('resultado', models.JSONField()),
+                ('fecha', models.DateTimeField(auto_now_add=True)),
+            ],
+            options={
+                'verbose_name': 'Operación de kiosco',
+                'verbose_name_plural': 'Operaciones de kiosco',
+            },
+        ),
+    ]
@@ -0,0 +1,36 @@
+# Generated by Django 5.2.8 on 2026-10-18 07:20
+
+from decimal import Decimal
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('gestion', '0007_operacion_kiosco'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='EjecucionMultas',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('fecha', models.DateField(unique=True)),
+                ('estado', models.CharField(choices=[('completada', 'Completada'), ('fallida', 'Fallida')], max_length=10)),
+                ('inicio', models.DateTimeField()),
+                ('fin', models.DateTimeField()),
+                ('prestamos_actualizados', models.IntegerField(default=0)),
+                ('total_acumulado', models.DecimalField(decimal_places=2, default=Decimal('0.00'), max_digits=14)),
+                ('mensaje', models.TextField(blank=True)),
+            ],
+            options={
+                'verbose_name': 'Ejecución de multas',
+                'verbose_name_plural': 'Ejecuciones de multas',
+            },
+        ),
+        migrations.AddField(
+            model_name='prestamo',
+            name='multa_acumulada',
+            field=models.DecimalField(decimal_places=2, default=Decimal('0.00'), max_digits=10),
+        ),
+    ]
@@ -0,0 +1,28 @@
+# Generated by Django 5.2.8 on 2026-10-18 07:22
+
+import django.db.models.deletion
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('gestion', '0008_multa_acumulada'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='RecordatorioEnviado',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('tipo', models.CharField(choices=[('por_vencer', 'Por vencer'), ('vencido', 'Vencido')], max_length=10)),
+                ('enviado', models.DateTimeField(auto_now_add=True)),
+                ('prestamo', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='recordatorios', to='gestion.prestamo')),
+            ],
+            options={
+                'verbose_name': 'Recordatorio enviado',
+                'verbose_name_plural': 'Recordatorios enviados',
+                'constraints': [models.UniqueConstraint(fields=('prestamo', 'tipo'), name='recordatorio_unico')],
+            },
+        ),
+    ]
@@ -0,0 +1,55 @@
+# Generated by Django 5.2.8 on 2026-10-18 07:25
+
+import django.db.models.deletion
+from django.db import migrations, models
+from django.db.models import OuterRef, Subquery
+
+
+def apuntar_prestamos_activos(apps, schema_editor):
+    """Cada libro apunta a su préstamo activo (un solo UPDATE con subconsulta)"""
+    Libro = apps.get_model('gestion', 'Libro')
+    Prestamo = apps.get_model('gestion', 'Prestamo')
+    Libro.objects.update(
+        prestamo_activo=Subquery(
+            Prestamo.objects.filter(
+                libro=OuterRef('pk'), fecha_devolucion_real__isnull=True
+            ).values('pk')[:1]
+        )
+    )
+
+
+def restaurar_disponible(apps, schema_editor):
+    Libro = apps.get_model('gestion', 'Libro')
+    Libro.objects.filter(prestamo_activo__isnull=False).update(disponible=False)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('gestion', '0009_recordatorios'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='libro',
+            name='prestamo_activo',
+            field=models.ForeignKey(blank=True, null=True, on_delete=django.db.models.deletion.SET_NULL, db_index=False, related_name='+', to='gestion.prestamo'),
+        ),
+        migrations.RunPython(apuntar_prestamos_activos, restaurar_disponible),
+        migrations.RemoveIndex(
+            model_name='libro',
+            name='libro_disponible_titulo_idx',
+        ),
+        migrations.RemoveField(
+            model_name='libro',
+            name='disponible',
+        ),
+        migrations.AddIndex(
+            model_name='libro',
+            index=models.Index(condition=models.Q(('prestamo_activo__isnull', True)), fields=['titulo'], name='libro_libre_titulo_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='libro',
+            index=models.Index(condition=models.Q(('prestamo_activo__isnull', False)), fields=['prestamo_activo'], name='libro_prestamo_activo_idx'),
+        ),
+    ]
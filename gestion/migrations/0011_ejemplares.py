@@ -0,0 +1,151 @@
+# Generated by Django 5.2.8 on 2026-10-18 07:32
+
+import django.db.models.deletion
+from django.conf import settings
+from django.db import migrations, models
+from django.db.models import OuterRef, Subquery
+
+# Triggers del índice de búsqueda tal como los crea 0003
+RESTAURAR_FTS = [
+    """
+    CREATE TRIGGER IF NOT EXISTS gestion_libro_fts_ai AFTER INSERT ON gestion_libro BEGIN
+        INSERT INTO gestion_libro_fts(rowid, titulo, autor, genero)
+        VALUES (new.id, new.titulo, new.autor, new.genero);
+    END
+    """,
+    """
+    CREATE TRIGGER IF NOT EXISTS gestion_libro_fts_ad AFTER DELETE ON gestion_libro BEGIN
+        INSERT INTO gestion_libro_fts(gestion_libro_fts, rowid, titulo, autor, genero)
+        VALUES ('delete', old.id, old.titulo, old.autor, old.genero);
+    END
+    """,
+    """
+    CREATE TRIGGER IF NOT EXISTS gestion_libro_fts_au AFTER UPDATE OF titulo, autor, genero ON gestion_libro BEGIN
+        INSERT INTO gestion_libro_fts(gestion_libro_fts, rowid, titulo, autor, genero)
+        VALUES ('delete', old.id, old.titulo, old.autor, old.genero);
+        INSERT INTO gestion_libro_fts(rowid, titulo, autor, genero)
+        VALUES (new.id, new.titulo, new.autor, new.genero);
+    END
+    """,
+    "INSERT INTO gestion_libro_fts(gestion_libro_fts) VALUES('rebuild')",
+]
+
+
+def crear_ejemplares(apps, schema_editor):
+    """
+    Hasta ahora cada Libro era una sola copia: se crea un ejemplar por libro
+    (con su préstamo activo) y los préstamos pasan a apuntar a ese ejemplar.
+    Todo son sentencias sobre conjuntos, sin recorrer filas en Python.
+    """
+    Libro = apps.get_model('gestion', 'Libro')
+    Ejemplar = apps.get_model('gestion', 'Ejemplar')
+    Prestamo = apps.get_model('gestion', 'Prestamo')
+    nombre = schema_editor.quote_name
+    schema_editor.execute(
+        f"INSERT INTO {nombre(Ejemplar._meta.db_table)} ({nombre('libro_id')}, {nombre('prestamo_activo_id')}) "
+        f"SELECT {nombre('id')}, {nombre('prestamo_activo_id')} FROM {nombre(Libro._meta.db_table)}"
+    )
+    Prestamo.objects.update(
+        ejemplar=Subquery(Ejemplar.objects.filter(libro=OuterRef('libro')).values('pk')[:1])
+    )
+    Libro.objects.filter(prestamo_activo__isnull=False).update(copias_disponibles=0)
+
+
+def restaurar_puntero(apps, schema_editor):
+    Libro = apps.get_model('gestion', 'Libro')
+    Prestamo = apps.get_model('gestion', 'Prestamo')
+    Libro.objects.update(
+        prestamo_activo=Subquery(
+            Prestamo.objects.filter(
+                libro=OuterRef('pk'), fecha_devolucion_real__isnull=True
+            ).values('pk')[:1]
+        )
+    )
+
+
+def restaurar_busqueda(apps, schema_editor):
+    """
+    En SQLite AddConstraint y RemoveField reconstruyen gestion_libro y con ello
+    se pierden los triggers del índice de búsqueda (0003): volver a crearlos y
+    reindexar
+    """
+    if schema_editor.connection.vendor != 'sqlite':
+        return
+    for sentencia in RESTAURAR_FTS:
+        schema_editor.execute(sentencia)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('gestion', '0010_prestamo_activo'),
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='Ejemplar',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('libro', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='ejemplares', to='gestion.libro')),
+                ('prestamo_activo', models.ForeignKey(blank=True, db_index=False, null=True, on_delete=django.db.models.deletion.SET_NULL, related_name='+', to='gestion.prestamo')),
+            ],
+            options={
+                'verbose_name': 'Ejemplar',
+                'verbose_name_plural': 'Ejemplares',
+            },
+        ),
+        migrations.AddField(
+            model_name='libro',
+            name='copias_disponibles',
+            field=models.PositiveIntegerField(default=1),
+        ),
+        migrations.AddField(
+            model_name='libro',
+            name='copias_total',
+            field=models.PositiveIntegerField(default=1),
+        ),
+        migrations.AddField(
+            model_name='prestamo',
+            name='ejemplar',
+            field=models.ForeignKey(blank=True, null=True, on_delete=django.db.models.deletion.SET_NULL, to='gestion.ejemplar'),
+        ),
+        migrations.RunPython(crear_ejemplares, restaurar_puntero),
+        migrations.RemoveConstraint(
+            model_name='prestamo',
+            name='prestamo_activo_unico_libro',
+        ),
+        migrations.RemoveIndex(
+            model_name='libro',
+            name='libro_libre_titulo_idx',
+        ),
+        migrations.RemoveIndex(
+            model_name='libro',
+            name='libro_prestamo_activo_idx',
+        ),
+        migrations.RemoveField(
+            model_name='libro',
+            name='prestamo_activo',
+        ),
+        migrations.AddIndex(
+            model_name='libro',
+            index=models.Index(condition=models.Q(('copias_disponibles__gt', 0)), fields=['titulo'], name='libro_disponible_titulo_idx'),
+        ),
+        migrations.AddConstraint(
+            model_name='libro',
+            constraint=models.CheckConstraint(condition=models.Q(('copias_disponibles__lte', models.F('copias_total'))), name='libro_copias_validas'),
+        ),
+        migrations.AddConstraint(
+            model_name='prestamo',
+            constraint=models.UniqueConstraint(condition=models.Q(('fecha_devolucion_real__isnull', True)), fields=('ejemplar',), name='prestamo_activo_unico_ejemplar'),
+        ),
+        migrations.AddConstraint(
+            model_name='prestamo',
+            constraint=models.UniqueConstraint(condition=models.Q(('fecha_devolucion_real__isnull', True)), fields=('usuario', 'libro'), name='prestamo_activo_unico_usuario_libro'),
+        ),
+        migrations.AddIndex(
+            model_name='ejemplar',
+            index=models.Index(condition=models.Q(('prestamo_activo__isnull', False)), fields=['prestamo_activo'], name='ejemplar_prestamo_activo_idx'),
+        ),
+        migrations.RunPython(restaurar_busqueda, migrations.RunPython.noop),
+    ]
@@ -0,0 +1,54 @@
+# Generated by Django 5.2.8 on 2026-10-18 07:42
+
+import django.db.models.deletion
+from django.conf import settings
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('gestion', '0011_ejemplares'),
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='Reserva',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('estado', models.CharField(choices=[('en_espera', 'En espera'), ('asignada', 'Lista para retirar'), ('retirada', 'Retirada'), ('cancelada', 'Cancelada'), ('expirada', 'Expirada')], default='en_espera', max_length=10)),
+                ('fecha', models.DateTimeField(auto_now_add=True)),
+                ('asignada', models.DateTimeField(blank=True, null=True)),
+                ('expira', models.DateTimeField(blank=True, null=True)),
+                ('ejemplar', models.ForeignKey(blank=True, null=True, on_delete=django.db.models.deletion.SET_NULL, related_name='+', to='gestion.ejemplar')),
+                ('libro', models.ForeignKey(db_index=False, on_delete=django.db.models.deletion.CASCADE, related_name='reservas', to='gestion.libro')),
+                ('usuario', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='reservas', to=settings.AUTH_USER_MODEL)),
+            ],
+            options={
+                'verbose_name': 'Reserva',
+                'verbose_name_plural': 'Reservas',
+            },
+        ),
+        migrations.AddField(
+            model_name='ejemplar',
+            name='reserva_activa',
+            field=models.ForeignKey(blank=True, db_index=False, null=True, on_delete=django.db.models.deletion.SET_NULL, related_name='+', to='gestion.reserva'),
+        ),
+        migrations.AddIndex(
+            model_name='ejemplar',
+            index=models.Index(condition=models.Q(('reserva_activa__isnull', False)), fields=['reserva_activa'], name='ejemplar_reserva_activa_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='reserva',
+            index=models.Index(fields=['libro', 'estado', 'id'], name='reserva_cola_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='reserva',
+            index=models.Index(condition=models.Q(('estado', 'asignada')), fields=['expira'], name='reserva_asignada_expira_idx'),
+        ),
+        migrations.AddConstraint(
+            model_name='reserva',
+            constraint=models.UniqueConstraint(condition=models.Q(('estado__in', ('en_espera', 'asignada'))), fields=('usuario', 'libro'), name='reserva_activa_unica'),
+        ),
+    ]
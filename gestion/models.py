@@ -20,36 +20,113 @@ class Libro(models.Model):
     titulo = models.CharField(max_length=200)
     autor = models.CharField(max_length=100)
     genero = models.CharField(max_length=20, choices=GENEROS, default='otro')
-    disponible = models.BooleanField(default=True)
+    # Contadores de ejemplares (ver Ejemplar). prestar_libro descuenta una copia
+    # con un UPDATE condicional (WHERE copias_disponibles > 0) y la devolución la
+    # repone, así que consultar la disponibilidad no cuenta filas
+    copias_total = models.PositiveIntegerField(default=1)
+    copias_disponibles = models.PositiveIntegerField(default=1)
 
     def __str__(self):
         return self.titulo
     
+    CONTADORES = ('copias_total', 'copias_disponibles')
+
+    def save(self, *args, **kwargs):
+        if self._state.adding:
+            # Un libro nuevo tiene todas sus copias disponibles (la señal post_save crea los ejemplares)
+            self.copias_disponibles = self.copias_total
+        elif not args and kwargs.get('update_fields') is None:
+            # Los contadores solo cambian con UPDATE relativos (préstamo, devolución,
+            # ajustar_copias): no escribirlos para no pisar un préstamo concurrente
+            kwargs['update_fields'] = [
+                campo.name for campo in self._meta.concrete_fields
+                if not campo.primary_key and campo.name not in self.CONTADORES
+            ]
+        super().save(*args, **kwargs)
+
+    @property
+    def disponible(self):
+        return self.copias_disponibles > 0
+
     def tiene_prestamo_activo(self):
         """
         Verifica si el libro tiene un préstamo activo
-        Retorna True si hay un préstamo sin devolver
+        Retorna True si alguna copia está prestada (sin consultar la base de datos)
         """
-        return Prestamo.objects.filter(
-            libro=self,
-            fecha_devolucion_real__isnull=True
-        ).exists()
+        return self.copias_disponibles < self.copias_total
     
     def puede_prestarse(self):
         """
         Verifica si el libro puede ser prestado
-        Retorna True solo si está disponible Y no tiene préstamo activo
+        Retorna True solo si queda alguna copia disponible
         """
-        return self.disponible and not self.tiene_prestamo_activo()
+        return self.disponible
     
     class Meta:
         verbose_name = "Libro"
         verbose_name_plural = "Libros"
+        indexes = [
+            # Orden estable del catálogo para la paginación por cursor
+            models.Index(fields=['titulo'], name='libro_titulo_idx'),
+            # Libros con alguna copia disponible, por título (registrar_prestamo)
+            models.Index(
+                fields=['titulo'],
+                condition=models.Q(copias_disponibles__gt=0),
+                name='libro_disponible_titulo_idx',
+            ),
+        ]
+        constraints = [
+            models.CheckConstraint(
+                condition=models.Q(copias_disponibles__lte=models.F('copias_total')),
+                name='libro_copias_validas',
+            ),
+        ]
+
+
+class Ejemplar(models.Model):
+    """Copia física de un libro"""
+    libro = models.ForeignKey(Libro, on_delete=models.CASCADE, related_name='ejemplares')
+    # Préstamo activo de esta copia (NULL = en estantería). Lo asignan y limpian
+    # prestar_libro, la devolución y los lotes de kiosco junto con el contador del libro
+    prestamo_activo = models.ForeignKey(
+        'Prestamo', null=True, blank=True, on_delete=models.SET_NULL, related_name='+',
+        db_index=False,
+    )
+    # Reserva a la que está apartada la copia hasta que el lector la retire (ver Reserva)
+    reserva_activa = models.ForeignKey(
+        'Reserva', null=True, blank=True, on_delete=models.SET_NULL, related_name='+',
+        db_index=False,
+    )
+
+    # Copias que se pueden prestar a cualquiera: ni prestadas ni apartadas.
+    # copias_disponibles del libro cuenta exactamente estas
+    EN_ESTANTERIA = models.Q(prestamo_activo__isnull=True, reserva_activa__isnull=True)
+
+    def __str__(self):
+        return f"{self.libro.titulo} (ejemplar {self.pk})"
+
+    class Meta:
+        verbose_name = "Ejemplar"
+        verbose_name_plural = "Ejemplares"
+        indexes = [
+            # Solo las copias prestadas (la devolución busca la copia por su préstamo)
+            models.Index(
+                fields=['prestamo_activo'],
+                condition=models.Q(prestamo_activo__isnull=False),
+                name='ejemplar_prestamo_activo_idx',
+            ),
+            models.Index(
+                fields=['reserva_activa'],
+                condition=models.Q(reserva_activa__isnull=False),
+                name='ejemplar_reserva_activa_idx',
+            ),
+        ]
 
 
 class Prestamo(models.Model):
     usuario = models.ForeignKey(User, on_delete=models.CASCADE)
     libro = models.ForeignKey(Libro, on_delete=models.CASCADE)
+    ejemplar = models.ForeignKey(Ejemplar, null=True, blank=True, on_delete=models.SET_NULL)
 
     fecha_prestamo = models.DateField(auto_now_add=True)
     fecha_devolucion_esperada = models.DateField()
@@ -62,6 +139,9 @@ class Prestamo(models.Model):
         default=Decimal("0.00"),
         validators=[MinValueValidator(Decimal('0.00'))]
     )
+    # Multa acumulada de un préstamo vencido aún no devuelto; la actualiza cada
+    # noche "python manage.py acumular_multas" (la multa definitiva es "multa")
+    multa_acumulada = models.DecimalField(max_digits=10, decimal_places=2, default=Decimal('0.00'))
 
     def __str__(self):
         return f"{self.usuario.username} - {self.libro.titulo}"
@@ -82,4 +162,276 @@ class Prestamo(models.Model):
     
     class Meta:
         verbose_name = "Préstamo"
-        verbose_name_plural = "Préstamos"
\ No newline at end of file
+        verbose_name_plural = "Préstamos"
+        constraints = [
+            # Una copia solo puede tener un préstamo activo a la vez
+            models.UniqueConstraint(
+                fields=['ejemplar'],
+                condition=models.Q(fecha_devolucion_real__isnull=True),
+                name='prestamo_activo_unico_ejemplar',
+            ),
+            # Un lector no puede tener dos copias del mismo libro a la vez
+            models.UniqueConstraint(
+                fields=['usuario', 'libro'],
+                condition=models.Q(fecha_devolucion_real__isnull=True),
+                name='prestamo_activo_unico_usuario_libro',
+            ),
+        ]
+        indexes = [
+            # Préstamos activos por fecha de vencimiento (vencidos, multas, dashboards)
+            models.Index(
+                fields=['fecha_devolucion_esperada'],
+                condition=models.Q(fecha_devolucion_real__isnull=True),
+                name='prestamo_activo_venc_idx',
+            ),
+            # Préstamos activos ordenados por fecha de préstamo (prestamos_activos)
+            models.Index(
+                fields=['fecha_prestamo'],
+                condition=models.Q(fecha_devolucion_real__isnull=True),
+                name='prestamo_activo_fecha_idx',
+            ),
+            # Préstamos activos de un usuario (panel, devolución)
+            models.Index(
+                fields=['usuario', 'fecha_devolucion_esperada'],
+                condition=models.Q(fecha_devolucion_real__isnull=True),
+                name='prestamo_activo_usuario_idx',
+            ),
+            # Historial de devoluciones de un usuario
+            models.Index(
+                fields=['usuario', '-fecha_devolucion_real'],
+                name='prestamo_historial_idx',
+            ),
+            # Multas registradas (devueltos con multa)
+            models.Index(
+                fields=['-fecha_devolucion_real'],
+                condition=models.Q(multa__gt=0),
+                name='prestamo_multa_idx',
+            ),
+        ]
+
+class Reserva(models.Model):
+    """
+    Reserva de un libro sin copias disponibles. Cada libro tiene una cola FIFO
+    de reservas en espera ordenada por llegada (id). Cuando una copia vuelve a
+    circular se asigna a la primera de la cola en la misma transacción y queda
+    apartada hasta 'expira'; si el lector no la retira, expirar_reservas pasa
+    la copia a la siguiente. Crear y mover siempre a través de gestion/reservas.py.
+    """
+    EN_ESPERA = 'en_espera'
+    ASIGNADA = 'asignada'
+    RETIRADA = 'retirada'
+    CANCELADA = 'cancelada'
+    EXPIRADA = 'expirada'
+    ESTADOS = [
+        (EN_ESPERA, 'En espera'),
+        (ASIGNADA, 'Lista para retirar'),
+        (RETIRADA, 'Retirada'),
+        (CANCELADA, 'Cancelada'),
+        (EXPIRADA, 'Expirada'),
+    ]
+    ACTIVAS = (EN_ESPERA, ASIGNADA)
+
+    usuario = models.ForeignKey(User, on_delete=models.CASCADE, related_name='reservas')
+    # Sin índice propio: lo cubre reserva_cola_idx (libro, estado, id)
+    libro = models.ForeignKey(Libro, on_delete=models.CASCADE, related_name='reservas', db_index=False)
+    estado = models.CharField(max_length=10, choices=ESTADOS, default=EN_ESPERA)
+    fecha = models.DateTimeField(auto_now_add=True)
+    # Copia apartada mientras está asignada (Ejemplar.reserva_activa apunta de vuelta)
+    ejemplar = models.ForeignKey(Ejemplar, null=True, blank=True, on_delete=models.SET_NULL, related_name='+')
+    asignada = models.DateTimeField(null=True, blank=True)
+    expira = models.DateTimeField(null=True, blank=True)
+
+    def __str__(self):
+        return f"{self.usuario.username} - {self.libro.titulo} ({self.get_estado_display()})"
+
+    class Meta:
+        verbose_name = "Reserva"
+        verbose_name_plural = "Reservas"
+        constraints = [
+            # Una reserva viva por lector y libro
+            models.UniqueConstraint(
+                fields=['usuario', 'libro'],
+                condition=models.Q(estado__in=('en_espera', 'asignada')),
+                name='reserva_activa_unica',
+            ),
+        ]
+        indexes = [
+            # Cola de cada libro: la primera en espera es la primera entrada de
+            # (libro, 'en_espera') en el índice, por largo que sea el historial
+            models.Index(fields=['libro', 'estado', 'id'], name='reserva_cola_idx'),
+            # Reservas asignadas por vencimiento (expirar_reservas)
+            models.Index(
+                fields=['expira'],
+                condition=models.Q(estado='asignada'),
+                name='reserva_asignada_expira_idx',
+            ),
+        ]
+
+
+class Estadisticas(models.Model):
+    """
+    Contadores globales para los dashboards (una sola fila, pk=1).
+    Se mantienen al día con señales (ver gestion/signals.py) y se pueden
+    reconstruir con: python manage.py recalcular_estadisticas
+    """
+    total_libros = models.IntegerField(default=0)
+    total_usuarios = models.IntegerField(default=0)
+    prestamos_activos = models.IntegerField(default=0)
+    # Libro de multas: total cargado histórico y saldo pendiente de todos los usuarios
+    total_multas = models.DecimalField(max_digits=14, decimal_places=2, default=Decimal("0.00"))
+    saldo_multas = models.DecimalField(max_digits=14, decimal_places=2, default=Decimal("0.00"))
+
+    def __str__(self):
+        return "Estadísticas de la biblioteca"
+
+    @classmethod
+    def obtener(cls):
+        """Retorna la fila de contadores, creándola vacía si no existe"""
+        # Primero una lectura: get_or_create va siempre a la base de escritura,
+        # y en los reportes esta lectura debe poder ir a la réplica
+        estadisticas = cls.objects.filter(pk=1).first()
+        if estadisticas is None:
+            estadisticas, _ = cls.objects.get_or_create(pk=1)
+        return estadisticas
+
+    class Meta:
+        verbose_name = "Estadísticas"
+        verbose_name_plural = "Estadísticas"
+
+
+class ConteoGenero(models.Model):
+    """Cantidad de libros por género, mantenida junto a Estadisticas"""
+    genero = models.CharField(max_length=20, choices=Libro.GENEROS, unique=True)
+    total = models.IntegerField(default=0)
+
+    def __str__(self):
+        return f"{self.get_genero_display()}: {self.total}"
+
+    class Meta:
+        verbose_name = "Conteo por género"
+        verbose_name_plural = "Conteos por género"
+
+
+
+class MovimientoMulta(models.Model):
+    """
+    Asiento del libro de multas. Solo se agregan filas (cargos y pagos);
+    nunca se editan ni se borran. Crear siempre a través de gestion/multas.py
+    para que el saldo del usuario y los totales se actualicen en la misma transacción.
+    """
+    TIPOS = [
+        ('cargo', 'Cargo'),
+        ('pago', 'Pago'),
+    ]
+
+    usuario = models.ForeignKey(User, on_delete=models.CASCADE, related_name='movimientos_multa')
+    prestamo = models.ForeignKey(Prestamo, on_delete=models.SET_NULL, null=True, blank=True)
+    tipo = models.CharField(max_length=10, choices=TIPOS)
+    monto = models.DecimalField(
+        max_digits=10,
+        decimal_places=2,
+        validators=[MinValueValidator(Decimal('0.01'))]
+    )
+    descripcion = models.CharField(max_length=200, blank=True)
+    fecha = models.DateTimeField(auto_now_add=True)
+
+    def __str__(self):
+        return f"{self.get_tipo_display()} ${self.monto} - {self.usuario.username}"
+
+    class Meta:
+        verbose_name = "Movimiento de multa"
+        verbose_name_plural = "Movimientos de multas"
+        indexes = [
+            models.Index(fields=['usuario', '-fecha'], name='movimiento_usuario_idx'),
+        ]
+
+
+class SaldoMulta(models.Model):
+    """Saldo materializado de multas por usuario (cargos - pagos)"""
+    usuario = models.OneToOneField(User, on_delete=models.CASCADE, related_name='saldo_multa')
+    saldo = models.DecimalField(max_digits=12, decimal_places=2, default=Decimal("0.00"))
+    total_cargado = models.DecimalField(max_digits=12, decimal_places=2, default=Decimal("0.00"))
+    total_pagado = models.DecimalField(max_digits=12, decimal_places=2, default=Decimal("0.00"))
+
+    def __str__(self):
+        return f"{self.usuario.username}: ${self.saldo}"
+
+    class Meta:
+        verbose_name = "Saldo de multas"
+        verbose_name_plural = "Saldos de multas"
+        indexes = [
+            models.Index(fields=['-saldo'], condition=models.Q(saldo__gt=0), name='saldo_pendiente_idx'),
+        ]
+
+
+class OperacionKiosco(models.Model):
+    """
+    Operación de préstamo o devolución enviada por un kiosco de autoservicio.
+    La clave de idempotencia evita aplicar dos veces una operación reenviada;
+    se guarda el resultado para responder lo mismo en los reintentos.
+    """
+    TIPOS = [
+        ('prestamo', 'Préstamo'),
+        ('devolucion', 'Devolución'),
+    ]
+
+    clave = models.CharField(max_length=64, unique=True)
+    tipo = models.CharField(max_length=10, choices=TIPOS)
+    resultado = models.JSONField()
+    fecha = models.DateTimeField(auto_now_add=True)
+
+    def __str__(self):
+        return f"{self.get_tipo_display()} {self.clave}"
+
+    class Meta:
+        verbose_name = "Operación de kiosco"
+        verbose_name_plural = "Operaciones de kiosco"
+
+
+class EjecucionMultas(models.Model):
+    """Registro de cada ejecución diaria de acumular_multas (una por fecha)"""
+    COMPLETADA = 'completada'
+    FALLIDA = 'fallida'
+    ESTADOS = [
+        (COMPLETADA, 'Completada'),
+        (FALLIDA, 'Fallida'),
+    ]
+
+    fecha = models.DateField(unique=True)
+    estado = models.CharField(max_length=10, choices=ESTADOS)
+    inicio = models.DateTimeField()
+    fin = models.DateTimeField()
+    prestamos_actualizados = models.IntegerField(default=0)
+    total_acumulado = models.DecimalField(max_digits=14, decimal_places=2, default=Decimal('0.00'))
+    mensaje = models.TextField(blank=True)
+
+    def __str__(self):
+        return f"Multas del {self.fecha}: {self.get_estado_display()}"
+
+    class Meta:
+        verbose_name = "Ejecución de multas"
+        verbose_name_plural = "Ejecuciones de multas"
+
+
+class RecordatorioEnviado(models.Model):
+    """Recordatorios por correo ya enviados: a lo más uno de cada tipo por préstamo"""
+    POR_VENCER = 'por_vencer'
+    VENCIDO = 'vencido'
+    TIPOS = [
+        (POR_VENCER, 'Por vencer'),
+        (VENCIDO, 'Vencido'),
+    ]
+
+    prestamo = models.ForeignKey(Prestamo, on_delete=models.CASCADE, related_name='recordatorios')
+    tipo = models.CharField(max_length=10, choices=TIPOS)
+    enviado = models.DateTimeField(auto_now_add=True)
+
+    def __str__(self):
+        return f"{self.get_tipo_display()} - préstamo {self.prestamo_id}"
+
+    class Meta:
+        verbose_name = "Recordatorio enviado"
+        verbose_name_plural = "Recordatorios enviados"
+        constraints = [
+            models.UniqueConstraint(fields=['prestamo', 'tipo'], name='recordatorio_unico'),
+        ]
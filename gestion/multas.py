@@ -0,0 +1,185 @@
+"""
+Cálculo de multas y libro de multas (cargos y pagos).
+
+Cada movimiento actualiza en la misma transacción el saldo del usuario
+(SaldoMulta) y los totales globales (Estadisticas), de modo que "cuánto
+debe el usuario X" y "total de multas" son lecturas de una sola fila.
+"""
+from decimal import Decimal
+
+from django.db import transaction
+from django.db.models import DateField, DecimalField, ExpressionWrapper, F, Func, IntegerField, Sum, Value
+
+from . import estadisticas
+from .models import MovimientoMulta, Prestamo, SaldoMulta
+
+MULTA_POR_DIA = Decimal('1000.00')  # $1000 por día de atraso
+
+
+def calcular_multa(fecha_devolucion_esperada, fecha_devolucion_real):
+    """Retorna (dias_atraso, multa) para una devolución en la fecha indicada"""
+    dias_atraso = max((fecha_devolucion_real - fecha_devolucion_esperada).days, 0)
+    return dias_atraso, MULTA_POR_DIA * dias_atraso
+
+
+class DiasEntre(Func):
+    """Días enteros entre dos fechas: DiasEntre(fin, inicio) = fin - inicio"""
+    arity = 2
+    output_field = IntegerField()
+
+    def _compilar(self, compiler, connection):
+        fin, inicio = (compiler.compile(expresion) for expresion in self.get_source_expressions())
+        return fin, inicio, (*fin[1], *inicio[1])
+
+    def as_sql(self, compiler, connection, **extra_context):
+        # PostgreSQL: date - date retorna un entero
+        fin, inicio, params = self._compilar(compiler, connection)
+        return f'({fin[0]} - {inicio[0]})', params
+
+    def as_sqlite(self, compiler, connection, **extra_context):
+        fin, inicio, params = self._compilar(compiler, connection)
+        return f'CAST(julianday({fin[0]}) - julianday({inicio[0]}) AS INTEGER)', params
+
+    def as_mysql(self, compiler, connection, **extra_context):
+        fin, inicio, params = self._compilar(compiler, connection)
+        return f'DATEDIFF({fin[0]}, {inicio[0]})', params
+
+
+def anotar_atraso(prestamos, hoy):
+    """
+    Agrega dias_atraso y multa_estimada calculados en la base de datos,
+    para préstamos activos a la fecha indicada.
+    """
+    return prestamos.annotate(
+        dias_atraso=DiasEntre(Value(hoy, output_field=DateField()), F('fecha_devolucion_esperada')),
+    ).annotate(
+        multa_estimada=ExpressionWrapper(
+            F('dias_atraso') * Value(MULTA_POR_DIA),
+            output_field=DecimalField(max_digits=12, decimal_places=2),
+        ),
+    )
+
+
+def acumular_multas(hoy):
+    """
+    Actualiza multa_acumulada de todos los préstamos vencidos no devueltos con
+    un único UPDATE calculado en la base de datos (sobre el índice parcial de
+    activos). Depende solo de la fecha, así que repetirlo el mismo día no cambia nada.
+    Retorna (prestamos_actualizados, total_acumulado).
+    """
+    vencidos = Prestamo.objects.filter(
+        fecha_devolucion_real__isnull=True,
+        fecha_devolucion_esperada__lt=hoy,
+    )
+    actualizados = vencidos.update(
+        multa_acumulada=ExpressionWrapper(
+            DiasEntre(Value(hoy, output_field=DateField()), F('fecha_devolucion_esperada'))
+            * Value(MULTA_POR_DIA),
+            output_field=DecimalField(max_digits=10, decimal_places=2),
+        )
+    )
+    total = vencidos.aggregate(total=Sum('multa_acumulada', default=Decimal('0.00')))['total']
+    return actualizados, total
+
+
+def _aplicar_en_saldo(usuario_id, cargo=Decimal('0.00'), pago=Decimal('0.00')):
+    cambios = {
+        'saldo': F('saldo') + cargo - pago,
+        'total_cargado': F('total_cargado') + cargo,
+        'total_pagado': F('total_pagado') + pago,
+    }
+    if not SaldoMulta.objects.filter(usuario_id=usuario_id).update(**cambios):
+        SaldoMulta.objects.get_or_create(usuario_id=usuario_id)
+        SaldoMulta.objects.filter(usuario_id=usuario_id).update(**cambios)
+    estadisticas.ajustar(total_multas=cargo, saldo_multas=cargo - pago)
+
+
+def registrar_cargo(usuario, monto, prestamo=None, descripcion=''):
+    """Registra una multa a nombre del usuario"""
+    monto = Decimal(monto)
+    if monto <= 0:
+        raise ValueError("El monto del cargo debe ser mayor a cero.")
+    with transaction.atomic():
+        movimiento = MovimientoMulta.objects.create(
+            usuario=usuario,
+            prestamo=prestamo,
+            tipo='cargo',
+            monto=monto,
+            descripcion=descripcion,
+        )
+        _aplicar_en_saldo(usuario.pk, cargo=monto)
+    return movimiento
+
+
+def registrar_cargos_en_lote(cargos):
+    """
+    Registra varios cargos de una vez: cargos es una lista de
+    (usuario_id, monto, prestamo_id, descripcion). Usar dentro de una transacción.
+    """
+    cargos = [cargo for cargo in cargos if cargo[1] > 0]
+    if not cargos:
+        return []
+    movimientos = MovimientoMulta.objects.bulk_create([
+        MovimientoMulta(
+            usuario_id=usuario_id,
+            prestamo_id=prestamo_id,
+            tipo='cargo',
+            monto=monto,
+            descripcion=descripcion,
+        )
+        for usuario_id, monto, prestamo_id, descripcion in cargos
+    ])
+    por_usuario = {}
+    for usuario_id, monto, _, _ in cargos:
+        por_usuario[usuario_id] = por_usuario.get(usuario_id, Decimal('0.00')) + monto
+    existentes = set(
+        SaldoMulta.objects.filter(usuario_id__in=por_usuario).values_list('usuario_id', flat=True)
+    )
+    SaldoMulta.objects.bulk_create([
+        SaldoMulta(usuario_id=usuario_id) for usuario_id in por_usuario if usuario_id not in existentes
+    ])
+    for usuario_id, total in por_usuario.items():
+        SaldoMulta.objects.filter(usuario_id=usuario_id).update(
+            saldo=F('saldo') + total,
+            total_cargado=F('total_cargado') + total,
+        )
+    total = sum(por_usuario.values(), Decimal('0.00'))
+    estadisticas.ajustar(total_multas=total, saldo_multas=total)
+    return movimientos
+
+
+def registrar_pago(usuario, monto, descripcion=''):
+    """Registra un pago del usuario; no puede superar su saldo pendiente"""
+    monto = Decimal(monto)
+    if monto <= 0:
+        raise ValueError("El monto del pago debe ser mayor a cero.")
+    with transaction.atomic():
+        # La condición en el UPDATE evita pagar de más aunque haya pagos simultáneos
+        actualizado = SaldoMulta.objects.filter(
+            usuario_id=usuario.pk, saldo__gte=monto
+        ).update(
+            saldo=F('saldo') - monto,
+            total_pagado=F('total_pagado') + monto,
+        )
+        if not actualizado:
+            raise ValueError("El pago supera el saldo pendiente del usuario.")
+        movimiento = MovimientoMulta.objects.create(
+            usuario=usuario,
+            tipo='pago',
+            monto=monto,
+            descripcion=descripcion,
+        )
+        estadisticas.ajustar(saldo_multas=-monto)
+    return movimiento
+
+
+def saldo_de(usuario):
+    """Saldo pendiente del usuario (una lectura por clave primaria)"""
+    saldo = SaldoMulta.objects.filter(usuario_id=usuario.pk).values_list('saldo', flat=True).first()
+    return saldo if saldo is not None else Decimal('0.00')
+
+
+async def asaldo_de(usuario):
+    """saldo_de para las vistas async"""
+    saldo = await SaldoMulta.objects.filter(usuario_id=usuario.pk).values_list('saldo', flat=True).afirst()
+    return saldo if saldo is not None else Decimal('0.00')
@@ -0,0 +1,219 @@
+"""
+Paginación por cursor (keyset / seek) para las vistas de listado.
+
+En vez de OFFSET, cada página se pide con un cursor que guarda los valores
+de ordenamiento de la última fila mostrada; la siguiente consulta filtra
+"después de esa fila" y usa el índice del orden, por lo que el costo de una
+página no depende de qué tan profundo se navegue ni del tamaño de la tabla.
+
+Los cursores van firmados con ``django.core.signing``: son opacos para el
+usuario y un cursor manipulado simplemente vuelve a la primera página.
+"""
+from datetime import date, datetime
+from decimal import Decimal
+
+from django.core import signing
+from django.core.exceptions import ValidationError as ErrorDeValidacion
+from django.db.models import Q
+from rest_framework.exceptions import NotFound, ValidationError
+from rest_framework.pagination import CursorPagination
+
+POR_PAGINA = 25
+SALT_CURSOR = 'gestion.paginacion'
+
+
+def _normalizar_orden(orden):
+    """
+    Convierte ('titulo', '-id') en [('titulo', False), ('id', True)].
+    Agrega 'id' al final si falta, para que el orden sea estable y único.
+    """
+    campos = []
+    for campo in orden:
+        descendente = campo.startswith('-')
+        campos.append((campo.lstrip('-'), descendente))
+    if campos[-1][0] not in ('id', 'pk'):
+        campos.append(('id', campos[0][1]))
+    return campos
+
+
+def _valor_de(objeto, campo):
+    """Obtiene el valor de un campo, siguiendo relaciones 'usuario__username'"""
+    valor = objeto
+    for parte in campo.split('__'):
+        valor = getattr(valor, parte)
+    return valor
+
+
+def _serializar(valor):
+    if isinstance(valor, (date, datetime, Decimal)):
+        return str(valor)
+    return valor
+
+
+def _filtro_despues_de(campos, valores, hacia_atras):
+    """
+    Construye (a > va) OR (a = va AND b > vb) OR ... respetando la
+    dirección de cada campo. Con hacia_atras=True se invierte la comparación.
+    """
+    filtro = Q()
+    for i, (campo, descendente) in enumerate(campos):
+        mayor = descendente == hacia_atras
+        condicion = Q(**{campos[j][0]: valores[j] for j in range(i)})
+        condicion &= Q(**{f'{campo}__{"gt" if mayor else "lt"}': valores[i]})
+        filtro |= condicion
+    return filtro
+
+
+def _orden_sql(campos, invertir=False):
+    return [
+        f'{"-" if descendente != invertir else ""}{campo}'
+        for campo, descendente in campos
+    ]
+
+
+class PaginaKeyset:
+    """Una página de resultados con los enlaces a la anterior y la siguiente"""
+
+    def __init__(self, objetos, request, parametro, cursor_anterior, cursor_siguiente):
+        self.objetos = objetos
+        self.tiene_anterior = cursor_anterior is not None
+        self.tiene_siguiente = cursor_siguiente is not None
+        self.url_anterior = self._url(request, parametro, cursor_anterior)
+        self.url_siguiente = self._url(request, parametro, cursor_siguiente)
+
+    @staticmethod
+    def _url(request, parametro, cursor):
+        if cursor is None:
+            return None
+        parametros = request.GET.copy()
+        if cursor:
+            parametros[parametro] = cursor
+        else:
+            parametros.pop(parametro, None)
+        return f'?{parametros.urlencode()}'
+
+    @property
+    def hay_paginas(self):
+        return self.tiene_anterior or self.tiene_siguiente
+
+    def __iter__(self):
+        return iter(self.objetos)
+
+    def __len__(self):
+        return len(self.objetos)
+
+    def __bool__(self):
+        return bool(self.objetos)
+
+
+def _crear_cursor(campos, objeto, direccion):
+    valores = [_serializar(_valor_de(objeto, campo)) for campo, _ in campos]
+    return signing.dumps({'v': valores, 'd': direccion}, salt=SALT_CURSOR, compress=True)
+
+
+def _leer_cursor(cursor, campos):
+    if not cursor:
+        return None, None
+    try:
+        datos = signing.loads(cursor, salt=SALT_CURSOR)
+    except signing.BadSignature:
+        return None, None
+    valores = datos.get('v')
+    if not isinstance(valores, list) or len(valores) != len(campos):
+        return None, None
+    return valores, datos.get('d')
+
+
+def _consulta_pagina(request, queryset, orden, por_pagina, parametro):
+    """Queryset (aún sin evaluar) de la página pedida y lo necesario para armarla"""
+    campos = _normalizar_orden(orden)
+    valores, direccion = _leer_cursor(request.GET.get(parametro), campos)
+    hacia_atras = direccion == 'ant'
+
+    if valores is not None:
+        queryset = queryset.filter(_filtro_despues_de(campos, valores, hacia_atras))
+
+    consulta = queryset.order_by(*_orden_sql(campos, invertir=hacia_atras))[:por_pagina + 1]
+    return consulta, (request, campos, valores, hacia_atras, por_pagina, parametro)
+
+
+def paginar(request, queryset, orden, por_pagina=POR_PAGINA, parametro='cursor'):
+    """
+    Pagina un queryset por cursor.
+
+    - orden: campos de ordenamiento, p. ej. ('titulo',) o ('-fecha_devolucion_real',).
+      Deben estar cubiertos por un índice para que la página sea O(por_pagina).
+      Se asume que los campos de orden no son nulos.
+    - parametro: nombre del parámetro GET del cursor (permite varias listas por página).
+    """
+    consulta, datos = _consulta_pagina(request, queryset, orden, por_pagina, parametro)
+    return _armar_pagina(list(consulta), *datos)
+
+
+async def apaginar(request, queryset, orden, por_pagina=POR_PAGINA, parametro='cursor'):
+    """paginar para las vistas async (la página se lee con el ORM async)"""
+    consulta, datos = _consulta_pagina(request, queryset, orden, por_pagina, parametro)
+    return _armar_pagina([fila async for fila in consulta.aiterator()], *datos)
+
+
+def _armar_pagina(filas, request, campos, valores, hacia_atras, por_pagina, parametro):
+    hay_mas = len(filas) > por_pagina
+    filas = filas[:por_pagina]
+    if hacia_atras:
+        filas.reverse()
+
+    cursor_anterior = cursor_siguiente = None
+    if filas:
+        if hacia_atras:
+            cursor_siguiente = _crear_cursor(campos, filas[-1], 'sig')
+            if hay_mas:
+                cursor_anterior = _crear_cursor(campos, filas[0], 'ant')
+        else:
+            if hay_mas:
+                cursor_siguiente = _crear_cursor(campos, filas[-1], 'sig')
+            if valores is not None:
+                cursor_anterior = _crear_cursor(campos, filas[0], 'ant')
+    elif valores is not None:
+        # Página vacía (p. ej. se borraron filas): ofrecer volver al inicio
+        cursor_anterior = ''
+
+    return PaginaKeyset(filas, request, parametro, cursor_anterior, cursor_siguiente)
+
+
+# ==================== API REST ====================
+
+class PaginacionCursorAPI(CursorPagination):
+    """Misma idea para la API: cursor opaco de DRF sobre un orden indexado"""
+    page_size = POR_PAGINA
+    max_page_size = 100
+    page_size_query_param = 'tamano'
+    ordering = '-id'
+    invalid_cursor_message = 'Cursor inválido.'
+
+    def _cursor_invalido(self):
+        return ValidationError({self.cursor_query_param: self.invalid_cursor_message})
+
+    def decode_cursor(self, request):
+        # DRF responde 404 a un cursor ilegible: es un parámetro mal formado (400)
+        try:
+            return super().decode_cursor(request)
+        except NotFound:
+            raise self._cursor_invalido()
+
+    def paginate_queryset(self, queryset, request, view=None):
+        # El cursor de DRF no va firmado: una posición que no calza con el campo
+        # de orden (texto donde va un id o una fecha) falla al filtrar
+        try:
+            return super().paginate_queryset(queryset, request, view)
+        except (ValueError, TypeError, ErrorDeValidacion):
+            raise self._cursor_invalido()
+
+
+class PaginacionCatalogoAPI(PaginacionCursorAPI):
+    """Por título; los resultados de una búsqueda, por relevancia como en la vista HTML"""
+    ordering = 'titulo'
+
+    def get_ordering(self, request, queryset, view):
+        if 'relevancia' in queryset.query.annotations:
+            return ('relevancia', 'id')
+        return super().get_ordering(request, queryset, view)
@@ -0,0 +1,136 @@
+"""
+Presupuesto de consultas SQL por petición.
+
+El middleware presupuesto_consultas registra las consultas de cada petición:
+cuántas, el tiempo total y cuántas repiten una sentencia ya ejecutada (mismo
+SQL con otros parámetros, la huella de un N+1). El registro lo hace un
+execute_wrapper instalado en cada conexión al abrirse y guarda en un ContextVar,
+así que también cuenta las consultas de las vistas async (el ORM corre en otro
+hilo, pero el contexto viaja con él) y las de la réplica.
+
+Si la petición excede PRESUPUESTO_CONSULTAS (o lo indicado para su vista en
+PRESUPUESTO_CONSULTAS_VISTAS) se registra un aviso en el logger
+gestion.presupuesto; con DEBUG el resumen va además en la cabecera
+X-Consultas-SQL. Las respuestas en streaming (exportar_multas) consultan
+después de salir del middleware y no se cuentan.
+"""
+import logging
+import time
+from collections import Counter
+from contextvars import ContextVar
+from dataclasses import dataclass
+
+from asgiref.sync import iscoroutinefunction
+from django.conf import settings
+from django.db.backends.signals import connection_created
+from django.dispatch import receiver
+from django.utils.decorators import sync_and_async_middleware
+
+logger = logging.getLogger(__name__)
+
+_registro = ContextVar('registro_consultas', default=None)
+
+
+@dataclass(frozen=True)
+class Resumen:
+    consultas: int
+    milisegundos: float
+    duplicadas: int
+    mas_repetida: str = ''
+
+    def __str__(self):
+        return f'{self.consultas} consultas; {self.milisegundos:.1f} ms; {self.duplicadas} duplicadas'
+
+
+def resumir(consultas):
+    """Resume una lista de pares (sql, segundos)"""
+    repeticiones = Counter(sql for sql, _ in consultas)
+    mas_repetida, veces = repeticiones.most_common(1)[0] if repeticiones else ('', 0)
+    return Resumen(
+        consultas=len(consultas),
+        milisegundos=sum(segundos for _, segundos in consultas) * 1000,
+        duplicadas=len(consultas) - len(repeticiones),
+        mas_repetida=mas_repetida if veces > 1 else '',
+    )
+
+
+def presupuesto_de(vista):
+    """
+    Presupuesto general con lo que se haya ajustado para la vista: por nombre
+    de URL ('ver_multas') o por espacio de nombres ('admin' vale para 'admin:...')
+    """
+    ajustes = settings.PRESUPUESTO_CONSULTAS_VISTAS
+    return {
+        **settings.PRESUPUESTO_CONSULTAS,
+        **ajustes.get(vista.partition(':')[0], {}),
+        **ajustes.get(vista, {}),
+    }
+
+
+def excesos(resumen, presupuesto):
+    """Lo que excede el presupuesto, como textos (lista vacía si lo cumple)"""
+    textos = []
+    if resumen.consultas > presupuesto['consultas']:
+        textos.append(f"{resumen.consultas} consultas (máx. {presupuesto['consultas']})")
+    if resumen.duplicadas > presupuesto['duplicadas']:
+        textos.append(f"{resumen.duplicadas} duplicadas (máx. {presupuesto['duplicadas']})")
+    if resumen.milisegundos > presupuesto['milisegundos']:
+        textos.append(f"{resumen.milisegundos:.0f} ms de SQL (máx. {presupuesto['milisegundos']})")
+    return textos
+
+
+def _registrar(execute, sql, params, many, context):
+    registro = _registro.get()
+    if registro is None:
+        return execute(sql, params, many, context)
+    inicio = time.perf_counter()
+    try:
+        return execute(sql, params, many, context)
+    finally:
+        registro.append((sql, time.perf_counter() - inicio))
+
+
+@receiver(connection_created)
+def instalar_registro(sender, connection, **kwargs):
+    # El mismo DatabaseWrapper vuelve a conectarse tras cerrarse: instalar una sola vez
+    if _registrar not in connection.execute_wrappers:
+        connection.execute_wrappers.append(_registrar)
+
+
+def _revisar(request, response, registro):
+    resumen = resumir(registro)
+    vista = request.resolver_match.view_name if request.resolver_match else ''
+    excedido = excesos(resumen, presupuesto_de(vista))
+    if excedido:
+        logger.warning(
+            "%s %s (%s) excede el presupuesto: %s. Sentencia más repetida: %s",
+            request.method, request.path, vista or '-', '; '.join(excedido),
+            resumen.mas_repetida[:300] or '-',
+        )
+    if settings.DEBUG:
+        response['X-Consultas-SQL'] = str(resumen)
+    return response
+
+
+@sync_and_async_middleware
+def presupuesto_consultas(get_response):
+    """Middleware: va primero en MIDDLEWARE para contar también sesión y usuario"""
+    if iscoroutinefunction(get_response):
+        async def middleware(request):
+            registro = []
+            token = _registro.set(registro)
+            try:
+                response = await get_response(request)
+            finally:
+                _registro.reset(token)
+            return _revisar(request, response, registro)
+    else:
+        def middleware(request):
+            registro = []
+            token = _registro.set(registro)
+            try:
+                response = get_response(request)
+            finally:
+                _registro.reset(token)
+            return _revisar(request, response, registro)
+    return middleware
@@ -0,0 +1,126 @@
+"""
+Recordatorios por correo de préstamos por vencer y vencidos.
+
+Una consulta (sobre el índice parcial de préstamos activos por vencimiento)
+selecciona los préstamos que vencen en los próximos N días o ya vencieron y
+que aún no tienen el recordatorio de su tipo. Los correos se envían por lotes
+reutilizando una sola conexión del backend de correo, con un tope opcional de
+mensajes por segundo, y cada correo enviado queda en RecordatorioEnviado para no
+repetirlo en la siguiente ejecución.
+
+Un destinatario rechazado no detiene el envío: se registra en el log, se salta
+por el resto de la ejecución y se reintenta en la siguiente.
+"""
+import logging
+import smtplib
+import time
+from datetime import timedelta
+
+from django.conf import settings
+from django.core.mail import EmailMessage, get_connection
+from django.db.models import Case, CharField, Exists, OuterRef, Value, When
+from django.template.loader import get_template
+
+from .models import Prestamo, RecordatorioEnviado
+
+logger = logging.getLogger(__name__)
+
+ASUNTOS = {
+    RecordatorioEnviado.POR_VENCER: "Tu préstamo de «{titulo}» vence el {fecha:%d/%m/%Y}",
+    RecordatorioEnviado.VENCIDO: "Tu préstamo de «{titulo}» está vencido",
+}
+
+
+def prestamos_a_recordar(hoy, dias):
+    """Préstamos activos que vencen hasta hoy + dias, sin el recordatorio de su tipo"""
+    tipo = Case(
+        When(fecha_devolucion_esperada__lt=hoy, then=Value(RecordatorioEnviado.VENCIDO)),
+        default=Value(RecordatorioEnviado.POR_VENCER),
+        output_field=CharField(),
+    )
+    ya_enviado = RecordatorioEnviado.objects.filter(prestamo=OuterRef('pk'), tipo=OuterRef('tipo'))
+    return (
+        Prestamo.objects.filter(
+            fecha_devolucion_real__isnull=True,
+            fecha_devolucion_esperada__lte=hoy + timedelta(days=dias),
+        )
+        .exclude(usuario__email='')
+        .annotate(tipo=tipo)
+        .filter(~Exists(ya_enviado))
+        .select_related('usuario', 'libro')
+        .only(
+            'fecha_devolucion_esperada', 'multa_acumulada',
+            'usuario__email', 'usuario__first_name', 'usuario__username',
+            'libro__titulo', 'libro__autor',
+        )
+        .order_by('fecha_devolucion_esperada', 'id')
+    )
+
+
+def _mensajes(prestamos, hoy):
+    plantilla = get_template('recordatorio_prestamo.txt')
+    for prestamo in prestamos:
+        asunto = ASUNTOS[prestamo.tipo].format(
+            titulo=prestamo.libro.titulo, fecha=prestamo.fecha_devolucion_esperada
+        )
+        cuerpo = plantilla.render({
+            'prestamo': prestamo,
+            'usuario': prestamo.usuario,
+            'vencido': prestamo.tipo == RecordatorioEnviado.VENCIDO,
+            'dias': abs((prestamo.fecha_devolucion_esperada - hoy).days),
+        })
+        yield prestamo, EmailMessage(asunto, cuerpo, settings.DEFAULT_FROM_EMAIL, [prestamo.usuario.email])
+
+
+def _enviar_lote(conexion, prestamos, hoy, fallidos):
+    """
+    Envía los correos uno a uno y registra los enviados aunque el lote se
+    interrumpa. Los rechazados se agregan a fallidos. Retorna cuántos se enviaron.
+    """
+    enviados = []
+    try:
+        for prestamo, mensaje in _mensajes(prestamos, hoy):
+            try:
+                conexion.send_messages([mensaje])
+            except smtplib.SMTPServerDisconnected:
+                raise
+            except smtplib.SMTPException as error:
+                logger.warning(
+                    "No se pudo enviar el recordatorio del préstamo %s a %s: %s",
+                    prestamo.pk, prestamo.usuario.email, error,
+                )
+                fallidos.add(prestamo.pk)
+                continue
+            enviados.append(prestamo)
+    finally:
+        RecordatorioEnviado.objects.bulk_create(
+            [RecordatorioEnviado(prestamo=prestamo, tipo=prestamo.tipo) for prestamo in enviados],
+            ignore_conflicts=True,
+        )
+    return len(enviados)
+
+
+def enviar_recordatorios(hoy, dias, lote=100, por_segundo=None, maximo=None, conexion=None):
+    """
+    Envía los recordatorios pendientes y retorna cuántos se enviaron.
+    Cada lote se vuelve a consultar después de registrar el anterior, así que
+    una ejecución interrumpida continúa donde quedó.
+    """
+    conexion = conexion or get_connection()
+    enviados = 0
+    fallidos = set()
+    inicio = time.monotonic()
+    # Una sola conexión (p. ej. SMTP) abierta para todos los lotes
+    with conexion:
+        while maximo is None or enviados < maximo:
+            cantidad = lote if maximo is None else min(lote, maximo - enviados)
+            prestamos = list(prestamos_a_recordar(hoy, dias).exclude(pk__in=fallidos)[:cantidad])
+            if not prestamos:
+                break
+            enviados += _enviar_lote(conexion, prestamos, hoy, fallidos)
+            if por_segundo:
+                # Esperar lo necesario para no superar el ritmo permitido
+                espera = enviados / por_segundo - (time.monotonic() - inicio)
+                if espera > 0:
+                    time.sleep(espera)
+    return enviados
@@ -0,0 +1,107 @@
+"""
+Réplica de solo lectura para los reportes (paneles, multas, préstamos activos).
+
+La réplica es una copia de la base principal que refresca periódicamente
+`manage.py refrescar_replica` (API de respaldo de SQLite). Las vistas marcadas
+con @leer_de_replica leen de ella en los GET; todo lo demás, y cualquier
+escritura, va a la base principal. Así los reportes no compiten con préstamos
+y devoluciones por el archivo principal.
+
+Leer lo propio recién escrito: tras un POST exitoso el middleware
+marcar_escrituras deja una cookie por REPLICA_SEGUNDOS_TRAS_ESCRITURA, y mientras
+exista las vistas marcadas leen de la principal (la réplica puede estar
+atrasada). Una vista cuyo reporte no depende de lo que escribe el propio
+usuario puede omitir esa espera con @leer_de_replica(propias_escrituras=False).
+"""
+import os
+from contextvars import ContextVar
+from functools import wraps
+
+from asgiref.sync import iscoroutinefunction
+from django.conf import settings
+from django.db import DEFAULT_DB_ALIAS, connections
+from django.utils.decorators import sync_and_async_middleware
+
+ALIAS = 'replica'
+COOKIE_ESCRITURA = 'escritura_reciente'
+
+_leer_de = ContextVar('leer_de', default=None)
+
+
+def disponible():
+    """
+    Hay réplica configurada, ya se copió al menos una vez y no es el archivo de
+    la principal (en las pruebas es un espejo de la base de pruebas)
+    """
+    if ALIAS not in settings.DATABASES:
+        return False
+    nombre = connections[ALIAS].settings_dict['NAME']
+    return nombre != connections[DEFAULT_DB_ALIAS].settings_dict['NAME'] and os.path.exists(nombre)
+
+
+class EnrutadorReplica:
+    """DATABASE_ROUTERS: lecturas a la réplica solo dentro de @leer_de_replica"""
+
+    def db_for_read(self, model, **hints):
+        return _leer_de.get()
+
+    def db_for_write(self, model, **hints):
+        # Explícito: si no, Django escribiría en la base de la que se leyó la instancia
+        return DEFAULT_DB_ALIAS
+
+    def allow_relation(self, obj1, obj2, **hints):
+        # Mismos datos en ambas bases
+        return True
+
+    def allow_migrate(self, db, app_label, **hints):
+        # La réplica recibe el esquema con la copia, no con migrate
+        return db != ALIAS
+
+
+def leer_de_replica(view_func=None, *, propias_escrituras=True):
+    """
+    Decorador: los GET de la vista leen de la réplica (si está configurada).
+    Con propias_escrituras=True (por defecto) lee de la principal mientras el
+    cliente tenga escrituras recientes.
+    """
+    def decorar(view_func):
+        @wraps(view_func)
+        def _wrapped(request, *args, **kwargs):
+            if not disponible() or request.method not in ('GET', 'HEAD') or (
+                propias_escrituras and COOKIE_ESCRITURA in request.COOKIES
+            ):
+                return view_func(request, *args, **kwargs)
+            token = _leer_de.set(ALIAS)
+            try:
+                return view_func(request, *args, **kwargs)
+            finally:
+                _leer_de.reset(token)
+        return _wrapped
+
+    return decorar(view_func) if view_func else decorar
+
+
+def _marcar(request, response):
+    if (
+        disponible()
+        and request.method not in ('GET', 'HEAD', 'OPTIONS', 'TRACE')
+        and response.status_code < 400
+    ):
+        response.set_cookie(
+            COOKIE_ESCRITURA, '1',
+            max_age=settings.REPLICA_SEGUNDOS_TRAS_ESCRITURA,
+            httponly=True, samesite='Lax',
+        )
+    return response
+
+
+@sync_and_async_middleware
+def marcar_escrituras(get_response):
+    """Middleware: marca al cliente tras un POST/PUT/PATCH/DELETE que no falló"""
+    if iscoroutinefunction(get_response):
+        async def middleware(request):
+            return _marcar(request, await get_response(request))
+    else:
+        def middleware(request):
+            return _marcar(request, get_response(request))
+    return middleware
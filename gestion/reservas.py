@@ -0,0 +1,236 @@
+"""
+Reservas: cola FIFO por libro para los títulos sin copias disponibles.
+
+La cola es el índice reserva_cola_idx (libro, estado, id), así que la
+siguiente reserva en espera de un libro se obtiene leyendo una sola entrada
+del índice, sin importar el largo de la cola ni del historial. Cuando una copia
+vuelve a circular (devolución, reserva cancelada o expirada, copias nuevas)
+repartir_copias la asigna a esa reserva dentro de la misma transacción; la
+copia queda apartada (Ejemplar.reserva_activa) y no suma a copias_disponibles
+hasta que el lector la retira con prestar_libro o la reserva expira.
+
+Como en prestar_libro, un UPDATE condicional (WHERE estado = 'en_espera') es
+el punto de serialización: si dos devoluciones toman la misma reserva, la
+segunda no actualiza nada y pasa a la siguiente de la cola.
+"""
+from collections import defaultdict
+from dataclasses import dataclass
+from datetime import timedelta
+
+from django.conf import settings
+from django.core.mail import EmailMessage, get_connection
+from django.db import IntegrityError, transaction
+from django.db.models import Count, Exists, F, OuterRef, Subquery
+from django.db.models.functions import Coalesce
+from django.template.loader import get_template
+from django.utils import timezone
+
+from . import cache_catalogo
+from .models import Ejemplar, Libro, Prestamo, Reserva
+
+RESERVADA = 'reservada'
+YA_RESERVADA = 'ya_reservada'
+HAY_COPIAS = 'hay_copias'
+TIENE_EL_LIBRO = 'tiene_el_libro'
+NO_EXISTE = 'no_existe'
+
+
+@dataclass(frozen=True)
+class ResultadoReserva:
+    """Resultado de reservar; estado es una de las constantes del módulo"""
+    estado: str
+    titulo: str = ''
+    reserva: Reserva = None
+
+    @property
+    def ok(self):
+        return self.estado == RESERVADA
+
+
+def _motivo_para_no_reservar(usuario, libro_id):
+    """HAY_COPIAS, TIENE_EL_LIBRO o None si el usuario puede ponerse en la cola"""
+    if Libro.objects.filter(pk=libro_id, copias_disponibles__gt=0).exists():
+        return HAY_COPIAS
+    if Prestamo.objects.filter(
+        usuario=usuario, libro_id=libro_id, fecha_devolucion_real__isnull=True
+    ).exists():
+        return TIENE_EL_LIBRO
+    return None
+
+
+def reservar(usuario, libro_id):
+    """Pone al usuario al final de la cola del libro (solo si no quedan copias disponibles)"""
+    try:
+        libro = Libro.objects.filter(pk=libro_id).only('titulo', 'copias_disponibles').first()
+    except (ValueError, TypeError):
+        return ResultadoReserva(NO_EXISTE)
+    if libro is None:
+        return ResultadoReserva(NO_EXISTE)
+    motivo = _motivo_para_no_reservar(usuario, libro.pk)
+    if motivo:
+        return ResultadoReserva(motivo, titulo=libro.titulo)
+    try:
+        with transaction.atomic():
+            reserva = Reserva.objects.create(usuario=usuario, libro=libro)
+            # Repetir la revisión ya dentro de la transacción de escritura: entretanto
+            # pudo volver una copia a la estantería o prestársele el libro
+            motivo = _motivo_para_no_reservar(usuario, libro.pk)
+            if motivo:
+                transaction.set_rollback(True)
+    except IntegrityError:
+        # Restricción reserva_activa_unica: ya está en la cola o tiene una copia apartada
+        return ResultadoReserva(YA_RESERVADA, titulo=libro.titulo)
+    if motivo:
+        return ResultadoReserva(motivo, titulo=libro.titulo)
+    return ResultadoReserva(RESERVADA, titulo=libro.titulo, reserva=reserva)
+
+
+def repartir_copias(libro_id, ejemplar_ids, ahora=None, notificar=True):
+    """
+    Asigna cada copia a la primera reserva en espera del libro; las que sobran
+    vuelven a la estantería (suben copias_disponibles). Las copias deben estar
+    libres (sin préstamo ni reserva). Llamar dentro de una transacción.
+    Retorna los ids de las reservas asignadas.
+    """
+    ahora = ahora or timezone.now()
+    expira = ahora + timedelta(hours=settings.RESERVA_HORAS_RETIRO)
+    asignadas = []
+    pendientes = list(ejemplar_ids)
+    lo_tiene = Exists(Prestamo.objects.filter(
+        usuario=OuterRef('usuario'), libro_id=libro_id, fecha_devolucion_real__isnull=True
+    ))
+    while pendientes:
+        siguiente = Reserva.objects.filter(
+            libro_id=libro_id, estado=Reserva.EN_ESPERA
+        ).order_by('id').values_list('id', lo_tiene).first()
+        if siguiente is None:
+            break
+        reserva_id, ya_lo_tiene = siguiente
+        if ya_lo_tiene:
+            # El lector ya tiene el libro (p. ej. lo retiró en un kiosco): no podría
+            # retirar la copia apartada, así que su reserva se cancela
+            Reserva.objects.filter(pk=reserva_id, estado=Reserva.EN_ESPERA).update(estado=Reserva.CANCELADA)
+            continue
+        if Reserva.objects.filter(pk=reserva_id, estado=Reserva.EN_ESPERA).update(
+            estado=Reserva.ASIGNADA, ejemplar_id=pendientes[-1], asignada=ahora, expira=expira,
+        ):
+            Ejemplar.objects.filter(pk=pendientes.pop()).update(reserva_activa_id=reserva_id)
+            asignadas.append(reserva_id)
+
+    if pendientes:
+        Libro.objects.filter(pk=libro_id).update(copias_disponibles=F('copias_disponibles') + len(pendientes))
+        # update() no dispara señales
+        transaction.on_commit(cache_catalogo.invalidar)
+    if asignadas and notificar:
+        transaction.on_commit(lambda: notificar_asignadas(asignadas))
+    return asignadas
+
+
+def _soltar(reservas, ahora):
+    """Devuelve a circulación las copias apartadas de reservas que ya no están asignadas"""
+    Ejemplar.objects.filter(reserva_activa_id__in=[reserva.pk for reserva in reservas]).update(reserva_activa=None)
+    por_libro = defaultdict(list)
+    for reserva in reservas:
+        if reserva.ejemplar_id is not None:
+            por_libro[reserva.libro_id].append(reserva.ejemplar_id)
+    asignadas = []
+    for libro_id, ejemplar_ids in por_libro.items():
+        asignadas += repartir_copias(libro_id, ejemplar_ids, ahora, notificar=False)
+    return asignadas
+
+
+def cancelar_reserva(usuario, reserva_id):
+    """Cancela una reserva viva del usuario; si tenía una copia apartada pasa a la siguiente"""
+    ahora = timezone.now()
+    with transaction.atomic():
+        try:
+            reserva = Reserva.objects.filter(
+                pk=reserva_id, usuario=usuario, estado__in=Reserva.ACTIVAS
+            ).only('estado', 'libro', 'ejemplar').first()
+        except (ValueError, TypeError):
+            return False
+        if reserva is None:
+            return False
+        if not Reserva.objects.filter(pk=reserva.pk, estado=reserva.estado).update(estado=Reserva.CANCELADA):
+            return False
+        if reserva.estado == Reserva.ASIGNADA:
+            asignadas = _soltar([reserva], ahora)
+            if asignadas:
+                transaction.on_commit(lambda: notificar_asignadas(asignadas))
+    return True
+
+
+def retirar_reserva(usuario, libro_id, ahora=None):
+    """
+    Marca como retirada la reserva asignada (y vigente) del usuario para el libro.
+    Retorna el id de la copia apartada o None si no tiene una. Lo usa prestar_libro.
+    """
+    ahora = ahora or timezone.now()
+    # Primero el UPDATE (aunque no haya reserva): en SQLite una transacción que
+    # empieza leyendo no puede luego tomar el bloqueo de escritura si otra escribe
+    if not Reserva.objects.filter(
+        usuario=usuario, libro_id=libro_id, estado=Reserva.ASIGNADA, expira__gt=ahora
+    ).update(estado=Reserva.RETIRADA):
+        return None
+    return Reserva.objects.filter(
+        usuario=usuario, libro_id=libro_id, estado=Reserva.RETIRADA
+    ).order_by('-id').values_list('ejemplar_id', flat=True).first()
+
+
+def expirar_reservas(ahora=None, lote=1000):
+    """
+    Expira en bloque las reservas asignadas cuyo plazo de retiro venció y pasa
+    sus copias a la siguiente reserva de cada cola (o a la estantería). Cada
+    lote es una transacción. Retorna (expiradas, reasignadas).
+    """
+    ahora = ahora or timezone.now()
+    expiradas = reasignadas = 0
+    while True:
+        with transaction.atomic():
+            vencidas = list(
+                Reserva.objects.filter(estado=Reserva.ASIGNADA, expira__lte=ahora)
+                .order_by('expira')
+                .only('libro', 'ejemplar')[:lote]
+            )
+            if not vencidas:
+                break
+            Reserva.objects.filter(
+                pk__in=[reserva.pk for reserva in vencidas], estado=Reserva.ASIGNADA
+            ).update(estado=Reserva.EXPIRADA)
+            asignadas = _soltar(vencidas, ahora)
+        # Fuera de la transacción: un correo que falla no deshace el lote
+        notificar_asignadas(asignadas)
+        expiradas += len(vencidas)
+        reasignadas += len(asignadas)
+    return expiradas, reasignadas
+
+
+def posiciones(reservas):
+    """
+    Anota en cada reserva del queryset su posición en la cola, en la misma
+    consulta: por fila, una subconsulta cuenta en reserva_cola_idx las
+    reservas en espera anteriores del mismo libro
+    """
+    delante = Reserva.objects.filter(
+        libro_id=OuterRef('libro_id'), estado=Reserva.EN_ESPERA, id__lt=OuterRef('id')
+    ).order_by().values('libro_id').annotate(cantidad=Count('id')).values('cantidad')
+    return reservas.annotate(posicion=Coalesce(Subquery(delante), 0) + 1)
+
+
+def notificar_asignadas(reserva_ids):
+    """Avisa por correo (una sola conexión) que la copia reservada está lista para retirar"""
+    if not reserva_ids:
+        return
+    plantilla = get_template('reserva_asignada.txt')
+    mensajes = [
+        EmailMessage(
+            f"Tu reserva de «{reserva.libro.titulo}» está lista para retirar",
+            plantilla.render({'reserva': reserva, 'usuario': reserva.usuario}),
+            to=[reserva.usuario.email],
+        )
+        for reserva in Reserva.objects.filter(
+            pk__in=reserva_ids, estado=Reserva.ASIGNADA
+        ).exclude(usuario__email='').select_related('usuario', 'libro')
+    ]
+    if mensajes:
+        get_connection(fail_silently=True).send_messages(mensajes)
@@ -0,0 +1,58 @@
+from rest_framework import serializers
+
+from .models import Libro, Prestamo
+
+
+class CamposDinamicosMixin:
+    """
+    Permite pedir solo algunos campos: ?campos=id,titulo
+    Los campos desconocidos se ignoran; si no queda ninguno se usan todos.
+    """
+
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        campos = campos_solicitados(self.context.get('request'))
+        if campos:
+            conservar = set(campos) & set(self.fields)
+            if conservar:
+                for nombre in set(self.fields) - conservar:
+                    self.fields.pop(nombre)
+
+
+def campos_solicitados(request):
+    """Lista de campos del parámetro ?campos= (vacía si no se indicó)"""
+    if request is None:
+        return []
+    valor = request.query_params.get('campos', '')
+    return [campo.strip() for campo in valor.split(',') if campo.strip()]
+
+
+class LibroSerializer(CamposDinamicosMixin, serializers.ModelSerializer):
+    genero_display = serializers.CharField(source='get_genero_display', read_only=True)
+    disponible = serializers.BooleanField(read_only=True)
+
+    class Meta:
+        model = Libro
+        fields = (
+            'id', 'titulo', 'autor', 'genero', 'genero_display',
+            'disponible', 'copias_total', 'copias_disponibles',
+        )
+        # Las copias se agregan o retiran como ejemplares (gestionar_libros, admin)
+        read_only_fields = ('copias_total', 'copias_disponibles')
+
+
+class PrestamoSerializer(CamposDinamicosMixin, serializers.ModelSerializer):
+    libro_titulo = serializers.CharField(source='libro.titulo', read_only=True)
+    usuario = serializers.CharField(source='usuario.username', read_only=True)
+    activo = serializers.SerializerMethodField()
+
+    class Meta:
+        model = Prestamo
+        fields = (
+            'id', 'libro', 'libro_titulo', 'usuario', 'fecha_prestamo',
+            'fecha_devolucion_esperada', 'fecha_devolucion_real', 'multa', 'activo',
+        )
+        read_only_fields = fields
+
+    def get_activo(self, obj):
+        return obj.fecha_devolucion_real is None
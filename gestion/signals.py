@@ -0,0 +1,104 @@
+"""
+Señales que mantienen los contadores de gestion/estadisticas.py e invalidan
+la caché del catálogo (gestion/cache_catalogo.py).
+
+Para detectar cambios en un update se guarda el valor original al cargar
+la instancia (post_init). Las operaciones masivas (bulk_create, update())
+no disparan señales: quien las use debe ajustar los contadores (o ejecutar
+recalcular_estadisticas) e invalidar la caché del catálogo.
+"""
+from django.contrib.auth.models import User
+from django.db import transaction
+from django.db.models import F
+from django.db.models.signals import post_delete, post_init, post_save
+from django.dispatch import receiver
+
+from . import cache_catalogo, estadisticas
+from .models import Ejemplar, Libro, Prestamo, SaldoMulta
+
+
+@receiver(post_init, sender=Libro)
+def recordar_genero(sender, instance, **kwargs):
+    # Evitar una consulta extra si el campo fue diferido (.only / .defer)
+    instance._genero_guardado = instance.__dict__.get('genero')
+
+
+@receiver(post_save, sender=Libro)
+def libro_guardado(sender, instance, created, raw=False, **kwargs):
+    if raw:
+        return
+    if created:
+        estadisticas.ajustar(total_libros=1)
+        estadisticas.ajustar_genero(instance.genero, 1)
+        Ejemplar.objects.bulk_create([Ejemplar(libro=instance) for _ in range(instance.copias_total)])
+    elif instance._genero_guardado is not None and instance._genero_guardado != instance.genero:
+        estadisticas.ajustar_genero(instance._genero_guardado, -1)
+        estadisticas.ajustar_genero(instance.genero, 1)
+    instance._genero_guardado = instance.genero
+
+
+@receiver(post_delete, sender=Libro)
+def libro_eliminado(sender, instance, **kwargs):
+    estadisticas.ajustar(total_libros=-1)
+    estadisticas.ajustar_genero(instance.genero, -1)
+
+
+@receiver(post_init, sender=Prestamo)
+def recordar_estado_prestamo(sender, instance, **kwargs):
+    if 'fecha_devolucion_real' in instance.__dict__:
+        instance._activo_guardado = instance.fecha_devolucion_real is None
+    else:
+        instance._activo_guardado = None
+
+
+@receiver(post_save, sender=Prestamo)
+def prestamo_guardado(sender, instance, created, raw=False, **kwargs):
+    if raw:
+        return
+    activo = instance.fecha_devolucion_real is None
+    if created:
+        if activo:
+            estadisticas.ajustar(prestamos_activos=1)
+    elif instance._activo_guardado is not None and instance._activo_guardado != activo:
+        # Devolución (activo -> devuelto) o reapertura desde el admin
+        estadisticas.ajustar(prestamos_activos=1 if activo else -1)
+    instance._activo_guardado = activo
+
+
+@receiver(post_delete, sender=Prestamo)
+def prestamo_eliminado(sender, instance, **kwargs):
+    if instance.fecha_devolucion_real is None:
+        estadisticas.ajustar(prestamos_activos=-1)
+        if instance.ejemplar_id:
+            # on_delete=SET_NULL ya dejó libre la copia: reponerla en el contador
+            Libro.objects.filter(
+                pk=instance.libro_id, copias_disponibles__lt=F('copias_total')
+            ).update(copias_disponibles=F('copias_disponibles') + 1)
+
+
+@receiver(post_save, sender=User)
+def usuario_guardado(sender, instance, created, raw=False, **kwargs):
+    if created and not raw:
+        estadisticas.ajustar(total_usuarios=1)
+
+
+@receiver(post_delete, sender=User)
+def usuario_eliminado(sender, instance, **kwargs):
+    estadisticas.ajustar(total_usuarios=-1)
+
+
+@receiver(post_delete, sender=SaldoMulta)
+def saldo_eliminado(sender, instance, **kwargs):
+    # Al borrar un usuario se borran también sus movimientos de multa
+    estadisticas.ajustar(total_multas=-instance.total_cargado, saldo_multas=-instance.saldo)
+
+
+@receiver(post_save, sender=Libro)
+@receiver(post_delete, sender=Libro)
+@receiver(post_save, sender=Prestamo)
+@receiver(post_delete, sender=Prestamo)
+def catalogo_modificado(sender, raw=False, **kwargs):
+    # Después del commit: invalidar antes permitiría que otra petición vuelva
+    # a guardar en caché los datos previos bajo la nueva generación
+    if not raw:
+        transaction.on_commit(cache_catalogo.invalidar)
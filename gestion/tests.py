@@ -1,3 +1,1109 @@
-from django.test import TestCase
+import base64
+import io
+import json
+import os
+import smtplib
+import sqlite3
+import tempfile
+import threading
+from datetime import date, timedelta
+from decimal import Decimal
+from unittest import mock
 
-# Create your tests here.
+from django.conf import settings
+from django.contrib import admin
+from django.contrib.auth.models import User
+from django.core import mail, signing
+from django.core.cache import cache
+from django.core.management import CommandError, call_command
+from django.db import OperationalError, connection, router, transaction
+from django.db.backends.sqlite3.base import DatabaseWrapper
+from django.http import HttpResponse
+from django.test import Client, RequestFactory, TestCase, TransactionTestCase, override_settings
+from django.test.utils import CaptureQueriesContext
+from django.urls import URLPattern, reverse
+from django.utils import timezone
+
+from cuentas import urls as cuentas_urls
+from cuentas.models import PerfilUsuario
+from cuentas.validadores import digito_verificador, validar_rut
+
+from . import cache_catalogo, estadisticas, urls as gestion_urls
+from .admin import MovimientoMultaForm, PrestamoAdmin
+from .busqueda import buscar_libros, sincronizacion_suspendida, suspender_sincronizacion
+from .circulacion import (
+    DEVUELTO, NO_DISPONIBLE, NO_EXISTE, PRESTADO, SIN_PRESTAMO, YA_LO_TIENE,
+    ajustar_copias, prestar_libro, procesar_lote,
+)
+from .models import (
+    ConteoGenero, EjecucionMultas, Ejemplar, Estadisticas, Libro, MovimientoMulta, OperacionKiosco, Prestamo,
+    RecordatorioEnviado, Reserva, SaldoMulta,
+)
+from .multas import anotar_atraso, calcular_multa, registrar_cargo, registrar_pago, saldo_de
+from .paginacion import SALT_CURSOR, paginar
+from .presupuesto import excesos, presupuesto_de, resumir
+from .recordatorios import enviar_recordatorios
+from .replica import COOKIE_ESCRITURA, leer_de_replica
+from .reservas import (
+    HAY_COPIAS, RESERVADA, YA_RESERVADA, cancelar_reserva, expirar_reservas, posiciones, reservar,
+)
+
+
+class PrestarLibroTests(TestCase):
+    def setUp(self):
+        self.lector = User.objects.create_user('lector', 'lector@example.com', 'Clave123!')
+        self.otro = User.objects.create_user('otro', 'otro@example.com', 'Clave123!')
+        self.libro = Libro.objects.create(titulo='Rayuela', autor='Julio Cortázar', genero='ficcion')
+
+    def test_presta_libro_disponible(self):
+        resultado = prestar_libro(self.lector, self.libro.id, 7)
+        self.assertEqual(resultado.estado, PRESTADO)
+        self.assertEqual(resultado.titulo, 'Rayuela')
+        self.libro.refresh_from_db()
+        self.assertFalse(self.libro.disponible)
+
+    def test_libro_ya_prestado(self):
+        prestar_libro(self.lector, self.libro.id, 7)
+        self.assertEqual(prestar_libro(self.otro, self.libro.id, 7).estado, NO_DISPONIBLE)
+        self.assertEqual(prestar_libro(self.lector, self.libro.id, 7).estado, YA_LO_TIENE)
+        self.assertEqual(Prestamo.objects.count(), 1)
+
+    def test_libro_inexistente(self):
+        self.assertEqual(prestar_libro(self.lector, 999, 7).estado, NO_EXISTE)
+        self.assertEqual(prestar_libro(self.lector, 'abc', 7).estado, NO_EXISTE)
+
+    def test_prestamo_activo_con_contador_inconsistente(self):
+        # La restricción única impide prestar la misma copia aunque el contador diga que hay una libre
+        prestar_libro(self.lector, self.libro.id, 7)
+        Libro.objects.filter(pk=self.libro.pk).update(copias_disponibles=1)
+        Ejemplar.objects.filter(libro=self.libro).update(prestamo_activo=None)
+        self.assertEqual(prestar_libro(self.otro, self.libro.id, 7).estado, NO_DISPONIBLE)
+        self.assertEqual(Prestamo.objects.count(), 1)
+
+    def test_camino_feliz_sin_lecturas_previas(self):
+        # Savepoint, UPDATE de la reserva apartada (ninguna), UPDATE condicional del contador, copia
+        # libre, INSERT, contador de estadísticas, puntero de la copia, cancelar la reserva en
+        # espera (ninguna), release y el título
+        with self.assertNumQueries(10):
+            prestar_libro(self.lector, self.libro.id, 7)
+
+    def test_devolucion_libera_el_libro(self):
+        prestamo = prestar_libro(self.lector, self.libro.id, 7).prestamo
+        self.client.force_login(self.lector)
+        self.client.post(reverse('registrar_devolucion'), {'prestamo_id': prestamo.id})
+        self.libro.refresh_from_db()
+        self.assertEqual(self.libro.copias_disponibles, 1)
+        self.assertFalse(Ejemplar.objects.filter(prestamo_activo__isnull=False).exists())
+        self.assertEqual(prestar_libro(self.otro, self.libro.id, 7).estado, PRESTADO)
+
+    def test_devolucion_simultanea_cobra_una_vez(self):
+        prestamo = prestar_libro(self.lector, self.libro.id, 7).prestamo
+        Prestamo.objects.filter(pk=prestamo.pk).update(
+            fecha_devolucion_esperada=timezone.localdate() - timedelta(days=3)
+        )
+        self.client.force_login(self.lector)
+        url, datos = reverse('registrar_devolucion'), {'prestamo_id': prestamo.id}
+        # Otra petición (doble envío) leyó el préstamo cuando aún estaba activo
+        leido_antes = Prestamo.objects.get(pk=prestamo.pk)
+        self.client.post(url, datos)
+
+        with mock.patch.object(Prestamo.objects, 'get', return_value=leido_antes):
+            respuesta = self.client.post(url, datos)
+        self.assertRedirects(respuesta, reverse('registrar_devolucion'))
+        self.assertEqual(saldo_de(self.lector), Decimal('3000.00'))
+        self.assertEqual(MovimientoMulta.objects.count(), 1)
+        self.assertEqual(estadisticas.verificar(), [])
+
+    def test_varias_copias(self):
+        libro = Libro.objects.create(titulo='Ficciones', autor='Jorge Luis Borges', copias_total=2)
+        self.assertEqual(libro.ejemplares.count(), 2)
+        primero = prestar_libro(self.lector, libro.id, 7).prestamo
+        self.assertEqual(prestar_libro(self.lector, libro.id, 7).estado, YA_LO_TIENE)
+        segundo = prestar_libro(self.otro, libro.id, 7).prestamo
+        self.assertNotEqual(primero.ejemplar_id, segundo.ejemplar_id)
+        tercero = User.objects.create_user('tercero', 'tercero@example.com', 'Clave123!')
+        self.assertEqual(prestar_libro(tercero, libro.id, 7).estado, NO_DISPONIBLE)
+        libro.refresh_from_db()
+        self.assertEqual((libro.copias_disponibles, libro.copias_total), (0, 2))
+        self.assertEqual(estadisticas.verificar(), [])
+
+    def test_ajustar_copias_solo_retira_copias_libres(self):
+        prestar_libro(self.lector, self.libro.id, 7)
+        self.assertTrue(ajustar_copias(self.libro, 3))
+        self.libro.refresh_from_db()
+        self.assertEqual((self.libro.copias_disponibles, self.libro.copias_total), (2, 3))
+        self.assertFalse(ajustar_copias(self.libro, 0))
+        self.assertTrue(ajustar_copias(self.libro, 1))
+        self.libro.refresh_from_db()
+        self.assertEqual((self.libro.copias_disponibles, self.libro.copias_total), (0, 1))
+        self.assertEqual(self.libro.ejemplares.get().prestamo_activo.usuario, self.lector)
+        self.assertEqual(estadisticas.verificar(), [])
+
+
+class PrestarLibroConcurrenteTests(TransactionTestCase):
+    HILOS = 8
+    LIBROS = 20
+
+    def setUp(self):
+        self.usuarios = [
+            User.objects.create_user(f'lector{i}', f'lector{i}@example.com', 'Clave123!')
+            for i in range(self.HILOS)
+        ]
+        self.libros = [
+            Libro.objects.create(titulo=f'Libro {i}', autor='Autor', genero='otro')
+            for i in range(self.LIBROS)
+        ]
+
+    def test_sin_prestamos_dobles_bajo_contencion(self):
+        barrera = threading.Barrier(self.HILOS)
+        resultados = []
+        errores = []
+
+        def pedir_todos(usuario):
+            try:
+                barrera.wait()
+                for libro in self.libros:
+                    resultados.append(prestar_libro(usuario, libro.id, 7).estado)
+            except Exception as e:  # pragma: no cover - se reporta en la aserción
+                errores.append(e)
+            finally:
+                connection.close()
+
+        hilos = [threading.Thread(target=pedir_todos, args=(u,)) for u in self.usuarios]
+        for hilo in hilos:
+            hilo.start()
+        for hilo in hilos:
+            hilo.join()
+
+        self.assertEqual(errores, [])
+        self.assertEqual(len(resultados), self.HILOS * self.LIBROS)
+        # Cada libro se prestó exactamente una vez
+        self.assertEqual(resultados.count(PRESTADO), self.LIBROS)
+        self.assertEqual(Prestamo.objects.count(), self.LIBROS)
+        self.assertEqual(
+            Prestamo.objects.values('libro').distinct().count(), self.LIBROS
+        )
+        self.assertFalse(Libro.objects.filter(copias_disponibles__gt=0).exists())
+        self.assertFalse(Ejemplar.objects.filter(prestamo_activo__isnull=True).exists())
+
+
+class ProcesarLoteTests(TestCase):
+    def setUp(self):
+        self.lector = User.objects.create_user('lector', 'lector@example.com', 'Clave123!')
+        self.libro = Libro.objects.create(titulo='Ficciones', autor='Jorge Luis Borges', genero='ficcion')
+        self.otro_libro = Libro.objects.create(titulo='El Aleph', autor='Jorge Luis Borges', genero='ficcion')
+
+    def test_aplica_operaciones_en_orden(self):
+        vencido = Prestamo.objects.create(
+            usuario=self.lector,
+            libro=self.otro_libro,
+            fecha_devolucion_esperada=timezone.now().date() - timedelta(days=3),
+        )
+        ejemplar = self.otro_libro.ejemplares.get()
+        Prestamo.objects.filter(pk=vencido.pk).update(ejemplar=ejemplar)
+        Ejemplar.objects.filter(pk=ejemplar.pk).update(prestamo_activo=vencido)
+        Libro.objects.filter(pk=self.otro_libro.pk).update(copias_disponibles=0)
+
+        resultados = procesar_lote([
+            {'clave': 'a', 'tipo': 'prestamo', 'libro_id': self.libro.id, 'usuario_id': self.lector.id},
+            {'clave': 'b', 'tipo': 'prestamo', 'libro_id': self.libro.id, 'usuario_id': self.lector.id},
+            {'clave': 'c', 'tipo': 'devolucion', 'libro_id': self.otro_libro.id},
+            {'clave': 'd', 'tipo': 'devolucion', 'libro_id': self.otro_libro.id},
+            {'clave': 'e', 'tipo': 'prestamo', 'libro_id': 999, 'usuario_id': self.lector.id},
+        ])
+
+        self.assertEqual(
+            [r['estado'] for r in resultados],
+            [PRESTADO, NO_DISPONIBLE, DEVUELTO, SIN_PRESTAMO, NO_EXISTE],
+        )
+        vencido.refresh_from_db()
+        # Misma regla que registrar_devolucion: $1000 por día de atraso
+        self.assertEqual(vencido.multa, Decimal('3000.00'))
+        self.assertEqual(saldo_de(self.lector), Decimal('3000.00'))
+        self.assertFalse(Libro.objects.get(pk=self.libro.pk).disponible)
+        self.assertTrue(Libro.objects.get(pk=self.otro_libro.pk).disponible)
+        self.assertEqual(estadisticas.verificar(), [])
+
+    def test_claves_repetidas_no_se_aplican_dos_veces(self):
+        operacion = {'clave': 'k1', 'tipo': 'prestamo', 'libro_id': self.libro.id, 'usuario_id': self.lector.id}
+        primero = procesar_lote([operacion])
+        segundo = procesar_lote([operacion])
+
+        self.assertEqual(primero[0]['estado'], PRESTADO)
+        self.assertEqual(segundo[0]['estado'], PRESTADO)
+        self.assertTrue(segundo[0]['repetida'])
+        self.assertEqual(Prestamo.objects.count(), 1)
+        self.assertEqual(OperacionKiosco.objects.count(), 1)
+
+
+    def test_base_bloqueada_responde_reintente(self):
+        biblio = User.objects.create_user('biblio', 'biblio@example.com', 'Clave123!')
+        PerfilUsuario.objects.create(
+            usuario=biblio, rut='11111111-1', direccion='Calle 1', telefono='912345678', rol='bibliotecario',
+        )
+        self.client.force_login(biblio)
+        cuerpo = {'operaciones': [
+            {'clave': 'k1', 'tipo': 'prestamo', 'libro_id': self.libro.id, 'usuario_id': self.lector.id},
+        ]}
+        with mock.patch('gestion.views.procesar_lote', side_effect=OperationalError('database is locked')):
+            respuesta = self.client.post(
+                reverse('sincronizar_kiosco'), json.dumps(cuerpo), content_type='application/json'
+            )
+        self.assertEqual(respuesta.status_code, 409)
+
+
+class PerfilSqliteTests(TestCase):
+    def test_pragmas_al_abrir_la_conexion(self):
+        with tempfile.TemporaryDirectory() as directorio:
+            configuracion = {
+                **connection.settings_dict, **settings.SQLITE_PRODUCCION,
+                'NAME': os.path.join(directorio, 'perfil.sqlite3'),
+            }
+            conexion = DatabaseWrapper(configuracion, 'perfil')
+            try:
+                with conexion.cursor() as cursor:
+                    valores = []
+                    for pragma in ('journal_mode', 'synchronous', 'busy_timeout', 'temp_store'):
+                        cursor.execute(f'PRAGMA {pragma}')
+                        valores.append(cursor.fetchone()[0])
+                self.assertEqual(valores, ['wal', 1, 5000, 2])
+                self.assertEqual(conexion.transaction_mode, 'IMMEDIATE')
+            finally:
+                conexion.close()
+
+
+class ReplicaTests(TestCase):
+    def test_reportes_leen_de_la_replica_solo_en_get_sin_escrituras_recientes(self):
+        destinos = []
+
+        @leer_de_replica
+        def vista(request):
+            destinos.append(router.db_for_read(Prestamo))
+            return HttpResponse()
+
+        fabrica = RequestFactory()
+        tras_escritura = fabrica.get('/')
+        tras_escritura.COOKIES[COOKIE_ESCRITURA] = '1'
+        with mock.patch('gestion.replica.disponible', return_value=True):
+            for peticion in (fabrica.get('/'), fabrica.post('/'), tras_escritura):
+                vista(peticion)
+            leer_de_replica(propias_escrituras=False)(vista)(tras_escritura)
+        with mock.patch('gestion.replica.disponible', return_value=False):
+            vista(fabrica.get('/'))
+        self.assertEqual(destinos, ['replica', 'default', 'default', 'replica', 'default'])
+
+        # Fuera de la vista y para escribir siempre la principal, aunque la instancia venga de la réplica
+        libro = Libro(titulo='Rayuela', autor='Julio Cortázar')
+        libro._state.db = 'replica'
+        self.assertEqual(router.db_for_read(Libro), 'default')
+        self.assertEqual(router.db_for_write(Libro, instance=libro), 'default')
+
+    def test_post_exitoso_marca_escritura_reciente(self):
+        lector = User.objects.create_user('lector', 'lector@example.com', 'Clave123!')
+        libro = Libro.objects.create(titulo='Rayuela', autor='Julio Cortázar')
+        self.client.force_login(lector)
+        with mock.patch('gestion.replica.disponible', return_value=True):
+            self.assertNotIn(COOKIE_ESCRITURA, self.client.get(reverse('registrar_prestamo')).cookies)
+            respuesta = self.client.post(reverse('registrar_prestamo'), {'libro_id': libro.id})
+        self.assertEqual(respuesta.cookies[COOKIE_ESCRITURA]['max-age'], 120)
+
+    def test_refresco_periodico_sobrevive_a_una_copia_fallida(self):
+        class Detener(Exception):
+            pass
+
+        salida, errores = io.StringIO(), io.StringIO()
+        # La propia base de pruebas hace de réplica; la copia falla una vez y luego funciona
+        with mock.patch('gestion.replica.ALIAS', 'default'), mock.patch(
+            'gestion.management.commands.refrescar_replica.Command._copiar',
+            side_effect=[sqlite3.OperationalError('database is locked'), 12],
+        ), mock.patch('time.sleep', side_effect=[None, Detener]):
+            with self.assertRaises(Detener):
+                call_command('refrescar_replica', '--cada', '60', stdout=salida, stderr=errores)
+        self.assertIn('database is locked', errores.getvalue())
+        self.assertIn('12 páginas', salida.getvalue())
+
+
+class EstadisticasTests(TestCase):
+    def setUp(self):
+        self.lector = User.objects.create_user('lector', 'lector@example.com', 'Clave123!')
+
+    def _guardado(self):
+        estado = Estadisticas.obtener()
+        contadores = {campo: getattr(estado, campo) for campo in estadisticas.calcular_desde_cero()[0]}
+        por_genero = dict(ConteoGenero.objects.filter(total__gt=0).values_list('genero', 'total'))
+        copias = list(Libro.objects.order_by('id').values_list('copias_total', 'copias_disponibles'))
+        return contadores, por_genero, copias
+
+    def assertCoincideConRecalcular(self):
+        guardado = self._guardado()
+        estadisticas.recalcular()
+        self.assertEqual(guardado, self._guardado())
+        self.assertEqual(estadisticas.verificar(), [])
+
+    def test_senales_mantienen_los_contadores(self):
+        rayuela = Libro.objects.create(titulo='Rayuela', autor='Julio Cortázar', genero='ficcion')
+        cosmos = Libro.objects.create(titulo='Cosmos', autor='Carl Sagan', genero='ciencia', copias_total=2)
+        dune = Libro.objects.create(titulo='Dune', autor='Frank Herbert', genero='ficcion')
+        dune.genero = 'fantasia'
+        dune.save()
+        otro = User.objects.create_user('otro', 'otro@example.com', 'Clave123!')
+        self.assertCoincideConRecalcular()
+
+        # Préstamos: uno devuelto por la vista, otro desde el admin y otro borrado activo
+        devuelto = prestar_libro(self.lector, rayuela.id, 7).prestamo
+        por_admin = prestar_libro(otro, cosmos.id, 7).prestamo
+        borrado = prestar_libro(self.lector, cosmos.id, 7).prestamo
+        prestar_libro(otro, dune.id, 7)
+        self.assertEqual(Estadisticas.obtener().prestamos_activos, 4)
+        self.client.force_login(self.lector)
+        self.client.post(reverse('registrar_devolucion'), {'prestamo_id': devuelto.id})
+        por_admin = Prestamo.objects.get(pk=por_admin.pk)
+        por_admin.fecha_devolucion_real = timezone.localdate()
+        PrestamoAdmin(Prestamo, admin.site).save_model(None, por_admin, None, True)
+        borrado.delete()
+        self.assertEqual(Estadisticas.obtener().prestamos_activos, 1)
+        self.assertCoincideConRecalcular()
+
+        # Borrar libros (con su historial) y usuarios con saldo de multas
+        registrar_cargo(otro, '2000')
+        Libro.objects.get(pk=rayuela.pk).delete()
+        otro.delete()
+        estado = Estadisticas.obtener()
+        self.assertEqual((estado.total_libros, estado.total_usuarios, estado.prestamos_activos), (2, 1, 0))
+        self.assertCoincideConRecalcular()
+
+    def test_verificar_detecta_desfases_y_el_comando_los_corrige(self):
+        libro = Libro.objects.create(titulo='Rayuela', autor='Julio Cortázar', genero='ficcion')
+        prestar_libro(self.lector, libro.id, 7)
+        self.assertEqual(estadisticas.verificar(), [])
+
+        # Cambios masivos que no disparan señales
+        Libro.objects.filter(pk=libro.pk).update(genero='poesia', copias_disponibles=1)
+        Estadisticas.objects.filter(pk=1).update(prestamos_activos=5)
+        self.assertEqual(sorted(estadisticas.verificar()), [
+            ('genero:ficcion', 1, 0),
+            ('genero:poesia', 0, 1),
+            ('libros con copias desfasadas', 1, 0),
+            ('prestamos_activos', 5, 1),
+        ])
+        with self.assertRaisesMessage(CommandError, '4 contador(es) no coinciden.'):
+            call_command('recalcular_estadisticas', '--verificar', stdout=io.StringIO(), stderr=io.StringIO())
+
+        call_command('recalcular_estadisticas', stdout=io.StringIO())
+        self.assertEqual(estadisticas.verificar(), [])
+        libro.refresh_from_db()
+        self.assertEqual(libro.copias_disponibles, 0)
+
+
+class PaginacionTests(TestCase):
+    def setUp(self):
+        self.factory = RequestFactory()
+        # Títulos repetidos: el orden lo desempata el id
+        for i in range(11):
+            Libro.objects.create(titulo=f'Tomo {i % 3}', autor='Autor', genero='otro')
+
+    def _pagina(self, url, queryset, orden):
+        return paginar(self.factory.get(f'/{url}'), queryset, orden, por_pagina=3)
+
+    def _recorrer(self, queryset, orden):
+        """Ids hacia adelante y luego hacia atrás desde la última página"""
+        adelante, pagina = [], self._pagina('', queryset, orden)
+        adelante.extend(libro.id for libro in pagina)
+        while pagina.tiene_siguiente:
+            pagina = self._pagina(pagina.url_siguiente, queryset, orden)
+            adelante.extend(libro.id for libro in pagina)
+        atras = [libro.id for libro in pagina]
+        while pagina.tiene_anterior:
+            pagina = self._pagina(pagina.url_anterior, queryset, orden)
+            atras[:0] = [libro.id for libro in pagina]
+        return adelante, atras
+
+    def test_recorrido_sin_repetidos_ni_saltos_con_empates(self):
+        esperado = list(Libro.objects.order_by('titulo', 'id').values_list('id', flat=True))
+        self.assertEqual(self._recorrer(Libro.objects.all(), ('titulo',)), (esperado, esperado))
+        esperado.reverse()
+        self.assertEqual(self._recorrer(Libro.objects.all(), ('-titulo',)), (esperado, esperado))
+
+    def test_cursor_manipulado_vuelve_a_la_primera_pagina(self):
+        primera = [libro.id for libro in self._pagina('', Libro.objects.all(), ('titulo',))]
+        cursor = self._pagina('', Libro.objects.all(), ('titulo',)).url_siguiente.split('=', 1)[1]
+        ajeno = signing.dumps({'v': ['Tomo 2', 1], 'd': 'sig'}, salt='otra.sal')
+        incompleto = signing.dumps({'v': ['Tomo 2'], 'd': 'sig'}, salt=SALT_CURSOR)
+        for manipulado in ('basura', cursor[:-2] + 'xx', ajeno, incompleto):
+            with self.subTest(cursor=manipulado):
+                pagina = self._pagina(f'?cursor={manipulado}', Libro.objects.all(), ('titulo',))
+                self.assertEqual([libro.id for libro in pagina], primera)
+                self.assertFalse(pagina.tiene_anterior)
+
+        self.client.force_login(User.objects.create_user('lector', 'lector@example.com', 'Clave123!'))
+        respuesta = self.client.get(reverse('disponibilidad_libros'), {'cursor': 'basura'})
+        self.assertEqual(respuesta.status_code, 200)
+
+    def test_busqueda_ordenada_por_relevancia(self):
+        en_autor = Libro.objects.create(titulo='Cuentos', autor='Ana Historia', genero='otro')
+        en_titulo = [
+            Libro.objects.create(titulo='Historia de Chile', autor='Autor', genero='otro') for _ in range(4)
+        ]
+        resultados = buscar_libros(Libro.objects.all(), 'historia')
+        adelante, atras = self._recorrer(resultados, ('relevancia',))
+        self.assertEqual(adelante, [libro.id for libro in en_titulo] + [en_autor.id])
+        self.assertEqual(atras, adelante)
+
+    def test_cursor_invalido_en_la_api_responde_400(self):
+        User.objects.create_user('lector', 'lector@example.com', 'Clave123!')
+        token = self.client.post('/api/v1/token/', {'username': 'lector', 'password': 'Clave123!'}).json()
+        cabecera = {'HTTP_AUTHORIZATION': f"Bearer {token['access']}"}
+        # Posición de texto donde el orden de los préstamos espera un id
+        posicion_ajena = base64.b64encode(b'p=abc').decode()
+        for url, cursor in (
+            ('/api/v1/libros/', 'basura'),
+            ('/api/v1/mis-prestamos/', 'basura'),
+            ('/api/v1/mis-prestamos/', posicion_ajena),
+        ):
+            with self.subTest(url=url, cursor=cursor):
+                respuesta = self.client.get(url, {'cursor': cursor}, **cabecera)
+                self.assertEqual(respuesta.status_code, 400)
+
+
+class ApiTests(TestCase):
+    def setUp(self):
+        self.lector = User.objects.create_user('lector', 'lector@example.com', 'Clave123!')
+        for i in range(3):
+            Libro.objects.create(titulo=f'Libro {i}', autor='Autor', genero='ciencia')
+        prestar_libro(self.lector, Libro.objects.first().id, 7)
+
+    def _token(self, username):
+        respuesta = self.client.post('/api/v1/token/', {'username': username, 'password': 'Clave123!'})
+        return {'HTTP_AUTHORIZATION': f"Bearer {respuesta.json()['access']}"}
+
+    def test_requiere_autenticacion(self):
+        self.assertEqual(self.client.get('/api/v1/libros/').status_code, 401)
+
+    def test_catalogo_con_campos_y_cursor(self):
+        respuesta = self.client.get('/api/v1/libros/?campos=id,titulo&tamano=2', **self._token('lector'))
+        datos = respuesta.json()
+        self.assertEqual(datos['results'], [
+            {'id': libro.id, 'titulo': libro.titulo} for libro in Libro.objects.order_by('titulo')[:2]
+        ])
+        siguiente = self.client.get(datos['next'], **self._token('lector')).json()
+        self.assertEqual([libro['titulo'] for libro in siguiente['results']], ['Libro 2'])
+
+    def test_busqueda_por_relevancia(self):
+        en_autor = Libro.objects.create(titulo='Atlas', autor='Ana Historia', genero='otro')
+        en_titulo = [Libro.objects.create(titulo='Historia de Chile', autor='Autor', genero='otro') for _ in range(3)]
+        cabecera, ids = self._token('lector'), []
+        url = '/api/v1/libros/?buscar=historia&campos=id&tamano=1'
+        while url:
+            datos = self.client.get(url, **cabecera).json()
+            ids.extend(libro['id'] for libro in datos['results'])
+            url = datos['next']
+        self.assertEqual(ids, [libro.id for libro in en_titulo] + [en_autor.id])
+
+    def test_eliminar_informa_que_lo_impide(self):
+        biblio = User.objects.create_user('biblio', 'biblio@example.com', 'Clave123!')
+        PerfilUsuario.objects.create(
+            usuario=biblio, rut='11111111-1', direccion='Calle 1', telefono='912345678', rol='bibliotecario',
+        )
+        cabecera = self._token('biblio')
+        prestado, apartado, libre = Libro.objects.order_by('id')
+        otro = User.objects.create_user('otro', 'otro@example.com', 'Clave123!')
+        devuelto = prestar_libro(otro, apartado.id, 7).prestamo
+        self.assertEqual(reservar(self.lector, apartado.id).estado, RESERVADA)
+        self.client.force_login(otro)
+        self.client.post(reverse('registrar_devolucion'), {'prestamo_id': devuelto.id})
+
+        for libro, motivo in (
+            (prestado, "No se puede eliminar un libro con préstamos activos."),
+            (apartado, "No se puede eliminar un libro con copias apartadas para reservas."),
+        ):
+            respuesta = self.client.delete(f'/api/v1/libros/{libro.id}/', **cabecera)
+            self.assertEqual((respuesta.status_code, respuesta.json()), (400, [motivo]))
+        self.assertEqual(self.client.delete(f'/api/v1/libros/{libre.id}/', **cabecera).status_code, 204)
+        self.assertEqual(Libro.objects.count(), 2)
+
+    def test_mis_prestamos_y_permisos(self):
+        cabecera = self._token('lector')
+        datos = self.client.get('/api/v1/mis-prestamos/?activos=1', **cabecera).json()
+        self.assertEqual(len(datos['results']), 1)
+        self.assertTrue(datos['results'][0]['activo'])
+        self.assertEqual(self.client.get('/api/v1/prestamos/', **cabecera).status_code, 403)
+        respuesta = self.client.post('/api/v1/libros/', {'titulo': 'X', 'autor': 'Y'}, **cabecera)
+        self.assertEqual(respuesta.status_code, 403)
+
+
+class CacheCatalogoTests(TestCase):
+    def test_generacion_cambia_al_modificar_libros(self):
+        calculos = []
+
+        def calcular():
+            calculos.append(1)
+            return list(Libro.objects.values_list('titulo', flat=True))
+
+        self.assertEqual(cache_catalogo.obtener('prueba', {'a': 1}, calcular), [])
+        self.assertEqual(cache_catalogo.obtener('prueba', {'a': 1}, calcular), [])
+        self.assertEqual(len(calculos), 1)
+
+        # TestCase no hace commit: ejecutar los callbacks de on_commit
+        with self.captureOnCommitCallbacks(execute=True):
+            Libro.objects.create(titulo='Ficciones', autor='Borges')
+        self.assertEqual(cache_catalogo.obtener('prueba', {'a': 1}, calcular), ['Ficciones'])
+        self.assertEqual(len(calculos), 2)
+
+
+class BusquedaTests(TestCase):
+    def test_libros_del_orm_quedan_indexados_tras_las_migraciones(self):
+        # Las migraciones que reconstruyen gestion_libro no deben dejar el índice sin triggers
+        libro = Libro.objects.create(titulo='Historia de la eternidad', autor='Jorge Luis Borges')
+        self.assertEqual(list(buscar_libros(Libro.objects.all(), 'historia')), [libro])
+        libro.titulo = 'Ficciones'
+        libro.save()
+        self.assertFalse(buscar_libros(Libro.objects.all(), 'historia').exists())
+        self.assertEqual(list(buscar_libros(Libro.objects.all(), 'ficciones')), [libro])
+
+
+class ImportarLibrosTests(TestCase):
+    def _importar(self, contenido, *opciones):
+        with tempfile.NamedTemporaryFile('w', suffix='.csv', delete=False, encoding='utf-8') as archivo:
+            archivo.write(contenido)
+        self.addCleanup(os.remove, archivo.name)
+        call_command('importar_libros', archivo.name, *opciones, stdout=open(os.devnull, 'w'), stderr=open(os.devnull, 'w'))
+
+    def test_importa_valida_y_deduplica(self):
+        Libro.objects.create(titulo='Rayuela', autor='Julio Cortázar', genero='ficcion')
+        self._importar(
+            'titulo,autor,genero,copias\n'
+            'RAYUELA,julio cortazar,ficcion,\n'
+            'Cien años de soledad,Gabriel García Márquez,Ficción,3\n'
+            'Cien  Años de Soledad,Gabriel Garcia Marquez,,\n'
+            'Cosmos,Carl Sagan,astronomia,\n'
+            'Ulises,James Joyce,,0\n'
+            'Breve historia del tiempo,Stephen Hawking,,\n',
+            '--lote', '1',
+        )
+        self.assertEqual(
+            sorted(Libro.objects.values_list('titulo', 'genero')),
+            [('Breve historia del tiempo', 'otro'), ('Cien años de soledad', 'ficcion'), ('Rayuela', 'ficcion')],
+        )
+        cien = Libro.objects.get(titulo='Cien años de soledad')
+        self.assertEqual((cien.copias_total, cien.copias_disponibles, cien.ejemplares.count()), (3, 3, 3))
+        self.assertEqual(Ejemplar.objects.count(), 5)
+        self.assertEqual(estadisticas.verificar(), [])
+        # Por defecto el índice se mantiene fila a fila
+        self.assertFalse(sincronizacion_suspendida())
+        self.assertEqual(buscar_libros(Libro.objects.all(), 'soledad').count(), 1)
+
+    def test_indice_suspendido_se_restaura(self):
+        self._importar('titulo,autor\nCosmos,Carl Sagan\n', '--suspender-indice')
+        self.assertFalse(sincronizacion_suspendida())
+        self.assertEqual(buscar_libros(Libro.objects.all(), 'cosmos').count(), 1)
+
+        # Una carga suspendida que murió sin restaurar los triggers: la siguiente los repara
+        suspender_sincronizacion()
+        Libro.objects.create(titulo='Rayuela', autor='Julio Cortázar')
+        self.assertTrue(sincronizacion_suspendida())
+        self._importar('titulo,autor\nFicciones,Jorge Luis Borges\n')
+        self.assertFalse(sincronizacion_suspendida())
+        self.assertEqual(buscar_libros(Libro.objects.all(), 'rayuela').count(), 1)
+        Libro.objects.create(titulo='Dune', autor='Frank Herbert')
+        self.assertEqual(buscar_libros(Libro.objects.all(), 'dune').count(), 1)
+
+
+class SembrarTests(TestCase):
+    def _sembrar(self, *opciones):
+        call_command(
+            'sembrar', '--libros', '60', '--usuarios', '25', '--lote', '10', *opciones,
+            stdout=open(os.devnull, 'w'),
+        )
+
+    def test_datos_consistentes_y_reproducibles(self):
+        self._sembrar('--vencidos', '1', '--atrasados', '0.5')
+        self.assertEqual(Libro.objects.count(), 60)
+        self.assertEqual(PerfilUsuario.objects.count(), 25)
+        # Contadores, copias y saldos como si los préstamos se hubieran hecho uno a uno
+        self.assertEqual(estadisticas.verificar(), [])
+        self.assertTrue(all(validar_rut(rut) for rut in PerfilUsuario.objects.values_list('rut', flat=True)))
+        activos = Prestamo.objects.filter(fecha_devolucion_real__isnull=True)
+        self.assertTrue(activos.filter(fecha_devolucion_esperada__lt=timezone.localdate()).exists())
+        self.assertEqual(
+            sorted(activos.values_list('id', flat=True)),
+            sorted(Ejemplar.objects.filter(prestamo_activo__isnull=False).values_list('prestamo_activo', flat=True)),
+        )
+        self.assertTrue(MovimientoMulta.objects.filter(tipo='cargo').exists())
+        self.assertTrue(buscar_libros(Libro.objects.all(), Libro.objects.first().titulo).exists())
+
+        # La misma semilla genera el mismo catálogo
+        titulos = list(Libro.objects.order_by('id').values_list('titulo', flat=True))
+        self._sembrar()
+        self.assertEqual(list(Libro.objects.order_by('id').values_list('titulo', flat=True)[60:]), titulos)
+        self.assertEqual(PerfilUsuario.objects.values('rut').distinct().count(), 50)
+        self.assertEqual(estadisticas.verificar(), [])
+
+
+class AcumularMultasTests(TestCase):
+    def setUp(self):
+        self.usuario = User.objects.create_user(username='lector', password='x')
+        self.hoy = timezone.now().date()
+
+    def _prestamo(self, titulo, dias_vencido, devuelto=False):
+        libro = Libro.objects.create(titulo=titulo, autor='Autor', genero='otro')
+        return Prestamo.objects.create(
+            usuario=self.usuario,
+            libro=libro,
+            fecha_devolucion_esperada=self.hoy - timedelta(days=dias_vencido),
+            fecha_devolucion_real=self.hoy if devuelto else None,
+        )
+
+    def _acumular(self, *opciones):
+        call_command('acumular_multas', *opciones, stdout=open(os.devnull, 'w'))
+
+    def test_acumula_vencidos_una_vez_por_dia(self):
+        vencido = self._prestamo('A', 3)
+        al_dia = self._prestamo('B', -2)
+        devuelto = self._prestamo('C', 5, devuelto=True)
+
+        self._acumular()
+        vencido.refresh_from_db()
+        al_dia.refresh_from_db()
+        devuelto.refresh_from_db()
+        self.assertEqual(vencido.multa_acumulada, Decimal('3000.00'))
+        self.assertEqual(al_dia.multa_acumulada, Decimal('0.00'))
+        self.assertEqual(devuelto.multa_acumulada, Decimal('0.00'))
+
+        ejecucion = EjecucionMultas.objects.get(fecha=self.hoy)
+        self.assertEqual(ejecucion.estado, EjecucionMultas.COMPLETADA)
+        self.assertEqual(ejecucion.prestamos_actualizados, 1)
+        self.assertEqual(ejecucion.total_acumulado, Decimal('3000.00'))
+
+        # Repetirlo el mismo día no vuelve a ejecutar el UPDATE
+        with self.assertNumQueries(1):
+            self._acumular()
+        self.assertEqual(EjecucionMultas.objects.count(), 1)
+
+    def test_reintento_forzado_fallido_conserva_la_ejecucion_completada(self):
+        self._prestamo('A', 3)
+        self._acumular()
+        with mock.patch(
+            'gestion.management.commands.acumular_multas.acumular_multas', side_effect=RuntimeError('sin disco')
+        ):
+            with self.assertRaises(CommandError):
+                self._acumular('--forzar')
+        ejecucion = EjecucionMultas.objects.get(fecha=self.hoy)
+        self.assertEqual(ejecucion.estado, EjecucionMultas.COMPLETADA)
+        self.assertEqual(ejecucion.prestamos_actualizados, 1)
+
+        # Sin una ejecución completada, la fallida sí queda registrada
+        manana = (self.hoy + timedelta(days=1)).isoformat()
+        with mock.patch(
+            'gestion.management.commands.acumular_multas.acumular_multas', side_effect=RuntimeError('sin disco')
+        ):
+            with self.assertRaises(CommandError):
+                self._acumular('--fecha', manana)
+        self.assertEqual(
+            EjecucionMultas.objects.get(fecha=self.hoy + timedelta(days=1)).estado, EjecucionMultas.FALLIDA
+        )
+
+    def test_fecha_de_corte(self):
+        vencido = self._prestamo('A', 3)
+        self._acumular('--fecha', (self.hoy + timedelta(days=2)).isoformat())
+        vencido.refresh_from_db()
+        self.assertEqual(vencido.multa_acumulada, Decimal('5000.00'))
+
+
+class AnotarAtrasoTests(TestCase):
+    def test_coincide_con_calcular_multa(self):
+        usuario = User.objects.create_user(username='lector', password='x')
+        libro = Libro.objects.create(titulo='Rayuela', autor='Julio Cortázar')
+        prestamos = Prestamo.objects.filter(
+            pk=Prestamo.objects.create(usuario=usuario, libro=libro, fecha_devolucion_esperada=date(2024, 1, 1)).pk
+        )
+        # Cruces de mes, de año y un 29 de febrero
+        casos = [
+            (date(2024, 3, 1), date(2024, 2, 27)),
+            (date(2024, 1, 2), date(2023, 12, 30)),
+            (date(2025, 3, 1), date(2025, 2, 28)),
+            (date(2024, 7, 15), date(2024, 7, 15)),
+            (date(2024, 12, 31), date(2024, 1, 1)),
+        ]
+        for hoy, vence in casos:
+            with self.subTest(hoy=hoy, vence=vence):
+                prestamos.update(fecha_devolucion_esperada=vence)
+                anotado = anotar_atraso(prestamos, hoy).get()
+                self.assertEqual((anotado.dias_atraso, anotado.multa_estimada), calcular_multa(vence, hoy))
+
+
+class LibroDeMultasTests(TestCase):
+    def setUp(self):
+        self.usuario = User.objects.create_user('lector', 'lector@example.com', 'Clave123!')
+
+    def _saldo(self):
+        saldo = SaldoMulta.objects.get(usuario=self.usuario)
+        return saldo.saldo, saldo.total_cargado, saldo.total_pagado
+
+    def test_cargo_y_pago_actualizan_saldo_y_totales(self):
+        registrar_cargo(self.usuario, '3000')
+        self.assertEqual(self._saldo(), (Decimal('3000.00'), Decimal('3000.00'), Decimal('0.00')))
+        registrar_pago(self.usuario, '1000')
+        self.assertEqual(self._saldo(), (Decimal('2000.00'), Decimal('3000.00'), Decimal('1000.00')))
+        self.assertEqual(saldo_de(self.usuario), Decimal('2000.00'))
+        estado = Estadisticas.obtener()
+        self.assertEqual((estado.total_multas, estado.saldo_multas), (Decimal('3000.00'), Decimal('2000.00')))
+        self.assertEqual(estadisticas.verificar(), [])
+
+    def test_cargo_fallido_no_deja_saldo_ni_movimiento(self):
+        with mock.patch('gestion.multas.estadisticas.ajustar', side_effect=OperationalError('sin disco')):
+            with self.assertRaises(OperationalError):
+                registrar_cargo(self.usuario, '3000')
+        self.assertFalse(MovimientoMulta.objects.exists())
+        self.assertEqual(saldo_de(self.usuario), Decimal('0.00'))
+
+    def test_pago_mayor_al_saldo_se_rechaza(self):
+        registrar_cargo(self.usuario, '1000')
+        with self.assertRaises(ValueError):
+            registrar_pago(self.usuario, '1500')
+        with self.assertRaises(ValueError):
+            registrar_pago(self.usuario, '0')
+        self.assertEqual(self._saldo(), (Decimal('1000.00'), Decimal('1000.00'), Decimal('0.00')))
+        self.assertEqual(MovimientoMulta.objects.filter(tipo='pago').count(), 0)
+
+        formulario = MovimientoMultaForm(data={'usuario': self.usuario.pk, 'tipo': 'pago', 'monto': '1500'})
+        self.assertFalse(formulario.is_valid())
+        self.assertIn("El pago supera el saldo pendiente del usuario.", formulario.non_field_errors())
+        self.assertTrue(
+            MovimientoMultaForm(data={'usuario': self.usuario.pk, 'tipo': 'pago', 'monto': '1000'}).is_valid()
+        )
+
+    def test_admin_registra_movimientos_por_el_servicio(self):
+        self.client.force_login(User.objects.create_superuser('admin', 'admin@example.com', 'Clave123!'))
+        url = reverse('admin:gestion_movimientomulta_add')
+        self.client.post(url, {'usuario': self.usuario.pk, 'tipo': 'cargo', 'monto': '2500'})
+        respuesta = self.client.post(url, {'usuario': self.usuario.pk, 'tipo': 'pago', 'monto': '4000'})
+        self.assertEqual(respuesta.status_code, 200)
+        self.client.post(url, {'usuario': self.usuario.pk, 'tipo': 'pago', 'monto': '500'})
+        self.assertEqual(self._saldo(), (Decimal('2000.00'), Decimal('2500.00'), Decimal('500.00')))
+        self.assertEqual(MovimientoMulta.objects.count(), 2)
+        self.assertEqual(estadisticas.verificar(), [])
+
+    def test_devolucion_atrasada_registra_un_cargo(self):
+        libro = Libro.objects.create(titulo='Rayuela', autor='Julio Cortázar', genero='ficcion')
+        atrasado = prestar_libro(self.usuario, libro.id, 7).prestamo
+        Prestamo.objects.filter(pk=atrasado.pk).update(
+            fecha_devolucion_esperada=timezone.localdate() - timedelta(days=4)
+        )
+        a_tiempo = prestar_libro(
+            self.usuario, Libro.objects.create(titulo='Ficciones', autor='Borges').id, 7
+        ).prestamo
+        self.client.force_login(self.usuario)
+        self.client.post(reverse('registrar_devolucion'), {'prestamo_id': atrasado.id})
+        self.client.post(reverse('registrar_devolucion'), {'prestamo_id': a_tiempo.id})
+
+        cargo = MovimientoMulta.objects.get()
+        self.assertEqual((cargo.tipo, cargo.monto, cargo.prestamo_id), ('cargo', Decimal('4000.00'), atrasado.id))
+        atrasado.refresh_from_db()
+        self.assertEqual(atrasado.multa, Decimal('4000.00'))
+        self.assertEqual(saldo_de(self.usuario), Decimal('4000.00'))
+        self.assertEqual(estadisticas.verificar(), [])
+
+
+class RecordatoriosTests(TestCase):
+    def setUp(self):
+        self.hoy = timezone.now().date()
+        self.usuario = User.objects.create_user(
+            username='lector', password='x', email='lector@example.com', first_name='Ana'
+        )
+
+    def _prestamo(self, titulo, dias_para_vencer, usuario=None):
+        libro = Libro.objects.create(titulo=titulo, autor='Autor', genero='otro')
+        return Prestamo.objects.create(
+            usuario=usuario or self.usuario,
+            libro=libro,
+            fecha_devolucion_esperada=self.hoy + timedelta(days=dias_para_vencer),
+        )
+
+    def test_envia_una_vez_por_tipo(self):
+        por_vencer = self._prestamo('Por vencer', 1)
+        vencido = self._prestamo('Vencido', -3)
+        self._prestamo('Lejano', 10)
+        sin_correo = User.objects.create_user(username='sincorreo', password='x')
+        self._prestamo('Sin correo', -1, usuario=sin_correo)
+
+        # Una consulta por lote, más la del lote vacío que termina el envío
+        with self.assertNumQueries(5):
+            enviados = enviar_recordatorios(self.hoy, 2, lote=1)
+        self.assertEqual(enviados, 2)
+        self.assertEqual(len(mail.outbox), 2)
+        asuntos = sorted(mensaje.subject for mensaje in mail.outbox)
+        self.assertIn('vence el', asuntos[0])
+        self.assertIn('está vencido', asuntos[1])
+        self.assertEqual(mail.outbox[0].to, ['lector@example.com'])
+        self.assertEqual(
+            set(RecordatorioEnviado.objects.values_list('prestamo_id', 'tipo')),
+            {(por_vencer.id, RecordatorioEnviado.POR_VENCER), (vencido.id, RecordatorioEnviado.VENCIDO)},
+        )
+
+        # Sin duplicados al repetir
+        self.assertEqual(enviar_recordatorios(self.hoy, 2), 0)
+        self.assertEqual(len(mail.outbox), 2)
+
+        # Cuando vence, corresponde el recordatorio de vencido
+        self.assertEqual(enviar_recordatorios(self.hoy + timedelta(days=2), 2), 1)
+
+    def test_maximo_por_ejecucion(self):
+        for numero in range(3):
+            self._prestamo(f'Libro {numero}', -1)
+        self.assertEqual(enviar_recordatorios(self.hoy, 0, maximo=2), 2)
+        self.assertEqual(enviar_recordatorios(self.hoy, 0), 1)
+
+    def test_destinatario_rechazado_no_detiene_el_envio(self):
+        rechazado = User.objects.create_user(username='malo', password='x', email='malo@example.com')
+        # El préstamo del correo rechazado es el primero del orden de envío
+        self._prestamo('Primero', -5, usuario=rechazado)
+        segundo = self._prestamo('Segundo', -3)
+        tercero = self._prestamo('Tercero', -1)
+        conexion = mail.get_connection()
+        enviar = conexion.send_messages
+
+        def send_messages(mensajes):
+            if mensajes[0].to == ['malo@example.com']:
+                raise smtplib.SMTPRecipientsRefused({'malo@example.com': (550, b'No existe')})
+            return enviar(mensajes)
+
+        with mock.patch.object(conexion, 'send_messages', side_effect=send_messages):
+            with self.assertLogs('gestion.recordatorios', 'WARNING'):
+                self.assertEqual(enviar_recordatorios(self.hoy, 0, lote=2, conexion=conexion), 2)
+        self.assertEqual(
+            set(RecordatorioEnviado.objects.values_list('prestamo_id', flat=True)), {segundo.id, tercero.id}
+        )
+        self.assertEqual(len(mail.outbox), 2)
+
+
+class ReservasTests(TestCase):
+    def setUp(self):
+        self.lector = User.objects.create_user('lector', 'lector@example.com', 'Clave123!')
+        self.primero = User.objects.create_user('primero', 'primero@example.com', 'Clave123!')
+        self.segundo = User.objects.create_user('segundo', 'segundo@example.com', 'Clave123!')
+        self.libro = Libro.objects.create(titulo='Rayuela', autor='Julio Cortázar', genero='ficcion')
+
+    def _devolver(self, usuario):
+        prestamo = Prestamo.objects.get(usuario=usuario, libro=self.libro, fecha_devolucion_real__isnull=True)
+        self.client.force_login(usuario)
+        with self.captureOnCommitCallbacks(execute=True):
+            self.client.post(reverse('registrar_devolucion'), {'prestamo_id': prestamo.id})
+
+    def test_cola_fifo_y_retiro(self):
+        self.assertEqual(reservar(self.primero, self.libro.id).estado, HAY_COPIAS)
+        prestar_libro(self.lector, self.libro.id, 7)
+        self.assertEqual(reservar(self.primero, self.libro.id).estado, RESERVADA)
+        self.assertEqual(reservar(self.segundo, self.libro.id).estado, RESERVADA)
+        self.assertEqual(reservar(self.primero, self.libro.id).estado, YA_RESERVADA)
+        self.assertEqual(
+            list(posiciones(Reserva.objects.order_by('id')).values_list('usuario__username', 'posicion')),
+            [('primero', 1), ('segundo', 2)],
+        )
+
+        self._devolver(self.lector)
+        reserva = Reserva.objects.get(usuario=self.primero)
+        self.assertEqual(reserva.estado, Reserva.ASIGNADA)
+        self.assertEqual(reserva.ejemplar.reserva_activa, reserva)
+        self.assertEqual(Libro.objects.get(pk=self.libro.pk).copias_disponibles, 0)
+        self.assertEqual([mensaje.to for mensaje in mail.outbox], [['primero@example.com']])
+
+        # La copia apartada solo la puede retirar quien la reservó
+        self.assertEqual(prestar_libro(self.lector, self.libro.id, 7).estado, NO_DISPONIBLE)
+        self.assertEqual(prestar_libro(self.primero, self.libro.id, 7).estado, PRESTADO)
+        self.assertEqual(Reserva.objects.get(pk=reserva.pk).estado, Reserva.RETIRADA)
+        self.assertEqual(Reserva.objects.get(usuario=self.segundo).estado, Reserva.EN_ESPERA)
+        self.assertEqual(estadisticas.verificar(), [])
+
+    def test_lector_que_ya_tiene_el_libro_no_queda_en_la_cola(self):
+        ajustar_copias(self.libro, 2)
+        prestar_libro(self.lector, self.libro.id, 7)
+        # Reserva hecha mientras volvía una copia a la estantería (la revisión previa no la vio)
+        en_cola = Reserva.objects.create(usuario=self.primero, libro=self.libro)
+        self.assertEqual(prestar_libro(self.primero, self.libro.id, 7).estado, PRESTADO)
+        self.assertEqual(Reserva.objects.get(pk=en_cola.pk).estado, Reserva.CANCELADA)
+
+        # Si igual quedó en la cola (préstamo de kiosco), la copia devuelta pasa al siguiente
+        colado = Reserva.objects.create(usuario=self.primero, libro=self.libro)
+        reservar(self.segundo, self.libro.id)
+        self._devolver(self.lector)
+        self.assertEqual(Reserva.objects.get(pk=colado.pk).estado, Reserva.CANCELADA)
+        self.assertEqual(Reserva.objects.get(usuario=self.segundo).estado, Reserva.ASIGNADA)
+        self.assertEqual(estadisticas.verificar(), [])
+
+    def test_expiracion_pasa_a_la_siguiente_y_luego_a_la_estanteria(self):
+        prestar_libro(self.lector, self.libro.id, 7)
+        reservar(self.primero, self.libro.id)
+        reservar(self.segundo, self.libro.id)
+        self._devolver(self.lector)
+
+        despues = timezone.now() + timedelta(hours=49)
+        self.assertEqual(expirar_reservas(despues), (1, 1))
+        self.assertEqual(Reserva.objects.get(usuario=self.primero).estado, Reserva.EXPIRADA)
+        self.assertEqual(Reserva.objects.get(usuario=self.segundo).estado, Reserva.ASIGNADA)
+        self.assertEqual(expirar_reservas(despues), (0, 0))
+
+        reserva = Reserva.objects.get(usuario=self.segundo)
+        self.assertTrue(cancelar_reserva(self.segundo, reserva.pk))
+        self.assertFalse(cancelar_reserva(self.segundo, reserva.pk))
+        libro = Libro.objects.get(pk=self.libro.pk)
+        self.assertEqual(libro.copias_disponibles, 1)
+        self.assertFalse(libro.ejemplares.filter(reserva_activa__isnull=False).exists())
+        self.assertEqual(estadisticas.verificar(), [])
+
+    def test_devolucion_en_lote_atiende_la_cola(self):
+        prestar_libro(self.lector, self.libro.id, 7)
+        reservar(self.primero, self.libro.id)
+        resultados = procesar_lote([
+            {'clave': 'a', 'tipo': 'devolucion', 'libro_id': self.libro.id},
+            {'clave': 'b', 'tipo': 'prestamo', 'libro_id': self.libro.id, 'usuario_id': self.segundo.id},
+        ])
+        self.assertEqual([r['estado'] for r in resultados], [DEVUELTO, NO_DISPONIBLE])
+        self.assertEqual(Reserva.objects.get(usuario=self.primero).estado, Reserva.ASIGNADA)
+
+        resultados = procesar_lote([
+            {'clave': 'c', 'tipo': 'prestamo', 'libro_id': self.libro.id, 'usuario_id': self.primero.id},
+        ])
+        self.assertEqual(resultados[0]['estado'], PRESTADO)
+        self.assertEqual(Reserva.objects.get(usuario=self.primero).estado, Reserva.RETIRADA)
+        self.assertEqual(estadisticas.verificar(), [])
+
+
+class VistasAsyncTests(TestCase):
+    @classmethod
+    def setUpTestData(cls):
+        cls.lector = User.objects.create_user('lector', 'lector@example.com', 'Clave123!')
+        for i in range(3):
+            Libro.objects.create(titulo=f'Libro {i}', autor='Autor', genero='ciencia')
+        prestar_libro(cls.lector, Libro.objects.get(titulo='Libro 0').id, 7)
+
+    def test_son_vistas_async(self):
+        from asgiref.sync import iscoroutinefunction
+        from cuentas.views import panel_usuario
+        from .views import disponibilidad_libros, registrar_prestamo
+
+        for vista in (disponibilidad_libros, registrar_prestamo, panel_usuario):
+            self.assertTrue(iscoroutinefunction(vista), vista.__name__)
+
+    async def test_listados_bajo_asgi(self):
+        rutas = [reverse('disponibilidad_libros'), reverse('registrar_prestamo'), reverse('panel_usuario')]
+        for ruta in rutas:
+            self.assertEqual((await self.async_client.get(ruta)).status_code, 403)
+
+        await self.async_client.aforce_login(self.lector)
+        respuesta = await self.async_client.get(rutas[0])
+        self.assertEqual((respuesta.context['total_libros'], respuesta.context['libros_prestados']), (3, 1))
+        respuesta = await self.async_client.get(rutas[1])
+        self.assertEqual(respuesta.context['total_disponibles'], 2)
+        self.assertEqual(respuesta.context['reservas_listas'], [])
+        respuesta = await self.async_client.get(rutas[2])
+        self.assertEqual(respuesta.context['total_prestamos_activos'], 1)
+        self.assertEqual(respuesta.context['saldo_multas'], Decimal('0.00'))
+
+    def test_prestamo_por_post_sigue_funcionando(self):
+        self.client.force_login(self.lector)
+        libro = Libro.objects.get(titulo='Libro 1')
+        respuesta = self.client.post(reverse('registrar_prestamo'), {'libro_id': libro.id})
+        self.assertRedirects(respuesta, reverse('dashboard'), fetch_redirect_response=False)
+        self.assertTrue(Prestamo.objects.filter(usuario=self.lector, libro=libro).exists())
+
+
+def sembrar_biblioteca(lectores=8, libros=24):
+    """
+    Datos con volumen realista para medir consultas: personal y lectores con
+    perfil, libros con varias copias, préstamos al día, vencidos y devueltos
+    con multa, y reservas en espera. Con varias filas en cada listado un N+1
+    aparece como consultas duplicadas. Retorna los usuarios por nombre.
+    """
+    hoy = timezone.localdate()
+    roles = [('admin', 'administrador'), ('biblio', 'bibliotecario')]
+    roles += [(f'lector{i}', 'lector') for i in range(lectores)]
+    usuarios = {}
+    for indice, (nombre, rol) in enumerate(roles):
+        usuario = User.objects.create_user(nombre, f'{nombre}@example.com', 'Clave123!')
+        numero = 15000000 + indice * 7919
+        PerfilUsuario.objects.create(
+            usuario=usuario, rut=f'{numero}-{digito_verificador(numero)}',
+            direccion=f'Calle {indice}', telefono='912345678', rol=rol,
+        )
+        usuarios[nombre] = usuario
+
+    generos = [codigo for codigo, _ in Libro.GENEROS]
+    catalogo = [
+        Libro.objects.create(
+            titulo=f'Libro {i:02d}', autor=f'Autor {i % 5}',
+            genero=generos[i % len(generos)], copias_total=1 + i % 3,
+        )
+        for i in range(libros)
+    ]
+
+    cliente = Client()
+    for i in range(lectores):
+        lector = usuarios[f'lector{i}']
+        prestamos = [
+            prestar_libro(lector, catalogo[(i * 3 + j) % libros].id, 7).prestamo for j in range(3)
+        ]
+        # Uno vencido hace i + 1 días y otro devuelto con atraso (multa); el tercero al día
+        Prestamo.objects.filter(pk=prestamos[0].pk).update(
+            fecha_devolucion_esperada=hoy - timedelta(days=i + 1)
+        )
+        Prestamo.objects.filter(pk=prestamos[1].pk).update(
+            fecha_devolucion_esperada=hoy - timedelta(days=2)
+        )
+        cliente.force_login(lector)
+        cliente.post(reverse('registrar_devolucion'), {'prestamo_id': prestamos[1].pk})
+
+    # Libros sin copias libres con lectores en espera
+    for libro in Libro.objects.filter(copias_disponibles=0)[:4]:
+        for i in range(lectores):
+            reservar(usuarios[f'lector{i}'], libro.id)
+    cache.clear()
+    return usuarios
+
+
+class PresupuestoConsultasTests(TestCase):
+    """Cada URL de gestion/urls.py y cuentas/urls.py, con cada rol, dentro de su presupuesto"""
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.usuarios = sembrar_biblioteca()
+
+    def _urls(self):
+        argumentos = {'user_id': self.usuarios['lector1'].pk, 'rol': 'lector'}
+        vistos = set()
+        for modulo in (gestion_urls, cuentas_urls):
+            for patron in modulo.urlpatterns:
+                if not isinstance(patron, URLPattern) or patron.name in vistos:
+                    continue
+                vistos.add(patron.name)
+                kwargs = {nombre: argumentos[nombre] for nombre in patron.pattern.converters}
+                yield patron.name, reverse(patron.name, kwargs=kwargs)
+
+    def _medir(self, usuario, url):
+        """Consultas de un GET (con caché vacía); lo que la vista escriba se deshace"""
+        cliente = Client()
+        cliente.force_login(usuario)
+        cache.clear()
+        with transaction.atomic():
+            with CaptureQueriesContext(connection) as consultas:
+                respuesta = cliente.get(url)
+                if respuesta.streaming:
+                    b''.join(respuesta.streaming_content)
+            transaction.set_rollback(True)
+        return resumir([(consulta['sql'], float(consulta['time'])) for consulta in consultas.captured_queries])
+
+    def test_cada_url_dentro_del_presupuesto(self):
+        for nombre, url in self._urls():
+            for rol in ('admin', 'biblio', 'lector0'):
+                resumen = self._medir(self.usuarios[rol], url)
+                # Solo cantidad y duplicadas: el tiempo depende de la máquina (lo avisa el middleware)
+                presupuesto = {**presupuesto_de(nombre), 'milisegundos': float('inf')}
+                with self.subTest(url=url, rol=rol):
+                    self.assertEqual(excesos(resumen, presupuesto), [], resumen.mas_repetida)
+
+    @override_settings(DEBUG=True, PRESUPUESTO_CONSULTAS_VISTAS={'disponibilidad_libros': {'consultas': 1}})
+    def test_middleware_avisa_y_agrega_cabecera(self):
+        self.client.force_login(self.usuarios['lector0'])
+        with self.assertLogs('gestion.presupuesto', 'WARNING') as avisos:
+            respuesta = self.client.get(reverse('disponibilidad_libros'))
+        self.assertRegex(respuesta['X-Consultas-SQL'], r'^\d+ consultas; [\d.]+ ms; \d+ duplicadas$')
+        self.assertIn('disponibilidad_libros', avisos.output[0])
@@ -10,9 +10,14 @@ urlpatterns = [
     path('prestamo/', views.registrar_prestamo, name='registrar_prestamo'),
     path('devolucion/', views.registrar_devolucion, name='registrar_devolucion'),
     path('disponibilidad/', views.disponibilidad_libros, name='disponibilidad_libros'),
+    path('reservas/nueva/', views.reservar_libro, name='reservar_libro'),
+    path('reservas/cancelar/', views.cancelar_reserva, name='cancelar_reserva'),
     
     # Gestión de libros (Bibliotecarios)
     path('gestionar-libros/', views.gestionar_libros, name='gestionar_libros'),
     path("prestamos/activos/", views.prestamos_activos, name="prestamos_activos"),
+    
+    # Kioscos de autoservicio (lotes de préstamos y devoluciones)
+    path("circulacion/lote/", views.sincronizar_kiosco, name="sincronizar_kiosco"),
 
 ]
\ No newline at end of file
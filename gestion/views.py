@@ -1,11 +1,24 @@
 from django.shortcuts import render, redirect, get_object_or_404
-from cuentas.restringir import login_exigido
+from cuentas.restringir import PERSONAL, login_exigido, perfil_de, tiene_rol
 from django.contrib import messages
 from django.utils import timezone
-from datetime import timedelta, datetime
-from decimal import Decimal
-from .models import Libro, Prestamo
-from django.db.models import Q, Count
+from .models import ConteoGenero, Estadisticas, Libro, Prestamo, Reserva
+from .busqueda import buscar_libros
+from .paginacion import apaginar, paginar
+from .replica import leer_de_replica
+from . import cache_catalogo, estadisticas, reservas
+from .multas import calcular_multa, registrar_cargo
+from .circulacion import (
+    MAX_OPERACIONES_LOTE, NO_EXISTE, YA_LO_TIENE, ConflictoLote, ajustar_copias, liberar_ejemplar, prestar_libro, procesar_lote,
+)
+from django.db.models import Q, Count, Sum
+from django.db import IntegrityError, OperationalError, transaction
+from django.core.exceptions import PermissionDenied
+from django.http import JsonResponse
+from django.views.decorators.http import require_POST
+from asgiref.sync import sync_to_async
+import asyncio
+import json
 
 def home(request):
     """Vista de inicio/home - redirige a index"""
@@ -13,9 +26,7 @@ def home(request):
 
 @login_exigido
 def dashboard(request):
-    perfil = None
-    if hasattr(request.user, 'perfil'):
-        perfil = request.user.perfil
+    perfil = perfil_de(request.user)
 
     context = {
         'usuario': request.user,
@@ -26,21 +37,21 @@ def dashboard(request):
         if perfil.rol == 'administrador':
             fecha_actual = timezone.now().date()
 
-            total_libros = Libro.objects.count()
-            prestamos_activos = Prestamo.objects.filter(
-                fecha_devolucion_real__isnull=True
-            ).count()
+            # Contadores mantenidos por señales: una sola fila
+            stats = Estadisticas.obtener()
+            # Los vencidos dependen de la fecha: conteo sobre el índice parcial de activos
             prestamos_vencidos = Prestamo.objects.filter(
                 fecha_devolucion_real__isnull=True,
                 fecha_devolucion_esperada__lt=fecha_actual
             ).count()
-            generos_diferentes = Libro.objects.values('genero').distinct().count()
+            generos_diferentes = ConteoGenero.objects.filter(total__gt=0).count()
 
             context.update({
-                "total_libros": total_libros,
-                "prestamos_activos": prestamos_activos,
+                "total_libros": stats.total_libros,
+                "prestamos_activos": stats.prestamos_activos,
                 "prestamos_vencidos": prestamos_vencidos,
                 "generos_diferentes": generos_diferentes,
+                "cache_catalogo": cache_catalogo.estadisticas(),
             })
 
             return render(request, 'dashboard_admin.html', context)
@@ -60,8 +71,17 @@ def dashboard(request):
                 prestamo.dias_restantes = dias_restantes
                 prestamo.esta_vencido = dias_restantes < 0
                 prestamo.dias_restantes_abs = abs(dias_restantes)
+                # La acumula el proceso nocturno; si aún no corrió para este préstamo, se calcula
+                prestamo.multa_vigente = prestamo.multa_acumulada or calcular_multa(
+                    prestamo.fecha_devolucion_esperada, fecha_actual
+                )[1]
 
             context['mis_prestamos'] = mis_prestamos
+            context['mis_reservas'] = reservas.posiciones(
+                Reserva.objects.filter(
+                    usuario=request.user, estado__in=Reserva.ACTIVAS
+                ).select_related('libro').order_by('fecha')
+            )
             return render(request, 'dashboard_lector.html', context)
 
     # fallback de seguridad
@@ -69,97 +89,78 @@ def dashboard(request):
 
 
 @login_exigido
-def registrar_prestamo(request):
+async def registrar_prestamo(request):
     """
     Funcionalidad 1: Registro de Préstamo con filtro de búsqueda
     - Muestra SOLO libros disponibles
     - Valida que el libro esté disponible antes de prestar
-    - Cambia el estado del libro a "Prestado"
+    - Cambia el estado del libro a "Prestado" (atómico, ver gestion/circulacion.py)
+    El listado (GET) es async; el préstamo (POST) corre en el hilo síncrono.
     """
     if request.method == 'POST':
-        libro_id = request.POST.get('libro_id')
-        dias_prestamo = int(request.POST.get('dias_prestamo', 7))
-        
-        # VALIDACIÓN 1: Verificar que el libro existe
-        try:
-            libro = Libro.objects.get(id=libro_id)
-        except Libro.DoesNotExist:
-            messages.error(request, 'El libro seleccionado no existe.')
-            return redirect('registrar_prestamo')
-        
-        # VALIDACIÓN 2: Verificar que el libro está disponible
-        if not libro.disponible:
-            messages.error(request, f'Lo sentimos, el libro "{libro.titulo}" ya está prestado y no está disponible en este momento.')
-            return redirect('registrar_prestamo')
-        
-        # VALIDACIÓN 3: Verificar que no hay préstamos activos de este libro
-        prestamo_activo = Prestamo.objects.filter(
-            libro=libro,
-            fecha_devolucion_real__isnull=True
-        ).exists()
-        
-        if prestamo_activo:
-            messages.error(request, f'El libro "{libro.titulo}" tiene un préstamo activo. No se puede prestar hasta que sea devuelto.')
-            return redirect('registrar_prestamo')
-        
-        # VALIDACIÓN 4: Verificar que el usuario no tiene este libro prestado
-        usuario_tiene_libro = Prestamo.objects.filter(
-            usuario=request.user,
-            libro=libro,
-            fecha_devolucion_real__isnull=True
-        ).exists()
-        
-        if usuario_tiene_libro:
-            messages.error(request, f'Ya tienes el libro "{libro.titulo}" en préstamo. Debes devolverlo antes de solicitarlo nuevamente.')
-            return redirect('registrar_prestamo')
-        
-        # Todas las validaciones pasaron: Crear el préstamo
-        fecha_devolucion_esperada = timezone.now().date() + timedelta(days=dias_prestamo)
-        
-        Prestamo.objects.create(
-            usuario=request.user,
-            libro=libro,
-            fecha_devolucion_esperada=fecha_devolucion_esperada
-        )
-        
-        # Control de Disponibilidad: Cambiar estado del libro a NO disponible
-        libro.disponible = False
-        libro.save()
-        
-        messages.success(request, f'Préstamo registrado exitosamente. Libro: "{libro.titulo}". Debes devolver antes del {fecha_devolucion_esperada.strftime("%d/%m/%Y")}')
-        return redirect('dashboard')
+        return await sync_to_async(_solicitar_prestamo)(request)
     
     # Mostrar SOLO libros disponibles
     busqueda = request.GET.get('buscar', '')
     
-    # Filtro base: Solo libros con disponible=True Y sin préstamos activos
-    libros_disponibles = Libro.objects.filter(disponible=True)
-    
-    # Excluir libros con préstamos activos (doble validación)
-    libros_con_prestamos_activos = Prestamo.objects.filter(
-        fecha_devolucion_real__isnull=True
-    ).values_list('libro_id', flat=True)
-    
-    libros_disponibles = libros_disponibles.exclude(id__in=libros_con_prestamos_activos)
+    # Solo libros con alguna copia libre: lee el contador (índice parcial libro_disponible_titulo_idx)
+    libros_disponibles = Libro.objects.filter(copias_disponibles__gt=0)
     
     # Aplicar búsqueda si existe
     if busqueda:
-        libros_disponibles = libros_disponibles.filter(
-            Q(titulo__icontains=busqueda) |
-            Q(autor__icontains=busqueda) |
-            Q(genero__icontains=busqueda)
+        libros_disponibles = buscar_libros(libros_disponibles, busqueda)
+    
+    async def consultar():
+        # Contar total de libros disponibles y leer la página, a la vez
+        return await asyncio.gather(
+            libros_disponibles.acount(),
+            apaginar(request, libros_disponibles, ('relevancia',) if busqueda else ('titulo',)),
         )
     
-    # Contar total de libros disponibles
-    total_disponibles = libros_disponibles.count()
+    async def consultar_reservas():
+        # Copias apartadas para el lector por sus reservas (no figuran entre los disponibles)
+        return [reserva async for reserva in Reserva.objects.filter(
+            usuario=request.user, estado=Reserva.ASIGNADA, expira__gt=timezone.now()
+        ).select_related('libro').aiterator()]
+    
+    # Listado en caché hasta el próximo cambio de Libro/Prestamo; las reservas son del lector
+    (total_disponibles, pagina), reservas_listas = await asyncio.gather(
+        cache_catalogo.aobtener('prestamo', request.GET, consultar),
+        consultar_reservas(),
+    )
     
     context = {
-        'libros': libros_disponibles,
+        'libros': pagina,
+        'pagina': pagina,
         'busqueda': busqueda,
         'total_disponibles': total_disponibles,
+        'reservas_listas': reservas_listas,
     }
     return render(request, 'registrar_prestamo.html', context)
 
+
+def _solicitar_prestamo(request):
+    libro_id = request.POST.get('libro_id')
+    dias_prestamo = int(request.POST.get('dias_prestamo', 7))
+    
+    resultado = prestar_libro(request.user, libro_id, dias_prestamo)
+    
+    if resultado.estado == NO_EXISTE:
+        messages.error(request, 'El libro seleccionado no existe.')
+        return redirect('registrar_prestamo')
+    
+    if resultado.estado == YA_LO_TIENE:
+        messages.error(request, f'Ya tienes el libro "{resultado.titulo}" en préstamo. Debes devolverlo antes de solicitarlo nuevamente.')
+        return redirect('registrar_prestamo')
+    
+    if not resultado.ok:
+        messages.error(request, f'Lo sentimos, el libro "{resultado.titulo}" ya está prestado y no está disponible en este momento. Puedes reservarlo desde el catálogo.')
+        return redirect('registrar_prestamo')
+    
+    fecha_devolucion_esperada = resultado.prestamo.fecha_devolucion_esperada
+    messages.success(request, f'Préstamo registrado exitosamente. Libro: "{resultado.titulo}". Debes devolver antes del {fecha_devolucion_esperada.strftime("%d/%m/%Y")}')
+    return redirect('dashboard')
+
 @login_exigido
 def registrar_devolucion(request):
     """
@@ -182,27 +183,40 @@ def registrar_devolucion(request):
             messages.error(request, 'Préstamo no válido o ya devuelto.')
             return redirect('registrar_devolucion')
         
-        # Registrar fecha de devolución real
-        fecha_devolucion_real = timezone.now().date()
-        prestamo.fecha_devolucion_real = fecha_devolucion_real
-        
-        # CÁLCULO DE MULTA AUTOMÁTICO - $1000 POR DÍA
-        if fecha_devolucion_real > prestamo.fecha_devolucion_esperada:
-            dias_atraso = (fecha_devolucion_real - prestamo.fecha_devolucion_esperada).days
-            multa_por_dia = Decimal('1000.00')  # $1000 por día de atraso
-            prestamo.multa = multa_por_dia * dias_atraso
+        with transaction.atomic():
+            # Registrar fecha de devolución real
+            fecha_devolucion_real = timezone.now().date()
             
-            messages.warning(request, f'Devolución con atraso de {dias_atraso} días. Multa: ${prestamo.multa}')
-        else:
-            prestamo.multa = Decimal('0.00')
-            messages.success(request, 'Devolución a tiempo. Sin multa.')
-        
-        prestamo.save()
-        
-        # Control de Disponibilidad: Devolver libro a estado DISPONIBLE
-        libro = prestamo.libro
-        libro.disponible = True
-        libro.save()
+            # CÁLCULO DE MULTA AUTOMÁTICO - $1000 POR DÍA
+            dias_atraso, multa = calcular_multa(
+                prestamo.fecha_devolucion_esperada, fecha_devolucion_real
+            )
+            # UPDATE condicional: si otra petición (doble envío, kiosco) ya lo devolvió,
+            # no se cobra la multa ni se descuentan los contadores otra vez
+            devuelto = Prestamo.objects.filter(
+                pk=prestamo.pk, usuario=request.user, fecha_devolucion_real__isnull=True
+            ).update(fecha_devolucion_real=fecha_devolucion_real, multa=multa)
+            if not devuelto:
+                messages.error(request, 'Préstamo no válido o ya devuelto.')
+                return redirect('registrar_devolucion')
+            prestamo.fecha_devolucion_real, prestamo.multa = fecha_devolucion_real, multa
+            # update() no dispara señales: ajustar contadores y caché aquí
+            estadisticas.ajustar(prestamos_activos=-1)
+            transaction.on_commit(cache_catalogo.invalidar)
+            
+            if prestamo.multa > 0:
+                # Cargo en el libro de multas: actualiza saldo del usuario y totales
+                registrar_cargo(
+                    request.user, prestamo.multa, prestamo=prestamo,
+                    descripcion=f'Atraso de {dias_atraso} días'
+                )
+                messages.warning(request, f'Devolución con atraso de {dias_atraso} días. Multa: ${prestamo.multa}')
+            else:
+                messages.success(request, 'Devolución a tiempo. Sin multa.')
+            
+            # Control de Disponibilidad: la copia pasa a la primera reserva en espera
+            # o vuelve a estar DISPONIBLE
+            liberar_ejemplar(prestamo)
         
         return redirect('registrar_devolucion')
     
@@ -218,7 +232,7 @@ def registrar_devolucion(request):
     return render(request, 'registrar_devolucion.html', context)
 
 @login_exigido
-def disponibilidad_libros(request):
+async def disponibilidad_libros(request):
     """
     Funcionalidad 3: Consulta de Disponibilidad con filtro de búsqueda
     - Muestra todos los libros con su estado
@@ -230,28 +244,84 @@ def disponibilidad_libros(request):
     libros = Libro.objects.all()
     
     if busqueda:
-        libros = libros.filter(
-            Q(titulo__icontains=busqueda) |
-            Q(autor__icontains=busqueda) |
-            Q(genero__icontains=busqueda)
+        libros = buscar_libros(libros, busqueda)
+    
+    async def consultar():
+        # Estadísticas (una sola consulta) y página, a la vez
+        return await asyncio.gather(
+            libros.aaggregate(
+                total=Count('id'),
+                disponibles=Count('id', filter=Q(copias_disponibles__gt=0)),
+                copias=Sum('copias_total', default=0),
+                copias_disponibles=Sum('copias_disponibles', default=0),
+            ),
+            apaginar(request, libros, ('relevancia',) if busqueda else ('titulo',)),
         )
     
-    # Contar estadísticas
-    total_libros = libros.count()
-    libros_disponibles = libros.filter(disponible=True).count()
-    libros_prestados = libros.filter(disponible=False).count()
+    # Resultado en caché hasta el próximo cambio de Libro/Prestamo
+    conteo, pagina = await cache_catalogo.aobtener('disponibilidad', request.GET, consultar)
+    total_libros = conteo['total']
+    libros_disponibles = conteo['disponibles']
+    libros_prestados = total_libros - libros_disponibles
     
     context = {
-        'libros': libros,
+        'libros': pagina,
+        'pagina': pagina,
         'total_libros': total_libros,
         'libros_disponibles': libros_disponibles,
         'libros_prestados': libros_prestados,
+        'copias': conteo['copias'],
+        'copias_disponibles': conteo['copias_disponibles'],
         'busqueda': busqueda
     }
     return render(request, 'disponibilidad_libros.html', context)
 
+# ==================== RESERVAS ====================
+
+@login_exigido
+@require_POST
+def reservar_libro(request):
+    """Pone al lector en la lista de espera de un libro sin copias disponibles"""
+    resultado = reservas.reservar(request.user, request.POST.get('libro_id'))
+
+    if resultado.estado == reservas.NO_EXISTE:
+        messages.error(request, 'El libro seleccionado no existe.')
+    elif resultado.estado == reservas.HAY_COPIAS:
+        messages.info(request, f'El libro "{resultado.titulo}" tiene copias disponibles: puedes solicitarlo directamente.')
+        return redirect('registrar_prestamo')
+    elif resultado.estado == reservas.TIENE_EL_LIBRO:
+        messages.error(request, f'Ya tienes el libro "{resultado.titulo}" en préstamo.')
+    elif resultado.estado == reservas.YA_RESERVADA:
+        messages.warning(request, f'Ya tienes una reserva para "{resultado.titulo}".')
+    else:
+        messages.success(request, f'Reserva registrada para "{resultado.titulo}". Te avisaremos por correo cuando haya una copia apartada para ti.')
+        return redirect('dashboard')
+    return redirect('disponibilidad_libros')
+
+
+@login_exigido
+@require_POST
+def cancelar_reserva(request):
+    if reservas.cancelar_reserva(request.user, request.POST.get('reserva_id')):
+        messages.success(request, 'Reserva cancelada.')
+    else:
+        messages.error(request, 'Reserva no válida o ya finalizada.')
+    return redirect('dashboard')
+
 # ==================== GESTIÓN DE LIBROS (BIBLIOTECARIOS) ====================
 
+MAX_COPIAS = 500
+
+
+def _copias(request, por_defecto=1):
+    """Cantidad de copias del formulario; None si no es válida"""
+    try:
+        copias = int(request.POST.get('copias') or por_defecto)
+    except ValueError:
+        return None
+    return copias if 1 <= copias <= MAX_COPIAS else None
+
+
 @login_exigido
 def gestionar_libros(request):
     """
@@ -263,7 +333,7 @@ def gestionar_libros(request):
     """
 
     # Verificar permisos: solo bibliotecario
-    if not hasattr(request.user, 'perfil') or request.user.perfil.rol != 'bibliotecario':
+    if not tiene_rol(request.user, 'bibliotecario'):
         messages.error(request, 'No tienes permisos para acceder a esta sección.')
         return redirect('dashboard')
     
@@ -275,17 +345,20 @@ def gestionar_libros(request):
         titulo = request.POST.get('titulo')
         autor = request.POST.get('autor')
         genero = request.POST.get('genero')
-        disponible = request.POST.get('disponible') == 'on'
+        copias = _copias(request)
         
         if not titulo or not autor:
             messages.error(request, 'El título y el autor son obligatorios.')
+        elif copias is None:
+            messages.error(request, 'La cantidad de copias debe ser un número entre 1 y 500.')
         else:
-            Libro.objects.create(
-                titulo=titulo,
-                autor=autor,
-                genero=genero,
-                disponible=disponible
-            )
+            with transaction.atomic():
+                Libro.objects.create(
+                    titulo=titulo,
+                    autor=autor,
+                    genero=genero,
+                    copias_total=copias
+                )
             messages.success(request, f'Libro "{titulo}" agregado exitosamente.')
             return redirect('gestionar_libros')
     
@@ -297,9 +370,17 @@ def gestionar_libros(request):
         libro.titulo = request.POST.get('titulo')
         libro.autor = request.POST.get('autor')
         libro.genero = request.POST.get('genero')
-        libro.disponible = request.POST.get('disponible') == 'on'
-        libro.save()
+        copias = _copias(request, libro.copias_total)
+        if copias is None:
+            messages.error(request, 'La cantidad de copias debe ser un número entre 1 y 500.')
+            return redirect(f"{request.path}?editar={libro.id}")
+        with transaction.atomic():
+            libro.save()
         
+        if not ajustar_copias(libro, copias):
+            prestadas = libro.copias_total - libro.copias_disponibles
+            messages.error(request, f'No se pueden retirar copias prestadas: "{libro.titulo}" tiene {prestadas} en préstamo.')
+            return redirect(f"{request.path}?editar={libro.id}")
         messages.success(request, f'Libro "{libro.titulo}" actualizado exitosamente.')
         return redirect('gestionar_libros')
     
@@ -327,16 +408,19 @@ def gestionar_libros(request):
     
     # LISTAR LIBROS CON BÚSQUEDA
     busqueda = request.GET.get('buscar', '')
-    libros = Libro.objects.all().order_by('titulo')
+    libros = Libro.objects.all()
     
     if busqueda:
-        libros = libros.filter(
-            Q(titulo__icontains=busqueda) |
-            Q(autor__icontains=busqueda)
-        )
+        libros = buscar_libros(libros, busqueda)
+    
+    pagina = cache_catalogo.obtener(
+        'gestion', request.GET,
+        lambda: paginar(request, libros, ('relevancia',) if busqueda else ('titulo',))
+    )
     
     context = {
-        'libros': libros,
+        'libros': pagina,
+        'pagina': pagina,
         'busqueda': busqueda,
         'generos': Libro.GENEROS,
         'libro_editar': libro_editar,  # Para mostrar el formulario de edición
@@ -344,8 +428,9 @@ def gestionar_libros(request):
     return render(request, 'gestionar_libros.html', context)
 
 @login_exigido
+@leer_de_replica
 def prestamos_activos(request):
-    if not hasattr(request.user, "perfil") or request.user.perfil.rol not in ["bibliotecario", "administrador"]:
+    if not tiene_rol(request.user, *PERSONAL):
         messages.error(request, "No tienes permisos para acceder a esta sección.")
         return redirect("dashboard")
 
@@ -355,8 +440,46 @@ def prestamos_activos(request):
         "usuario__perfil"
     ).filter(
         fecha_devolucion_real__isnull=True
-    ).order_by("fecha_prestamo")
+    )
+
+    pagina = paginar(request, prestamos, ("fecha_prestamo",))
 
     return render(request, "prestamos_activos.html", {
-        "prestamos": prestamos
-    })
\ No newline at end of file
+        "prestamos": pagina,
+        "pagina": pagina,
+    })
+
+# ==================== KIOSCOS DE AUTOSERVICIO ====================
+
+@login_exigido
+@require_POST
+def sincronizar_kiosco(request):
+    """
+    Recibe en un solo POST (JSON) las operaciones encoladas por un kiosco:
+    {"operaciones": [{"clave": "...", "tipo": "prestamo", "libro_id": 1, "usuario_id": 2, "dias": 7},
+                     {"clave": "...", "tipo": "devolucion", "libro_id": 3}]}
+    Responde un resultado por operación; las claves ya aplicadas no se repiten.
+    """
+    if not tiene_rol(request.user, *PERSONAL):
+        raise PermissionDenied
+
+    try:
+        operaciones = json.loads(request.body)["operaciones"]
+    except (ValueError, KeyError, TypeError):
+        return JsonResponse({"error": "Se esperaba un JSON con la lista 'operaciones'."}, status=400)
+    if not isinstance(operaciones, list):
+        return JsonResponse({"error": "'operaciones' debe ser una lista."}, status=400)
+    if len(operaciones) > MAX_OPERACIONES_LOTE:
+        return JsonResponse({"error": f"Máximo {MAX_OPERACIONES_LOTE} operaciones por lote."}, status=400)
+
+    try:
+        resultados = procesar_lote(operaciones)
+    except (ConflictoLote, IntegrityError, OperationalError) as error:
+        # Con BEGIN diferido de SQLite, la escritura de otra transacción produce
+        # "database is locked"; cualquier otro OperationalError es una falla real
+        if isinstance(error, OperationalError) and 'locked' not in str(error):
+            raise
+        # Nada se aplicó: el kiosco puede reenviar el mismo lote con las mismas claves
+        return JsonResponse({"error": "Conflicto con otra operación simultánea, reintente."}, status=409)
+
+    return JsonResponse({"resultados": resultados})